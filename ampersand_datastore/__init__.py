@@ -1,5 +1,28 @@
 __version__ = "0.5.5"
 
-from ampersand_datastore.postgres import Postgres
-from ampersand_datastore.snowflake import Snowflake
-from ampersand_datastore.bigquery import BigQuery
\ No newline at end of file
+## resolved on first access so importing the package doesn't import every connector
+LAZY_ATTRIBUTES = {
+    'register_connector': 'ampersand_datastore.registry',
+    'get_connector': 'ampersand_datastore.registry',
+    'Postgres': 'ampersand_datastore.postgres',
+    'Snowflake': 'ampersand_datastore.snowflake',
+    'BigQuery': 'ampersand_datastore.bigquery',
+    'fan_out': 'ampersand_datastore.fanout',
+    'Destination': 'ampersand_datastore.fanout',
+    'RowHashIndex': 'ampersand_datastore.delta',
+    'LoadJournal': 'ampersand_datastore.journal',
+    'LoadMetrics': 'ampersand_datastore.metrics',
+}
+
+__all__ = list(LAZY_ATTRIBUTES)
+
+def __getattr__(name):
+    if name in LAZY_ATTRIBUTES:
+        import importlib
+        value = getattr(importlib.import_module(LAZY_ATTRIBUTES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_ATTRIBUTES))
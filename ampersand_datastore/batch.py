@@ -0,0 +1,83 @@
+'''Group several loads on one connection into a single transaction.'''
+
+class LoadBatch(object):
+    '''
+    Returned by Database.load_batch. Every load run inside the with block
+    shares one transaction that is committed once when the block exits, or
+    rolled back as a whole if anything in it fails:
+
+        with sf.load_batch() as batch:
+            batch.upsert(orders, 'orders', 'sales', ['order_id'])
+            batch.upsert(order_lines, 'order_lines', 'sales', ['order_id', 'line'])
+
+    Connectors that can't hold everything in one open transaction (Snowflake
+    commits on every DDL statement) load into staging tables first and defer
+    the statements that touch the targets to commit time; see defer.
+
+    Inside a batch, failed loads raise instead of returning their exception,
+    so the rest of the block doesn't run.
+    '''
+    def __init__(self, database):
+        self.database = database
+        self.statements = []
+        self.temp_tables = []
+        self.deltas = []
+        self.created = []
+        self.operations = 0
+
+    def __enter__(self):
+        if self.database.batch is not None:
+            raise ValueError("A load batch is already open on this connection; batches don't nest.")
+        self.database.batch = self
+        return self
+
+    def defer(self, statement: str, temp_table=None, schema=None):
+        '''Run statement in the batch's transaction at commit time, then drop temp_table if given.'''
+        self.statements.append(statement)
+        if temp_table is not None:
+            self.temp_tables.append((temp_table, schema))
+
+    def run(self, operation: str, target: object, target_table: str, schema: str, primary_key_list: list, **options):
+        '''Stage target and run one of the connector's load methods on it as part of the batch.'''
+        self.database.stage_object(target, target_table)
+        result = getattr(self.database, operation)(target_table, schema, primary_key_list, **options)
+        if isinstance(result, Exception):
+            raise result
+        self.operations += 1
+        return result
+
+    def upsert(self, target, target_table, schema, primary_key_list, **options):
+        return self.run('upsert_object', target, target_table, schema, primary_key_list, **options)
+
+    def append(self, target, target_table, schema, primary_key_list, **options):
+        return self.run('append_object', target, target_table, schema, primary_key_list, **options)
+
+    def __exit__(self, exc_type, exc, tb):
+        database = self.database
+        database.batch = None
+        try:
+            if exc_type is not None:
+                database.logger.error(f"Load batch failed after {self.operations} operation(s); rolling all of it back.")
+                self.rollback()
+                return False
+            try:
+                database.commit_batch(self.statements)
+            except Exception:
+                database.logger.exception("Committing the load batch failed; rolling all of it back.")
+                self.rollback()
+                raise
+            for index, scope in self.deltas:
+                index.commit(scope)
+            database.logger.info(f"Committed {self.operations} operation(s) in one transaction.")
+        finally:
+            for temp_table, schema in self.temp_tables:
+                database.drop_temp_table(temp_table, schema)
+        return False
+
+    def rollback(self):
+        self.database.cxn.rollback()
+        for index, scope in self.deltas:
+            index.discard(scope)
+        # tables created inside the transaction are gone again
+        for target_table, schema in self.created:
+            self.database.forget_table(target_table, schema)
@@ -1,17 +1,59 @@
 from .datastore import Database
+from .cleaning import to_decimal
+from .metrics import measured_load
 
+import io
+import json
 import os
+import uuid
+import datetime
+import decimal
 
 def import_bigquery():
     from google.cloud import bigquery
     return bigquery
 
+def import_parquet():
+    import pyarrow
+    import pyarrow.parquet
+    return pyarrow, pyarrow.parquet
+
+## parquet column types for BigQuery types; anything else is written as text
+PARQUET_TYPES = {
+    'INT64': 'int64',
+    'FLOAT64': 'float64',
+    'BOOL': 'bool_',
+    'BYTES': 'binary',
+}
+
+## NUMERIC is a 38 digit decimal with 9 of them after the point
+NUMERIC_SCALE = decimal.Decimal('1e-9')
+
 class BigQuery(Database):
     '''Connection to a particular BigQuery instance.'''
     def __init__(self):
         super().__init__()
         self.bigquery = import_bigquery()
-        self.type_conversion_dict = {}
+        self.type_conversion_dict = {
+            'int': 'INT64',
+            'integer': 'INT64',
+            'bigint': 'INT64',
+            'smallint': 'INT64',
+            'varchar': 'STRING',
+            'text': 'STRING',
+            'json': 'STRING',
+            'jsonb': 'STRING',
+            'text[]': 'ARRAY<STRING>',
+            'float': 'FLOAT64',
+            'double precision': 'FLOAT64',
+            'real': 'FLOAT64',
+            'numeric': 'NUMERIC',
+            'boolean': 'BOOL',
+            'bool': 'BOOL',
+            'timestamp': 'TIMESTAMP',
+            'timestamptz': 'TIMESTAMP',
+            'date': 'DATE'
+        }
 
     def open_connection(self, creds: str = None):
         ''''
@@ -30,4 +72,253 @@ class BigQuery(Database):
         self.logger.info(f"Set up connection to {self.cxn.project} BigQuery instance successfully.")
 
     def get_cursor(self, creds, connection_name=''):
-        raise NotImplementedError("We don't currently support BQ cursors.")
\ No newline at end of file
+        raise NotImplementedError("We don't currently support BQ cursors.")
+
+    def load_batch(self):
+        raise NotImplementedError("BigQuery loads run as separate jobs; load batches aren't supported.")
+
+    def schema_cache_scope(self):
+        return ('BigQuery', self.cxn.project)
+
+    def table_id(self, target_table, schema):
+        '''Fully qualified table id; schema is the dataset.'''
+        return f"{self.cxn.project}.{schema}.{target_table}"
+
+    def table_schema(self):
+        '''SchemaFields for model_columns, converting generic types through type_conversion_dict.'''
+        fields = []
+        for col, typ in self.target.model_columns.items():
+            converted_type = self.type_conversion_dict.get(typ, typ)
+            if converted_type.startswith('ARRAY<'):
+                fields.append(self.bigquery.SchemaField(col, converted_type[6:-1], mode='REPEATED'))
+            else:
+                fields.append(self.bigquery.SchemaField(col, converted_type))
+        return fields
+
+    def create_object(self, target_table: str, schema: str, primary_key_list: list, expires=None):
+        '''
+        Create table corresponding to object in target dataset. BigQuery doesn't
+        enforce primary keys, so primary_key_list only matters to upsert_object.
+        '''
+        if not hasattr(self, 'target'):
+            raise AttributeError("Target object not staged within Database object. Run stage_object first.")
+
+        if self.table_known(target_table, schema, primary_key_list):
+            return
+
+        table = self.bigquery.Table(self.table_id(target_table, schema), schema=self.table_schema())
+        if expires is not None:
+            table.expires = expires
+        self.logger.info(f"Creating table {table.table_id} if it does not exist.")
+        with self.phase('create'):
+            self.cxn.create_table(table, exists_ok=True)
+        self.remember_table(target_table, schema, primary_key_list)
+        self.logger.info("Created.")
+
+    def drop_object(self, target_table, schema):
+        '''Drop table corresponding to object in target dataset.'''
+        if not hasattr(self, 'target'):
+            raise AttributeError("Target object not staged within Database object. Run stage_object first.")
+
+        self.forget_table(target_table, schema)
+        self.cxn.delete_table(self.table_id(target_table, schema), not_found_ok=True)
+        self.logger.info(f"Table {schema}.{target_table} dropped.")
+
+    def json_value(self, value):
+        '''NDJSON has no NaN; everything json can't encode natively goes in as its string form.'''
+        if type(value) == float and value != value:
+            return None
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        return value
+
+    def serialize_batch(self, buffer, batch):
+        '''Append one batch of row tuples to the in-memory NDJSON load file.'''
+        columns = list(self.target.model_columns.keys())
+        for row in batch:
+            buffer.write(json.dumps({col: self.json_value(value) for col, value in zip(columns, row)}, default=str).encode('utf-8'))
+            buffer.write(b'\n')
+
+    def parquet_type(self, pyarrow, typ: str):
+        if typ.startswith('ARRAY<'):
+            return pyarrow.list_(self.parquet_type(pyarrow, typ[6:-1]))
+        if typ == 'NUMERIC':
+            return pyarrow.decimal128(38, 9)
+        return getattr(pyarrow, PARQUET_TYPES.get(typ, 'string'))()
+
+    def parquet_schema(self, pyarrow):
+        '''
+        Parquet schema from the table's BigQuery types, so every batch written
+        to a load file agrees on each column's type even when a column is all
+        null in the first batch.
+        '''
+        return pyarrow.schema([
+            (col, self.parquet_type(pyarrow, self.type_conversion_dict.get(typ, typ))) for col, typ in self.target.model_columns.items()
+        ])
+
+    def parquet_value(self, pyarrow, value, arrow_type):
+        value = self.json_value(value)
+        if value is None:
+            return None
+        if pyarrow.types.is_decimal(arrow_type):
+            value = to_decimal(value)
+            return None if value is None else value.quantize(NUMERIC_SCALE)
+        if pyarrow.types.is_string(arrow_type) and type(value) != str:
+            return json.dumps(value, default=str) if isinstance(value, (dict, list)) else str(value)
+        return value
+
+    def parquet_table(self, pyarrow, arrow_schema, batch):
+        '''One batch of row tuples as an Arrow table with arrow_schema.'''
+        arrays = []
+        for i, field in enumerate(arrow_schema):
+            try:
+                arrays.append(pyarrow.array([self.parquet_value(pyarrow, row[i], field.type) for row in batch], type=field.type))
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError, ValueError, decimal.InvalidOperation) as e:
+                raise ValueError(f"Column {field.name} has values that don't fit its {field.type} parquet type: {e}") from e
+        return pyarrow.Table.from_arrays(arrays, schema=arrow_schema)
+
+    def load_buffer(self, buffer, target_table, schema, file_format):
+        '''Run one load job appending buffer to the table and wait for it.'''
+        source_format = self.bigquery.SourceFormat.NEWLINE_DELIMITED_JSON if file_format == 'json' else self.bigquery.SourceFormat.PARQUET
+        job_config = self.bigquery.LoadJobConfig(
+            source_format = source_format,
+            schema = self.table_schema(),
+            write_disposition = self.bigquery.WriteDisposition.WRITE_APPEND
+        )
+        if file_format == 'parquet':
+            # without list inference a parquet LIST reads as a nested record, which doesn't match a REPEATED column
+            parquet_options = self.bigquery.ParquetOptions()
+            parquet_options.enable_list_inference = True
+            job_config.parquet_options = parquet_options
+        size = buffer.tell()
+        buffer.seek(0)
+        self.logger.info(f"Loading {size} bytes into {schema}.{target_table}...")
+        with self.phase('execute'):
+            job = self.cxn.load_table_from_file(buffer, self.table_id(target_table, schema), job_config=job_config)
+            job.result()
+        self.count(rows=job.output_rows or 0, bytes=size, chunks=1)
+        self.logger.info(f"Loaded {job.output_rows} rows.")
+
+    @measured_load
+    def append_object(self, target_table, schema, primary_key_list, batch_size=5000, file_format='json', max_batch_bytes=50 * 1024 * 1024, coerce=False):
+        '''
+        Serialize the staged rows in memory as NDJSON ('json') or parquet and
+        append them with load jobs, starting a new job whenever the current file
+        passes max_batch_bytes. Each batch is a row group in the parquet file,
+        written straight from Arrow when the target was staged from Arrow.
+
+        coerce: True to coerce the staged rows before anything is sent; see check_staged.
+        '''
+        if file_format not in ('json', 'parquet'):
+            raise ValueError(f"Unknown load file format {file_format} -- use 'json' or 'parquet'.")
+        self.check_staged(primary_key_list, coerce=coerce, batch_size=batch_size)
+
+        self.logger.info("Creating table if does not exist")
+        self.create_object(target_table, schema, primary_key_list)
+
+        if file_format == 'parquet':
+            return self.append_parquet(target_table, schema, batch_size, max_batch_bytes)
+
+        buffer = io.BytesIO()
+        for batch in self.iter_batches(batch_size):
+            with self.phase('encode'):
+                self.serialize_batch(buffer, batch)
+            if buffer.tell() >= max_batch_bytes:
+                self.load_buffer(buffer, target_table, schema, file_format)
+                buffer = io.BytesIO()
+        if buffer.tell() > 0:
+            self.load_buffer(buffer, target_table, schema, file_format)
+
+    def append_parquet(self, target_table, schema, batch_size=5000, max_batch_bytes=50 * 1024 * 1024):
+        '''
+        Write batches through one ParquetWriter per load file, closing the file
+        and loading it once it passes max_batch_bytes. Arrow-staged targets keep
+        their own Arrow schema; everything else uses parquet_schema.
+        '''
+        pyarrow, parquet = import_parquet()
+        record_batches = self.iter_arrow_batches(batch_size)
+        arrow_schema = self.parquet_schema(pyarrow) if record_batches is None else None
+        batches = self.iter_batches(batch_size) if record_batches is None else record_batches
+
+        buffer, writer = io.BytesIO(), None
+        for batch in batches:
+            with self.phase('encode'):
+                if arrow_schema is None:
+                    table = pyarrow.Table.from_batches([batch])
+                else:
+                    table = self.parquet_table(pyarrow, arrow_schema, batch)
+                if writer is None:
+                    writer = parquet.ParquetWriter(buffer, table.schema)
+                elif not table.schema.equals(writer.schema):
+                    table = table.cast(writer.schema)
+                writer.write_table(table)
+            if buffer.tell() >= max_batch_bytes:
+                writer.close()
+                self.load_buffer(buffer, target_table, schema, 'parquet')
+                buffer, writer = io.BytesIO(), None
+        if writer is not None:
+            writer.close()
+            self.load_buffer(buffer, target_table, schema, 'parquet')
+
+    @measured_load
+    def upsert_object(self, target_table, schema, primary_key_list, update_existing=True, batch_size=5000, file_format='json', max_batch_bytes=50 * 1024 * 1024, delta_index=None, dedupe=None, coerce=False):
+        '''
+        Load the staged rows into a uniquely named temp table next to the target,
+        then MERGE it in on primary_key_list. The temp table is dropped afterwards
+        and expires on its own after a day in case that never happens.
+
+        delta_index: a delta.RowHashIndex. Only rows that are new or changed since
+        the last committed load through that index are sent.
+
+        dedupe: 'last' or 'first' to drop rows repeating a primary key before
+        loading, keeping the last or first row per key, since MERGE fails on a
+        key matched twice. See clean_staged.
+
+        coerce: True to coerce the staged rows before anything is sent; see check_staged.
+        '''
+        if len(primary_key_list) == 0:
+            raise ValueError("No primary keys declared for table -- you cannot upsert without at least one. Appending is still an option.")
+
+        self.check_staged(primary_key_list, dedupe, coerce, batch_size)
+        self.create_object(target_table, schema, primary_key_list)
+        temp_table = f"{target_table}_temp_{uuid.uuid4().hex}"
+        try:
+            if delta_index is not None:
+                self.stage_delta(delta_index, target_table, schema, primary_key_list, batch_size)
+            self.create_object(temp_table, schema, primary_key_list, expires=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1))
+            self.append_object(temp_table, schema, primary_key_list, batch_size, file_format, max_batch_bytes)
+
+            columns = list(self.target.model_columns.keys())
+            upsert_sql = """MERGE `{target}` AS a
+            USING `{temp}` AS b
+            ON {primary_key_expression}
+            {when_matched}
+            WHEN NOT MATCHED THEN INSERT ({insert_cols}) VALUES ({insert_vals})
+            """.format(
+                        target = self.table_id(target_table, schema),
+                        temp = self.table_id(temp_table, schema),
+                        primary_key_expression = ' AND '.join([f"a.`{pk}` = b.`{pk}`" for pk in primary_key_list]),
+                        when_matched = "WHEN MATCHED THEN UPDATE SET {update_cols}".format(
+                            update_cols = ','.join([f"`{col}` = b.`{col}`" for col in columns if col not in primary_key_list])
+                        ) if update_existing is True and len(columns) > len(primary_key_list) else '',
+                        insert_cols = ','.join([f"`{col}`" for col in columns]),
+                        insert_vals = ','.join([f"b.`{col}`" for col in columns])
+                    )
+            self.logger.info(f"Merging into {schema}.{target_table}...")
+            with self.phase('merge'):
+                self.cxn.query(upsert_sql).result()
+            self.finish_delta(True)
+            self.logger.info("Merged.")
+        except Exception:
+            self.finish_delta(False)
+            self.logger.exception(f"Something went wrong during the upsert routine for {schema}.{target_table}.")
+            raise
+        finally:
+            self.logger.info("Cleaning up temp table...")
+            self.forget_table(temp_table, schema)
+            self.cxn.delete_table(self.table_id(temp_table, schema), not_found_ok=True)
+
+    def recreate_object(self, target_table, schema, primary_key_list):
+        '''Convenience wrapper for drop and create methods.'''
+        self.drop_object(target_table, schema)
+        self.create_object(target_table, schema, primary_key_list)
@@ -0,0 +1,89 @@
+'''Process-wide caches that let repeated loads skip work they've already done.'''
+
+import threading
+import time
+from collections import OrderedDict
+
+class SchemaCache(object):
+    '''
+    Remembers which tables create_object has already made, and with which
+    column definitions, per database scope. A table is only trusted for ttl
+    seconds so tables changed outside the library get picked up again.
+    '''
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.counts = {'hits': 0, 'misses': 0}
+
+    def known(self, scope, schema, target_table, definition):
+        '''True if the table was created with this definition less than ttl seconds ago.'''
+        with self.lock:
+            entry = self.tables.get((scope, schema, target_table), None)
+            if entry is not None and entry[0] == definition and time.monotonic() - entry[1] < self.ttl:
+                self.counts['hits'] += 1
+                return True
+            self.counts['misses'] += 1
+            return False
+
+    def remember(self, scope, schema, target_table, definition):
+        with self.lock:
+            self.tables[(scope, schema, target_table)] = (definition, time.monotonic())
+
+    def forget(self, scope, schema, target_table):
+        with self.lock:
+            self.tables.pop((scope, schema, target_table), None)
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats['tables'] = len(self.tables)
+        return stats
+
+schema_cache = SchemaCache()
+
+class StatementCache(object):
+    '''
+    Bounded LRU of compiled SQL keyed by whatever determines the statement
+    (connector, schema, table, columns, primary keys, options). Shared by every
+    instance, so hot loops only build each statement once.
+    '''
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.statements = OrderedDict()
+        self.counts = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, compile):
+        '''Return the cached statement for key, building it with compile() on a miss.'''
+        with self.lock:
+            if key in self.statements:
+                self.statements.move_to_end(key)
+                self.counts['hits'] += 1
+                return self.statements[key]
+            self.counts['misses'] += 1
+
+        statement = compile()
+        with self.lock:
+            self.statements[key] = statement
+            self.statements.move_to_end(key)
+            while len(self.statements) > self.max_size:
+                self.statements.popitem(last=False)
+                self.counts['evictions'] += 1
+        return statement
+
+    def clear(self):
+        with self.lock:
+            self.statements.clear()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats['size'] = len(self.statements)
+        return stats
+
+statement_cache = StatementCache()
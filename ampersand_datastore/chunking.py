@@ -0,0 +1,35 @@
+'''Byte-budget chunk sizing that adapts to how long each chunk takes to send.'''
+
+MIN_BYTES = 16 * 1024
+MAX_BYTES = 1024 * 1024
+
+class AdaptiveChunker(object):
+    '''
+    Decides how many encoded bytes go into the next chunk. Starts at
+    target_bytes, grows by half again while chunks come back well under
+    target_seconds and halves when they take much longer, always staying
+    between min_bytes and max_bytes. Chunks that fail for being too large are
+    bisected by the loader, which also calls shrink so the next ones start smaller.
+    '''
+    def __init__(self, target_bytes=256 * 1024, min_bytes=MIN_BYTES, max_bytes=MAX_BYTES, target_seconds=2.0):
+        self.target_bytes = target_bytes
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+        self.counts = {'chunks': 0, 'bytes': 0, 'splits': 0}
+
+    def observe(self, sent_bytes: int, seconds: float):
+        '''Feed back how long a chunk of sent_bytes took, and resize the budget.'''
+        self.counts['chunks'] += 1
+        self.counts['bytes'] += sent_bytes
+        if sent_bytes < self.target_bytes / 2:
+            # a short final chunk says nothing about the budget
+            return
+        if seconds < self.target_seconds / 2:
+            self.target_bytes = min(self.max_bytes, int(self.target_bytes * 1.5))
+        elif seconds > self.target_seconds * 2:
+            self.target_bytes = max(self.min_bytes, self.target_bytes // 2)
+
+    def shrink(self):
+        self.counts['splits'] += 1
+        self.target_bytes = max(self.min_bytes, self.target_bytes // 2)
@@ -0,0 +1,249 @@
+'''Primary-key deduplication and type coercion for staged rows, run before anything is sent.'''
+
+import datetime
+import decimal
+import json
+import sys
+from operator import itemgetter
+
+NoneType = type(None)
+
+## values that are never null, checked before anything slower
+NOT_NULL_TYPES = frozenset([str, int, bool, bytes, list, tuple, dict, datetime.datetime, datetime.date, decimal.Decimal])
+
+def is_null(value):
+    '''None, NaN, NaT and pd.NA -- the ways rows read out of dataframes spell null.'''
+    if value is None:
+        return True
+    if type(value) in NOT_NULL_TYPES:
+        return False
+    if type(value) == float:
+        return value != value
+    # only a dataframe can have put a pandas null here, so pandas is already imported if it matters
+    pandas = sys.modules.get('pandas', None)
+    if pandas is not None:
+        return pandas.api.types.is_scalar(value) and bool(pandas.isna(value))
+    try:
+        return bool(value != value)
+    except (TypeError, ValueError):
+        return False
+
+def to_str(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        # str(True) is 'True', which is never what a text column wanted
+        raise TypeError("bool isn't text")
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=str)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} isn't text")
+
+def to_int(value):
+    if isinstance(value, str):
+        value = value.strip()
+        if value == '':
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            value = float(value)
+    if isinstance(value, (float, decimal.Decimal)):
+        if value != int(value):
+            raise ValueError(f"{value} isn't a whole number")
+        return int(value)
+    if isinstance(value, int):
+        return int(value)
+    raise TypeError(f"{type(value).__name__} isn't a number")
+
+def to_float(value):
+    if isinstance(value, str):
+        value = value.strip()
+        if value == '':
+            return None
+    if isinstance(value, (str, int, float, decimal.Decimal)):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} isn't a number")
+
+def to_decimal(value):
+    if isinstance(value, str):
+        value = value.strip()
+        if value == '':
+            return None
+    if isinstance(value, float):
+        return decimal.Decimal(repr(value))
+    if isinstance(value, (str, int, decimal.Decimal)):
+        try:
+            return decimal.Decimal(value)
+        except decimal.InvalidOperation:
+            raise ValueError(f"{value!r} isn't a number")
+    raise TypeError(f"{type(value).__name__} isn't a number")
+
+BOOLEAN_STRINGS = {'true': True, 't': True, 'yes': True, 'y': True, '1': True, 'false': False, 'f': False, 'no': False, 'n': False, '0': False}
+
+def to_bool(value):
+    if isinstance(value, str):
+        if value.strip() == '':
+            return None
+        return BOOLEAN_STRINGS[value.strip().lower()]
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    raise TypeError(f"{value!r} isn't a boolean")
+
+def parse_datetime(value: str):
+    # fromisoformat only takes a trailing Z from python 3.11 on
+    return datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+
+def to_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    if isinstance(value, str):
+        return None if value.strip() == '' else parse_datetime(value)
+    raise TypeError(f"{type(value).__name__} isn't a timestamp")
+
+def to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str):
+        if value.strip() == '':
+            return None
+        try:
+            return datetime.date.fromisoformat(value.strip())
+        except ValueError:
+            return parse_datetime(value).date()
+    raise TypeError(f"{type(value).__name__} isn't a date")
+
+## model_columns type (lowercased, without any (precision)) -> (types accepted as they are, coercion)
+COERCIONS = {}
+for names, accepted, coerce in (
+    (('varchar', 'text', 'string', 'char', 'character', 'character varying', 'nvarchar'), (str,), to_str),
+    (('int', 'integer', 'bigint', 'smallint', 'int2', 'int4', 'int8', 'int64'), (int,), to_int),
+    (('float', 'float4', 'float8', 'float64', 'double', 'double precision', 'real'), (float,), to_float),
+    (('numeric', 'decimal'), (decimal.Decimal, int), to_decimal),
+    (('bool', 'boolean'), (bool,), to_bool),
+    (('timestamp', 'timestamptz', 'timestamp without time zone', 'timestamp with time zone', 'timestamp_ntz', 'timestamp_ltz', 'timestamp_tz', 'datetime'), (datetime.datetime,), to_timestamp),
+    (('date',), (datetime.date,), to_date),
+):
+    for name in names:
+        COERCIONS[name] = (frozenset(accepted + (NoneType,)), coerce)
+
+def coercion_for(typ: str):
+    '''(accepted types, coerce) for a model_columns type, or None for types that aren't checked (arrays, json, ...).'''
+    return COERCIONS.get(typ.lower().split('(')[0].strip(), None)
+
+def coerce_value(value, coerce):
+    if is_null(value):
+        return None
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        # numpy scalars out of dataframes
+        value = value.item()
+    return coerce(value)
+
+def coerce_batch(batch: list, coercions: list, columns: list, counts: dict, invalid='raise'):
+    '''
+    Coerce a batch of row tuples a column at a time. Columns whose values all
+    already have an accepted type are passed over after one set comparison.
+    Values that can't be coerced raise ValueError, or with invalid='null' are
+    loaded as nulls and with invalid='drop' take their row out of the load.
+    '''
+    if len(batch) == 0:
+        return batch
+    values_by_column = None
+    dropped = set()
+    for position, coercion in enumerate(coercions):
+        if coercion is None:
+            continue
+        accepted, coerce = coercion
+        if values_by_column is None:
+            values_by_column = [list(column) for column in zip(*batch)]
+        values = values_by_column[position]
+        if set(map(type, values)) <= accepted:
+            continue
+        for row, value in enumerate(values):
+            if type(value) in accepted:
+                continue
+            try:
+                coerced = coerce_value(value, coerce)
+            except (TypeError, ValueError, KeyError, OverflowError) as e:
+                if invalid == 'raise':
+                    raise ValueError(f"Can't load {value!r} into column {columns[position]}: {e}") from e
+                counts['invalid'] += 1
+                if invalid == 'null':
+                    values[row] = None
+                else:
+                    dropped.add(row)
+                continue
+            if coerced is not value:
+                values[row] = coerced
+                counts['coerced'] += 1
+    if values_by_column is None:
+        return batch
+    rows = list(zip(*values_by_column))
+    if len(dropped) > 0:
+        counts['dropped'] += len(dropped)
+        rows = [row for position, row in enumerate(rows) if position not in dropped]
+    return rows
+
+def key_function(key_positions: list):
+    get_key = itemgetter(*key_positions)
+    def key_of(row):
+        key = get_key(row)
+        try:
+            hash(key)
+        except TypeError:
+            # lists and dicts in the key
+            key = json.dumps(key, default=str)
+        return key
+    return key_of
+
+def clean_rows(batches, model_columns: dict, key_positions=None, keep='last', coerce=True, invalid='raise'):
+    '''
+    Read batches of row tuples to the end, coercing values to their
+    model_columns types and dropping rows whose key_positions repeat an earlier
+    row's, so keys are unique across the whole load. keep='last' keeps each
+    key's last row (in the position its first row had); keep='first' keeps its
+    first. Returns the rows and counts of what was changed.
+    '''
+    columns = list(model_columns.keys())
+    coercions = [coercion_for(typ) if coerce is True else None for typ in model_columns.values()]
+    if all(coercion is None for coercion in coercions):
+        coercions = []
+    counts = {'rows': 0, 'coerced': 0, 'invalid': 0, 'dropped': 0, 'duplicates': 0}
+    key_of = key_function(key_positions) if key_positions else None
+    if key_of is None:
+        cleaned = []
+    elif keep == 'first':
+        cleaned, seen = [], set()
+    else:
+        cleaned = {}
+
+    for batch in batches:
+        counts['rows'] += len(batch)
+        if len(coercions) > 0:
+            batch = coerce_batch(batch, coercions, columns, counts, invalid)
+        if key_of is None:
+            cleaned.extend(batch)
+        elif keep == 'first':
+            for row in batch:
+                key = key_of(row)
+                if key in seen:
+                    counts['duplicates'] += 1
+                    continue
+                seen.add(key)
+                cleaned.append(row)
+        else:
+            for row in batch:
+                key = key_of(row)
+                if key in cleaned:
+                    counts['duplicates'] += 1
+                cleaned[key] = row
+
+    rows = list(cleaned.values()) if type(cleaned) == dict else cleaned
+    return rows, counts
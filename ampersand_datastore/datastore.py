@@ -1,17 +1,272 @@
 '''Configurable interface to a datastore.'''
 
+import functools
 import logging
 import json
+import threading
+import time
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import chain, islice
+
+from ampersand_datastore.pool import connection_pool
+from ampersand_datastore.cache import schema_cache
+from ampersand_datastore.metrics import LoadMetrics, NULL_PHASE
+from ampersand_datastore.batch import LoadBatch
+from ampersand_datastore.cleaning import clean_rows
+
+def project_frame(frame, columns: list):
+    '''Select columns out of a dataframe, filling any the frame doesn't have with None.'''
+    missing = [col for col in columns if col not in frame.columns]
+    projected = frame[[col for col in columns if col not in missing]]
+    if len(missing) > 0:
+        projected = projected.assign(**{col: None for col in missing})[columns]
+    return projected
+
+def is_arrow(data):
+    '''pyarrow Tables, RecordBatches and RecordBatchReaders, recognised without importing pyarrow.'''
+    return type(data).__module__.split('.')[0] == 'pyarrow'
+
+def project_arrow(data, columns: list):
+    '''
+    Select columns out of an Arrow Table or RecordBatch without copying them,
+    adding all-null columns for any it doesn't have. Always returns a Table.
+    '''
+    pyarrow = import_pyarrow()
+    present = set(data.schema.names)
+    arrays = [data.column(col) if col in present else pyarrow.nulls(data.num_rows) for col in columns]
+    if isinstance(data, pyarrow.RecordBatch):
+        return pyarrow.Table.from_batches([pyarrow.RecordBatch.from_arrays(arrays, names=columns)])
+    return pyarrow.Table.from_arrays(arrays, names=columns)
+
+def iter_arrow_record_batches(arrow, batch_size=5000):
+    '''Record batches of at most batch_size rows from a staged Table, or from a stream of projected Tables.'''
+    tables = [arrow] if hasattr(arrow, 'to_batches') else arrow
+    for table in tables:
+        for record_batch in table.to_batches(max_chunksize=batch_size):
+            if record_batch.num_rows > 0:
+                yield record_batch
+
+def arrow_rows(record_batch):
+    '''Row tuples from a record batch, converting a column at a time.'''
+    return list(zip(*[column.to_pylist() for column in record_batch.columns]))
+
+def iter_stream_rows(stream, columns: list):
+    '''Flatten a stream of row dicts and/or dataframe chunks into row tuples ordered like columns.'''
+    for item in stream:
+        if hasattr(item, 'columns'):
+            yield from project_frame(item, columns).itertuples(index=False, name=None)
+        else:
+            yield tuple(item.get(col) for col in columns)
+
+def rebatch(rows, batch_size):
+    batch = list(islice(rows, batch_size))
+    while len(batch) > 0:
+        yield batch
+        batch = list(islice(rows, batch_size))
+
+class StagedRows(object):
+    '''
+    What stage_object leaves on target.staged_rows: one tuple per row, ordered
+    like columns, sharing a single column -> position index instead of
+    repeating every column name in a dict per row.
+    '''
+    __slots__ = ('columns', 'index', 'rows')
+
+    def __init__(self, columns: list, rows: list):
+        self.columns = tuple(columns)
+        self.index = {col: position for position, col in enumerate(self.columns)}
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def batches(self, batch_size=5000):
+        for start in range(0, len(self.rows), batch_size):
+            yield self.rows[start:start + batch_size]
+
+    def column(self, col):
+        position = self.index[col]
+        return [row[position] for row in self.rows]
+
+class FormattedRow(dict):
+    '''
+    One row of a FormattedDataView. It's built fresh on every access, so a
+    change to it would be silently lost; changing it raises instead.
+    '''
+    __slots__ = ()
+
+    def read_only(self, *args, **kwargs):
+        raise TypeError("formatted_data rows are read-only -- change target.data and stage it again.")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = read_only
+
+class FormattedDataView(Sequence):
+    '''
+    Read-only list-of-dicts view over StagedRows, kept as target.formatted_data
+    for code written against the old staging. Dicts are built per access and
+    hold every model column, with None where the source row had none.
+    '''
+    __slots__ = ('staged',)
+
+    def __init__(self, staged: StagedRows):
+        self.staged = staged
+
+    def __len__(self):
+        return len(self.staged.rows)
+
+    def __getitem__(self, position):
+        columns = self.staged.columns
+        if type(position) == slice:
+            return [FormattedRow(zip(columns, row)) for row in self.staged.rows[position]]
+        return FormattedRow(zip(columns, self.staged.rows[position]))
+
+    def __setitem__(self, position, value):
+        raise TypeError("formatted_data is read-only -- change target.data and stage it again.")
+
+def iter_staged_batches(target: object, batch_size=5000):
+    '''
+    Read back whatever stage_object left on target as lists of row tuples.
+    Batches materialized by materialize_batches are handed out as they are
+    when batch_size matches, so several loaders can share one read of the source.
+
+    The staged source is picked when this is called, not when iteration starts,
+    so the result can be put back on target as its new staged_batches.
+    '''
+    return read_staged_batches(
+        target,
+        getattr(target, 'staged_batches', None),
+        getattr(target, 'staged_frame', None),
+        getattr(target, 'staged_stream', None),
+        getattr(target, 'staged_rows', None),
+        getattr(target, 'staged_arrow', None),
+        batch_size
+    )
+
+def read_staged_batches(target, batches, frame, stream, rows, arrow, batch_size):
+    columns = list(target.model_columns.keys())
+    if batches is not None:
+        if target.staged_batch_size == batch_size:
+            yield from batches
+        else:
+            yield from rebatch(chain.from_iterable(batches), batch_size)
+    elif stream is not None:
+        yield from rebatch(iter_stream_rows(stream, columns), batch_size)
+    elif frame is not None:
+        for start in range(0, len(frame), batch_size):
+            yield list(frame.iloc[start:start + batch_size].itertuples(index=False, name=None))
+    elif rows is not None:
+        yield from rows.batches(batch_size)
+    elif arrow is not None:
+        for record_batch in iter_arrow_record_batches(arrow, batch_size):
+            yield arrow_rows(record_batch)
+    else:
+        data = target.formatted_data
+        for start in range(0, len(data), batch_size):
+            yield [tuple(row.get(col) for col in columns) for row in data[start:start + batch_size]]
+
+def materialize_batches(target: object, batch_size=5000):
+    '''
+    Read the staged rows into batches of row tuples once and keep them on
+    target, so every later read shares them. This holds the whole load in
+    memory -- streams are read to the end here -- and it only shares the
+    reading: each connector still encodes the rows into its own SQL, CSV or
+    parquet payloads from these batches.
+    '''
+    batches = list(iter_staged_batches(target, batch_size))
+    target.staged_batches = batches
+    target.staged_batch_size = batch_size
+    return batches
+
+def import_pandas():
+    import pandas
+    return pandas
+
+def import_pyarrow():
+    import pyarrow
+    return pyarrow
+
+@functools.lru_cache(maxsize=None)
+def configure_logging():
+    '''Default to INFO logging, once per process, the first time a connector is created.'''
+    logging.basicConfig(level=logging.INFO)
 
 class Database(object):
     '''Generic database connector for any interface that implements DB-API standards.'''
     def __init__(self):
-        logging.basicConfig(level=logging.INFO)
+        configure_logging()
         self.logger = logging.getLogger(__name__)
         # override to convert generic API types to specific database types
         self.type_conversion_dict = {}
+        self.metrics = None
+        self.batch = None
+
+    def load_batch(self):
+        '''
+        Context manager that runs every load inside it in one transaction on this
+        connection and commits once at the end -- see batch.LoadBatch.
+        '''
+        return LoadBatch(self)
+
+    def commit(self):
+        '''Commit, unless a load batch is holding commits until it finishes.'''
+        if self.batch is not None:
+            return
+        self.cxn.commit()
+
+    def commit_batch(self, statements: list):
+        '''Run whatever a load batch deferred and commit it all. Override where that needs an explicit transaction.'''
+        for statement in statements:
+            self.cursor.execute(statement)
+        self.cxn.commit()
+
+    def instrument(self, sink=None, log_summary=True):
+        '''
+        Start timing load phases and counting rows, bytes, chunks and retries.
+        Every append/upsert then logs a one-line summary, and sink (if given) gets
+        each phase and summary as a dict -- see metrics.LoadMetrics. Returns the
+        LoadMetrics; its last attribute holds the latest summary.
+        '''
+        self.metrics = LoadMetrics(sink, log_summary)
+        return self.metrics
+
+    def phase(self, name):
+        '''Context manager timing a phase of the load; free when metrics are off.'''
+        if self.metrics is None:
+            return NULL_PHASE
+        return self.metrics.phase(name)
+
+    def count(self, **amounts):
+        if self.metrics is not None:
+            self.metrics.count(**amounts)
+
+    def stage_object(self, target: object, target_table=False, columnar=False):
+        '''
+        Trim target.data down to target.model_columns so the connectors can load it.
+
+        Rows are kept as target.staged_rows (see StagedRows), one tuple per row;
+        target.formatted_data is a read-only view that builds the old per-row
+        dicts on access.
+
+        columnar: only for dataframes. Projects the frame onto model_columns once
+        and leaves it as target.staged_frame instead of copying it into tuples.
+        Use iter_batches to read the staged rows back out regardless of which
+        path staged them.
 
-    def stage_object(self, target: object, target_table=False):
+        pyarrow Tables, RecordBatches and RecordBatchReaders are staged as Arrow
+        (see stage_arrow); loaders that can take Arrow as-is read it through
+        iter_arrow_batches.
+
+        If target.data is neither a list nor a dataframe it's treated as a stream:
+        any iterable of row dicts or of dataframe chunks (e.g. a generator over
+        paged API results). Nothing is read until the connector pulls batches
+        through iter_batches, so the load runs in constant memory -- but the
+        stream can only be loaded once.
+        '''
+        with self.phase('stage'):
+            self.stage_rows(target, target_table, columnar)
+
+    def stage_rows(self, target: object, target_table=False, columnar=False):
         if target_table is False:
             if not hasattr(target, 'target_table'):
                 raise AttributeError(f"Target_table not defined in function call or target object -- set one of those.")
@@ -19,37 +274,475 @@ class Database(object):
 
         self.logger.info(f"Loading in {target} instance for interface with {target_table}.")
 
-        target.formatted_data = []
+        target.staged_frame = None
+        target.staged_stream = None
+        target.staged_batches = None
+        target.staged_rows = None
+        target.staged_arrow = None
+        # only row staging builds a view; the other paths mustn't leave an earlier one behind
+        target.formatted_data = None
+        target.staged_checked = False
+        if is_arrow(target.data):
+            self.stage_arrow(target)
+            self.target = target
+            return
+
+        if type(target.data) != list and not hasattr(target.data, 'columns'):
+            self.logger.info("target.data is neither a list nor a dataframe; staging it as a stream.")
+            target.staged_stream = iter(target.data)
+            self.target = target
+            return
+
+        if columnar is True:
+            self.stage_columnar(target)
+            self.target = target
+            return
+
+        columns = list(target.model_columns.keys())
         if type(target.data) != list:
             self.logger.info("target.data is not a list; attempting dataframe parse")
             self.logger.info(f"Trimming out columns not in {target}.model_columns. Starting with {len(target.data.columns)} columns...")
             try:
-                for index, entry in target.data.iterrows():
-                    formatted_dict = {col: entry[col] for col in list(target.model_columns.keys()) if col in entry}
-                    target.formatted_data.append(formatted_dict)
-                self.logger.info(f"""Ended with {len(target.formatted_data[0].keys())} columns. Trimmed the following columns out:
-                            {set(target.data.columns) - set(target.formatted_data[0].keys())}""")
+                target.staged_rows = StagedRows(columns, list(project_frame(target.data, columns).itertuples(index=False, name=None)))
+                self.logger.info(f"""Ended with {len([col for col in columns if col in target.data.columns])} columns. Trimmed the following columns out:
+                            {set(target.data.columns) - set(columns)}""")
             except:
                 self.logger.exception("Dataframe parse failed.")
+                target.staged_rows = StagedRows(columns, [])
         else:
-            self.logger.info(f"Trimming out columns not in {target}.model_columns. Starting with {len(target.data[0].keys())} columns...")
-            for entry in target.data:
-                formatted_dict = {col: entry[col] for col in list(target.model_columns.keys()) if col in entry}
-                target.formatted_data.append(formatted_dict)
-            self.logger.info(f"""Ended with {len(target.formatted_data[0].keys())} columns. Trimmed the following columns out:
-                        {set(target.data[0].keys()) - set(target.formatted_data[0].keys())}""")
+            first = target.data[0] if len(target.data) > 0 else {}
+            self.logger.info(f"Trimming out columns not in {target}.model_columns. Starting with {len(first.keys())} columns...")
+            target.staged_rows = StagedRows(columns, [tuple([entry.get(col) for col in columns]) for entry in target.data])
+            self.logger.info(f"""Ended with {len([col for col in columns if col in first])} columns. Trimmed the following columns out:
+                        {set(first.keys()) - set(columns)}""")
+        target.formatted_data = FormattedDataView(target.staged_rows)
 
         self.target = target
 
+    def stage_columnar(self, target: object):
+        '''Project a dataframe onto model_columns in one pass; columns missing from the frame come through as nulls.'''
+        if type(target.data) == list:
+            raise ValueError("Columnar staging needs a dataframe in target.data; stage lists of dicts with columnar=False.")
+
+        columns = list(target.model_columns.keys())
+        self.logger.info(f"Trimming out columns not in {target}.model_columns. Starting with {len(target.data.columns)} columns...")
+        target.staged_frame = project_frame(target.data, columns)
+        self.logger.info(f"""Ended with {len(columns)} columns. Trimmed the following columns out:
+                    {set(target.data.columns) - set(columns)}""")
+
+    def stage_arrow(self, target: object):
+        '''
+        Project an Arrow Table/RecordBatch onto model_columns by picking columns,
+        without copying any data, and keep it as target.staged_arrow. A
+        RecordBatchReader is projected a batch at a time as it's read, so like
+        other streams it can only be loaded once.
+        '''
+        columns = list(target.model_columns.keys())
+        self.logger.info(f"Trimming out columns not in {target}.model_columns. Starting with {len(target.data.schema.names)} Arrow columns...")
+        if hasattr(target.data, 'read_next_batch'):
+            target.staged_arrow = (project_arrow(record_batch, columns) for record_batch in target.data)
+        else:
+            target.staged_arrow = project_arrow(target.data, columns)
+        self.logger.info(f"""Ended with {len(columns)} columns. Trimmed the following columns out:
+                    {set(target.data.schema.names) - set(columns)}""")
+
+    def iter_arrow_batches(self, batch_size=5000):
+        '''
+        Arrow record batches of at most batch_size rows when the target was
+        staged from Arrow and nothing has narrowed the rows down since (a
+        delta load or materialize_batches); otherwise None, and loaders should
+        fall back to iter_batches.
+        '''
+        if not hasattr(self, 'target'):
+            raise AttributeError("Target object not staged within Database object. Run stage_object first.")
+        arrow = getattr(self.target, 'staged_arrow', None)
+        if arrow is None or getattr(self.target, 'staged_batches', None) is not None or getattr(self, 'delta_filter', None) is not None:
+            return None
+        if self.metrics is not None:
+            return self.metrics.timed('read', iter_arrow_record_batches(arrow, batch_size))
+        return iter_arrow_record_batches(arrow, batch_size)
+
+    def iter_batches(self, batch_size=5000):
+        '''
+        Yield the staged rows in lists of at most batch_size tuples, with values
+        ordered like target.model_columns. Columns a row doesn't have come through as None.
+        During a delta load only the rows its index lets through are yielded.
+        '''
+        if not hasattr(self, 'target'):
+            raise AttributeError("Target object not staged within Database object. Run stage_object first.")
+        batches = iter_staged_batches(self.target, batch_size)
+        if getattr(self, 'delta_filter', None) is not None:
+            batches = self.delta_filter(batches)
+        if self.metrics is not None:
+            return self.metrics.timed('read', batches)
+        return batches
+
+    def clean_staged(self, primary_key_list=None, keep='last', coerce=True, invalid='raise', batch_size=5000):
+        '''
+        Check the staged rows before anything is sent, and leave the cleaned
+        rows staged in their place (see cleaning.clean_rows):
+
+        coerce: convert values to their model_columns type where that's
+        unambiguous ('12' into an int column, 12 into a varchar, ISO strings into
+        timestamps and dates, '' and NaN to null). invalid: what to do with
+        values that can't be -- 'raise' a ValueError, load them as 'null', or
+        'drop' their rows.
+
+        primary_key_list: drop rows repeating a key, keeping the 'last' or
+        'first' row per key, so upserts never see the same key twice.
+
+        Streams are read to the end here. Returns counts of the rows read,
+        coerced, invalid, dropped and duplicated.
+        '''
+        if not hasattr(self, 'target'):
+            raise AttributeError("Target object not staged within Database object. Run stage_object first.")
+        if keep not in ('last', 'first'):
+            raise ValueError(f"Unknown keep policy {keep} -- use 'last' or 'first'.")
+        if invalid not in ('raise', 'null', 'drop'):
+            raise ValueError(f"Unknown invalid policy {invalid} -- use 'raise', 'null' or 'drop'.")
+
+        columns = list(self.target.model_columns.keys())
+        key_positions = [columns.index(pk) for pk in primary_key_list] if primary_key_list else None
+        with self.phase('clean'):
+            rows, counts = clean_rows(iter_staged_batches(self.target, batch_size), self.target.model_columns, key_positions, keep, coerce, invalid)
+
+        target = self.target
+        # every value now has its model_columns type, so encoders can skip their own checks
+        target.staged_checked = getattr(target, 'staged_checked', False) or coerce is True
+        target.staged_frame = None
+        target.staged_stream = None
+        target.staged_batches = None
+        target.staged_arrow = None
+        target.staged_rows = StagedRows(columns, rows)
+        target.formatted_data = FormattedDataView(target.staged_rows)
+
+        self.count(**{name: amount for name, amount in counts.items() if name != 'rows'})
+        self.logger.info(f"Cleaned {counts['rows']} staged rows: {counts['coerced']} values coerced, {counts['invalid']} invalid, {counts['dropped']} rows dropped as invalid and {counts['duplicates']} as duplicate keys.")
+        return counts
+
+    def check_staged(self, primary_key_list, dedupe=None, coerce=False, batch_size=5000):
+        '''
+        Run clean_staged ahead of a load when it asked for dedupe or coerce,
+        before anything is sent. Loads call this before they touch the database.
+
+        coerce=True checks every staged value against its model_columns type,
+        converting what's unambiguous and raising ValueError on the first value
+        that can't be, and lets the encoders skip their own per-value checks.
+        Streams are read into memory for it. Without it, a value the encoders
+        can't place (a float in a varchar column, say) fails mid-load, after
+        earlier chunks may have been sent.
+        '''
+        if dedupe is None and coerce is not True:
+            return
+        self.clean_staged(primary_key_list if dedupe is not None else None, keep=dedupe or 'last', coerce=coerce is True, batch_size=batch_size)
+
+    def stage_delta(self, index, target_table, schema, primary_key_list: list, batch_size=5000):
+        '''
+        Narrow the batches iter_batches hands out to the rows a RowHashIndex
+        hasn't seen with the same values for this table. The target's staged
+        rows are left alone, so they can still be loaded in full afterwards.
+        The loaders call finish_delta once they know whether the load committed.
+        '''
+        columns = list(self.target.model_columns.keys())
+        key_positions = [columns.index(pk) for pk in primary_key_list]
+        scope = f"{self.schema_cache_scope()}:{schema}.{target_table}"
+        self.delta_index = index
+        self.delta_scope = scope
+        self.delta_filter = lambda batches: index.filter_batches(scope, batches, key_positions)
+
+    def finish_delta(self, committed: bool):
+        '''Record the sent rows' hashes after a committed load, or drop them so they're retried.'''
+        index = getattr(self, 'delta_index', None)
+        if index is None:
+            return
+        if committed is True and self.batch is not None:
+            self.batch.deltas.append((index, self.delta_scope))
+        elif committed is True:
+            index.commit(self.delta_scope)
+        else:
+            index.discard(self.delta_scope)
+        self.delta_index = None
+        self.delta_filter = None
+
+    def stage_resume(self, journal, load_id: str, target_table, schema, batch_size=5000, staging_table=None):
+        '''
+        Make the staged batches skip the chunks a LoadJournal has recorded as
+        committed for load_id, and return the staging table to load into (the
+        one recorded when load_id first ran, else staging_table). Loaders call
+        checkpoint after committing each chunk and finish_resume at the end.
+        '''
+        if self.batch is not None:
+            raise ValueError("Resumable loads commit chunk by chunk, so they can't run inside a load batch.")
+        scope = f"{self.schema_cache_scope()}:{schema}.{target_table}"
+        staging_table = journal.begin(scope, load_id, batch_size, staging_table)
+        self.journal = journal
+        self.journal_scope = scope
+        self.load_id = load_id
+        committed = journal.committed_chunks(self.journal_scope, load_id)
+        if len(committed) > 0:
+            self.logger.info(f"Resuming load {load_id}: skipping {len(committed)} committed chunk(s), {journal.committed_rows(self.journal_scope, load_id)} rows.")
+        self.target.staged_batches = self.skip_committed(iter_staged_batches(self.target, batch_size), committed)
+        self.target.staged_batch_size = batch_size
+        return staging_table
+
+    def skip_committed(self, batches, committed: set):
+        for chunk, batch in enumerate(batches):
+            if chunk in committed:
+                continue
+            self.resume_chunk = (chunk, len(batch))
+            yield batch
+
+    def checkpoint(self):
+        '''Record the batch iter_batches handed out last as committed. A no-op outside resumable loads.'''
+        if getattr(self, 'journal', None) is None:
+            return
+        chunk, rows = self.resume_chunk
+        self.journal.record(self.journal_scope, self.load_id, chunk, rows)
+
+    def finish_resume(self, completed: bool):
+        '''Clear the journal after a completed load, or leave it for the retry.'''
+        journal = getattr(self, 'journal', None)
+        if journal is None:
+            return
+        if completed is True:
+            journal.finish(self.journal_scope, self.load_id)
+        else:
+            self.logger.warning(f"Load {self.load_id} stopped after {journal.committed_rows(self.journal_scope, self.load_id)} committed rows; retry with the same load_id to resume.")
+        self.journal = None
+
+    def schema_cache_scope(self):
+        '''Which database the schema cache entries belong to: the creds this instance connected with.'''
+        if getattr(self, 'pool_key', None) is not None:
+            return self.pool_key
+        if getattr(self, 'creds', None) is not None:
+            return connection_pool.key(type(self).__name__, self.creds)
+        return (type(self).__name__, id(self.cxn))
+
+    def schema_definition(self, primary_key_list: list):
+        return (tuple(self.target.model_columns.items()), tuple(primary_key_list))
+
+    def table_known(self, target_table, schema, primary_key_list: list):
+        '''True if create_object already made this table with the current model_columns, so the DDL can be skipped.'''
+        if schema_cache.known(self.schema_cache_scope(), schema, target_table, self.schema_definition(primary_key_list)):
+            self.logger.debug(f"Table {schema}.{target_table} already created; skipping DDL.")
+            return True
+        return False
+
+    def remember_table(self, target_table, schema, primary_key_list: list):
+        if self.batch is not None:
+            self.batch.created.append((target_table, schema))
+        schema_cache.remember(self.schema_cache_scope(), schema, target_table, self.schema_definition(primary_key_list))
+
+    def forget_table(self, target_table, schema):
+        schema_cache.forget(self.schema_cache_scope(), schema, target_table)
+
+    def open_worker_connection(self):
+        raise NotImplementedError("Implement the open_worker_connection method on a per-connector basis to send in parallel.")
+
+    def checkout_worker_connection(self):
+        '''Worker connections come out of the shared pool when this instance's own connection did.'''
+        if getattr(self, 'pool_key', None) is not None:
+            return connection_pool.checkout(self.pool_key, self.open_worker_connection, self.connection_healthy)
+        return self.open_worker_connection()
+
+    def release_worker_connection(self, cxn):
+        if getattr(self, 'pool_key', None) is not None:
+            connection_pool.checkin(self.pool_key, cxn)
+        else:
+            cxn.close()
+
+    def parallel_send(self, send_chunk, batches, parallelism: int):
+        '''
+        Run send_chunk(cursor, cxn, chunk) over batches from a pool of parallelism
+        threads, each with its own worker connection. Only a couple of chunks per
+        thread are in flight at once, so streamed targets stay bounded. Once a
+        chunk fails no more are submitted.
+
+        Errors are logged in chunk order and the earliest one is returned, the same
+        way the sequential loaders return theirs.
+        '''
+        local = threading.local()
+        connections = []
+        lock = threading.Lock()
+
+        def work(chunk):
+            if not hasattr(local, 'cxn'):
+                local.cxn = self.checkout_worker_connection()
+                with lock:
+                    connections.append(local.cxn)
+            cursor = local.cxn.cursor()
+            try:
+                return send_chunk(cursor, local.cxn, chunk)
+            finally:
+                cursor.close()
+
+        errors = {}
+        pending = {}
+
+        def collect(done):
+            for future in done:
+                index = pending.pop(future)
+                exc = future.exception() or future.result()
+                if exc:
+                    errors[index] = exc
+
+        try:
+            with ThreadPoolExecutor(max_workers=parallelism) as pool:
+                for index, chunk in enumerate(batches):
+                    pending[pool.submit(work, chunk)] = index
+                    if len(pending) >= parallelism * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    if len(errors) > 0:
+                        break
+                done, _ = wait(pending)
+                collect(done)
+        finally:
+            for cxn in connections:
+                self.release_worker_connection(cxn)
+
+        if len(errors) > 0:
+            for index in sorted(errors):
+                self.logger.error(f"Chunk {index} failed: {errors[index]}")
+            return errors[min(errors)]
+
+    def adaptive_send(self, chunker, batches, encode_sized, send_payloads, too_large):
+        '''
+        Regroup batches into chunks of about chunker.target_bytes. encode_sized(batch)
+        returns (payload, size) per row and send_payloads(payloads) sends one chunk,
+        returning its exception on failure. Returns the first error that splitting
+        couldn't get past.
+        '''
+        payloads, sizes, total = [], [], 0
+        for batch in batches:
+            for payload, size in encode_sized(batch):
+                payloads.append(payload)
+                sizes.append(size)
+                total += size
+                if total >= chunker.target_bytes:
+                    exc = self.send_splitting(chunker, payloads, sizes, send_payloads, too_large)
+                    if exc:
+                        return exc
+                    payloads, sizes, total = [], [], 0
+        if len(payloads) > 0:
+            return self.send_splitting(chunker, payloads, sizes, send_payloads, too_large)
+
+    def send_splitting(self, chunker, payloads, sizes, send_payloads, too_large):
+        '''Send one chunk; if it's rejected for its size, bisect it and send the halves.'''
+        started = time.monotonic()
+        exc = send_payloads(payloads)
+        if not exc:
+            chunker.observe(sum(sizes), time.monotonic() - started)
+            return None
+        if len(payloads) > 1 and too_large(exc):
+            chunker.shrink()
+            self.count(retries=1)
+            middle = len(payloads) // 2
+            self.logger.warning(f"Chunk of {len(payloads)} rows ({sum(sizes)} bytes) was too large; retrying it in two halves.")
+            return (self.send_splitting(chunker, payloads[:middle], sizes[:middle], send_payloads, too_large)
+                    or self.send_splitting(chunker, payloads[middle:], sizes[middle:], send_payloads, too_large))
+        return exc
+
+    def read_query(self, query, params=None, batch_size=5000, frames=False):
+        '''
+        Stream a query's results instead of fetching them all at once: an
+        iterator of row dicts, or with frames, of DataFrame chunks. Either one
+        works as another target's data for stage_object, which stages it as a
+        stream, so copies between stores run in bounded memory:
+
+            target.data = pg.read_query("SELECT * FROM sales.orders")
+            sf.stage_object(target, 'orders')
+            sf.append_object('orders', 'SALES', ['id'])
+
+        Nothing is sent until the iterator is first read.
+        '''
+        if frames is True:
+            return self.read_frames(query, params, batch_size)
+        return self.read_rows(query, params, batch_size)
+
+    def read_table(self, target_table, schema, columns=None, batch_size=5000, frames=False):
+        '''read_query over a whole table, or just columns of it.'''
+        return self.read_query(self.select_sql(target_table, schema, columns), None, batch_size, frames)
+
+    def read_rows(self, query, params=None, batch_size=5000):
+        for columns, rows in self.fetch_chunks(query, params, batch_size):
+            for row in rows:
+                yield dict(zip(columns, row))
+
+    def read_frames(self, query, params=None, batch_size=5000):
+        pandas = import_pandas()
+        for columns, rows in self.fetch_chunks(query, params, batch_size):
+            yield pandas.DataFrame.from_records(list(rows), columns=columns)
+
+    def select_sql(self, target_table, schema, columns=None):
+        raise NotImplementedError("Implement the select_sql method on a per-connector basis to read tables.")
+
+    def fetch_chunks(self, query, params=None, batch_size=5000):
+        '''Override to yield (column names, rows) a chunk at a time for read_query.'''
+        raise NotImplementedError("Implement the fetch_chunks method on a per-connector basis to stream reads.")
+
     def open_connection(self, creds: dict, connection_name=''):
         raise NotImplementedError("Implement the open_connection method on a per-connector basis.")
 
-    def get_cursor(self, creds, connection_name=''):
-        self.open_connection(creds, connection_name)
+    def connection_healthy(self, cxn, ping=False):
+        '''
+        Whether an idle pooled connection is still usable. The pool asks for a
+        ping once it has sat idle a while, since a server or load balancer may
+        have dropped it without the client noticing. Override to add cheaper
+        local checks first.
+        '''
+        if ping is True:
+            return self.ping_connection(cxn)
+        return True
+
+    def ping_connection(self, cxn):
+        '''Round-trip a SELECT 1 on cxn; False if it fails.'''
+        try:
+            cursor = cxn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            cxn.rollback()
+        except Exception:
+            self.logger.warning("Pooled connection failed its ping; replacing it.")
+            return False
+        return True
+
+    def ensure_connection(self, creds, pooled=False):
+        '''
+        Connect unless this instance already has a connection. With pooled, the
+        connection is checked out of the process-wide pool keyed by these creds,
+        and close_connection hands it back instead of closing it.
+        '''
+        self.creds = creds
+        if hasattr(self, 'cxn'):
+            return
+        if pooled is True:
+            def connect():
+                self.open_connection(creds)
+                return self.cxn
+            self.pool_key = connection_pool.key(type(self).__name__, creds)
+            self.cxn = connection_pool.checkout(self.pool_key, connect, self.connection_healthy)
+        else:
+            self.open_connection(creds)
+
+    def get_cursor(self, creds, connection_name='', pooled=False):
+        if pooled is True:
+            self.ensure_connection(creds, pooled)
+        else:
+            self.open_connection(creds, connection_name)
         self.cursor = self.cxn.cursor()
         self.logger.info("Cursor retrieved.")
 
     def close_connection(self):
         self.cursor.close()
-        self.cxn.close()
-        self.logger.info("Connection closed.")
+        if getattr(self, 'pool_key', None) is not None:
+            connection_pool.checkin(self.pool_key, self.cxn)
+            self.pool_key = None
+            self.logger.info("Connection returned to pool.")
+        else:
+            self.cxn.close()
+            self.logger.info("Connection closed.")
+        del self.cxn
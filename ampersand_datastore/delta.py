@@ -0,0 +1,78 @@
+'''Persistent row-hash index so upserts only send rows that changed since the last load.'''
+
+import hashlib
+import json
+import sqlite3
+import threading
+
+class RowHashIndex(object):
+    '''
+    SQLite file of one hash per (scope, primary key), where scope is the
+    destination table. filter_batches drops staged rows whose hash matches what
+    was last loaded; their new hashes are only written by commit, which the
+    loaders call once the upsert has committed. Rows deleted upstream aren't
+    detected -- this only finds new and changed rows.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS row_hashes (scope TEXT, pk TEXT, hash TEXT, PRIMARY KEY (scope, pk))")
+        self.db.commit()
+        self.pending = {}
+        self.counts = {'sent': 0, 'skipped': 0}
+
+    def row_hash(self, row: tuple):
+        return hashlib.blake2b(json.dumps(row, default=str).encode('utf-8'), digest_size=16).hexdigest()
+
+    def known_hashes(self, scope, keys: list):
+        '''Stored hashes for keys, looked up in chunks that stay under SQLite's variable limit.'''
+        known = {}
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join(['?'] * len(chunk))
+                known.update(self.db.execute(
+                    f"SELECT pk, hash FROM row_hashes WHERE scope = ? AND pk IN ({placeholders})", [scope] + chunk
+                ).fetchall())
+        return known
+
+    def filter_batches(self, scope, batches, key_positions: list):
+        '''Yield each batch with unchanged rows removed, remembering the new hashes as pending.'''
+        pending = self.pending[scope] = {}
+        for batch in batches:
+            hashes = [(json.dumps([row[i] for i in key_positions], default=str), self.row_hash(row)) for row in batch]
+            known = self.known_hashes(scope, [key for key, _ in hashes])
+            changed = []
+            for row, (key, row_hash) in zip(batch, hashes):
+                if known.get(key, None) == row_hash:
+                    self.counts['skipped'] += 1
+                    continue
+                pending[key] = row_hash
+                changed.append(row)
+            self.counts['sent'] += len(changed)
+            if len(changed) > 0:
+                yield changed
+
+    def commit(self, scope):
+        '''Record the hashes of everything filter_batches let through for scope.'''
+        pending = self.pending.pop(scope, {})
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO row_hashes (scope, pk, hash) VALUES (?, ?, ?)",
+                [(scope, key, row_hash) for key, row_hash in pending.items()]
+            )
+            self.db.commit()
+
+    def discard(self, scope):
+        '''Forget pending hashes after a failed load so those rows are sent again next time.'''
+        self.pending.pop(scope, None)
+
+    def forget(self, scope):
+        '''Drop every stored hash for scope, e.g. after the destination table was recreated.'''
+        with self.lock:
+            self.db.execute("DELETE FROM row_hashes WHERE scope = ?", [scope])
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
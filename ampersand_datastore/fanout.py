@@ -0,0 +1,82 @@
+'''Load one staged object into several datastores at once.'''
+
+import copy
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ampersand_datastore.datastore import materialize_batches
+
+logger = logging.getLogger(__name__)
+
+class Destination(object):
+    '''
+    One place to fan a staged object out to: a connected Database (get_cursor
+    already run), the table settings, and which of its load methods to call.
+    Any extra keyword arguments are passed through to that method.
+    '''
+    def __init__(self, database, target_table: str, schema: str, primary_key_list: list, operation='upsert_object', **options):
+        self.database = database
+        self.target_table = target_table
+        self.schema = schema
+        self.primary_key_list = primary_key_list
+        self.operation = operation
+        self.options = options
+
+    def __repr__(self):
+        return f"{type(self.database).__name__}:{self.schema}.{self.target_table}"
+
+class FanOutResult(object):
+    '''What happened at one destination: the error if it failed, and how long it took.'''
+    def __init__(self, destination, error=None, seconds=0.0):
+        self.destination = destination
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.succeeded else f'failed: {self.error!r}'
+        return f"<FanOutResult {self.destination} {status} in {self.seconds:.2f}s>"
+
+def fan_out(target: object, destinations: list, batch_size=5000, max_workers=None):
+    '''
+    Load target, already run through stage_object, into every destination
+    concurrently. The staged rows are read into batches once and shared (see
+    materialize_batches); each destination gets its own shallow copy of target
+    so connector-specific type conversions don't leak between them.
+
+    Fan-out isn't bounded-memory: a streamed target is read to the end before
+    any destination starts, and every destination encodes its own payloads
+    from the shared batches at the same time. Load a stream too large for
+    memory into each destination in turn, restaging it every time.
+
+    A failing destination doesn't stop the others. Returns one FanOutResult per
+    destination, in the order given.
+    '''
+    batches = materialize_batches(target, batch_size)
+    logger.info(f"Fanning {sum(len(batch) for batch in batches)} staged rows out to {len(destinations)} destinations.")
+
+    def load(destination):
+        staged = copy.copy(target)
+        staged.model_columns = dict(target.model_columns)
+        destination.database.target = staged
+        started = time.monotonic()
+        try:
+            operation = getattr(destination.database, destination.operation)
+            exc = operation(destination.target_table, destination.schema, destination.primary_key_list, batch_size=batch_size, **destination.options)
+            if isinstance(exc, Exception):
+                raise exc
+        except Exception as e:
+            logger.exception(f"Fan-out load into {destination} failed.")
+            return FanOutResult(destination, e, time.monotonic() - started)
+        return FanOutResult(destination, None, time.monotonic() - started)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(destinations) or 1) as pool:
+        results = list(pool.map(load, destinations))
+
+    for result in results:
+        logger.info(repr(result))
+    return results
@@ -0,0 +1,63 @@
+'''Local record of which chunks of a long load have committed, so a failed load can resume.'''
+
+import sqlite3
+import threading
+
+class LoadJournal(object):
+    '''
+    SQLite file of committed chunk numbers per (scope, load_id), where scope is
+    the destination table and load_id is whatever the caller uses to name one
+    load across its retries (a run id, a file name, an export date). A retry
+    with the same load_id and the same staged data skips the chunks recorded
+    here and loads the rest into the same staging table.
+
+    Chunks are numbered in staging order, so a resumed load has to be staged
+    from the same data in the same order and with the same batch_size. Entries
+    are removed once the load completes.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS loads (scope TEXT, load_id TEXT, batch_size INTEGER, staging_table TEXT, PRIMARY KEY (scope, load_id))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS load_chunks (scope TEXT, load_id TEXT, chunk INTEGER, rows INTEGER, PRIMARY KEY (scope, load_id, chunk))")
+        self.db.commit()
+
+    def begin(self, scope, load_id: str, batch_size: int, staging_table=None):
+        '''
+        Start load_id, or pick it up again after a failure. Returns the staging
+        table recorded for it, which is staging_table for a new load.
+        '''
+        with self.lock:
+            found = self.db.execute("SELECT batch_size, staging_table FROM loads WHERE scope = ? AND load_id = ?", [scope, load_id]).fetchone()
+            if found is None:
+                self.db.execute("INSERT INTO loads (scope, load_id, batch_size, staging_table) VALUES (?, ?, ?, ?)", [scope, load_id, batch_size, staging_table])
+                self.db.commit()
+                return staging_table
+        if found[0] != batch_size:
+            raise ValueError(f"Load {load_id} was started with batch_size {found[0]}; resume it with the same batch_size so the chunks line up.")
+        return found[1]
+
+    def committed_chunks(self, scope, load_id: str):
+        with self.lock:
+            return set([chunk for chunk, in self.db.execute("SELECT chunk FROM load_chunks WHERE scope = ? AND load_id = ?", [scope, load_id])])
+
+    def committed_rows(self, scope, load_id: str):
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(SUM(rows), 0) FROM load_chunks WHERE scope = ? AND load_id = ?", [scope, load_id]).fetchone()[0]
+
+    def record(self, scope, load_id: str, chunk: int, rows: int):
+        '''Note that chunk committed. Call only after the database commit went through.'''
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO load_chunks (scope, load_id, chunk, rows) VALUES (?, ?, ?, ?)", [scope, load_id, chunk, rows])
+            self.db.commit()
+
+    def finish(self, scope, load_id: str):
+        '''Forget load_id once it has fully committed.'''
+        with self.lock:
+            self.db.execute("DELETE FROM load_chunks WHERE scope = ? AND load_id = ?", [scope, load_id])
+            self.db.execute("DELETE FROM loads WHERE scope = ? AND load_id = ?", [scope, load_id])
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
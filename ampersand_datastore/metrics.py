@@ -0,0 +1,151 @@
+'''Opt-in timing and counters for the phases of a load.'''
+
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class NullPhase(object):
+    '''What Database.phase hands out when metrics are off: a context manager that does nothing.'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+
+class Phase(object):
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.started)
+        return False
+
+class Load(object):
+    def __init__(self, metrics, label):
+        self.metrics = metrics
+        self.label = label
+        self.succeeded = True
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        with self.metrics.lock:
+            self.metrics.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self.metrics.lock:
+            self.metrics.depth -= 1
+            outermost = self.metrics.depth == 0
+        if outermost:
+            self.metrics.finish(self.label, time.perf_counter() - self.started, self.succeeded and exc is None)
+        return False
+
+class LoadMetrics(object):
+    '''
+    Seconds spent per phase (stage, read, encode, execute, commit, merge, ...)
+    and rows/bytes/chunks/retries counted since the last report. Attach one
+    with Database.instrument.
+
+    sink, if given, is called with a dict for every finished phase
+    ({'event': 'phase', 'phase', 'seconds'}) and once per top-level load with
+    the summary ({'event': 'load', 'load', 'seconds', 'phases', 'counts'}).
+    Phases timed on parallel_send workers overlap, so their seconds can add
+    up to more than the load's wall time.
+    '''
+    def __init__(self, sink=None, log_summary=True):
+        self.sink = sink
+        self.log_summary = log_summary
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.last = None
+        self.reset()
+
+    def reset(self):
+        self.phases = {}
+        self.counts = {'rows': 0, 'bytes': 0, 'chunks': 0, 'retries': 0}
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        if self.sink is not None:
+            self.sink({'event': 'phase', 'phase': name, 'seconds': seconds})
+
+    def count(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.counts[name] = self.counts.get(name, 0) + amount
+
+    def timed(self, name, iterable):
+        '''Pass iterable through, timing how long each item takes to produce under phase name.'''
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.record(name, time.perf_counter() - started)
+                return
+            self.record(name, time.perf_counter() - started)
+            yield item
+
+    def load(self, label):
+        '''
+        Bracket one load. Nested loads (append_object inside upsert_object)
+        fold into the outermost, which reports and resets when it exits.
+        '''
+        return Load(self, label)
+
+    def finish(self, label, seconds, succeeded):
+        with self.lock:
+            summary = {
+                'event': 'load',
+                'load': label,
+                'succeeded': succeeded,
+                'seconds': seconds,
+                'phases': dict(self.phases),
+                'counts': dict(self.counts)
+            }
+            self.reset()
+        self.last = summary
+        if self.log_summary:
+            logger.info(self.report(summary))
+        if self.sink is not None:
+            self.sink(summary)
+
+    def report(self, summary=None):
+        '''One readable line for a load summary, the last one by default.'''
+        if summary is None:
+            summary = self.last
+        counts = summary['counts']
+        phases = ', '.join([f"{name} {seconds:.3f}s" for name, seconds in sorted(summary['phases'].items(), key=lambda item: -item[1])])
+        rate = counts['rows'] / summary['seconds'] if summary['seconds'] > 0 else 0.0
+        status = 'done' if summary['succeeded'] else 'FAILED'
+        return (f"{summary['load']} {status} in {summary['seconds']:.3f}s: {counts['rows']} rows ({rate:.0f}/s), "
+                f"{counts['bytes']} bytes, {counts['chunks']} chunks, {counts['retries']} retries. Phases: {phases}")
+
+def measured_load(method):
+    '''Decorate a connector's append/upsert so each call is reported as one load when metrics are on.'''
+    @functools.wraps(method)
+    def run(self, target_table, schema, *args, **kwargs):
+        if self.metrics is None:
+            return method(self, target_table, schema, *args, **kwargs)
+        with self.metrics.load(f"{type(self).__name__}.{method.__name__} {schema}.{target_table}") as load:
+            result = method(self, target_table, schema, *args, **kwargs)
+            # Snowflake returns its errors instead of raising them
+            if isinstance(result, Exception):
+                load.succeeded = False
+            return result
+    return run
@@ -0,0 +1,216 @@
+'''Process-wide pool of open connections, shared by every Database instance.'''
+
+import atexit
+import hashlib
+import json
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class ConnectionPool(object):
+    '''
+    Keeps idle connections around per (connector, creds) key so the next
+    instance with the same creds can skip the connect/auth handshake.
+
+    max_size caps the connections open per key, checked out or idle; checkout
+    waits up to checkout_timeout seconds for one to come back once the cap is
+    hit. Connections idle for more than idle_timeout seconds are closed, and
+    ones idle for more than ping_after seconds are pinged before reuse.
+
+    Checked-out connections are tracked by weak reference, so one that's
+    dropped without being checked in gives its slot back once it's garbage
+    collected instead of holding it for the life of the process.
+
+    Connecting, pinging and closing all happen outside the pool's lock.
+    '''
+    def __init__(self, max_size=8, idle_timeout=300, checkout_timeout=60, ping_after=30):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.ping_after = ping_after
+        self.condition = threading.Condition()
+        self.idle = {}
+        self.open_count = {}
+        self.borrowed = {}
+        self.leaked = deque()
+        self.counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'unhealthy': 0, 'leaked': 0, 'connect_seconds': 0.0}
+
+    def key(self, connector: str, creds: dict):
+        '''Hash the creds so the pool never holds on to passwords in its keys.'''
+        digest = hashlib.sha256(json.dumps(creds, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return (connector, digest)
+
+    def close_quietly(self, cxn):
+        try:
+            cxn.close()
+        except Exception:
+            logger.exception("Failed to close pooled connection.")
+
+    def evict_idle(self):
+        '''
+        Take connections that have sat idle past idle_timeout out of the pool.
+        Call with the condition held, and close what it returns after letting go.
+        '''
+        cutoff = time.monotonic() - self.idle_timeout
+        evicted = []
+        for key, entries in self.idle.items():
+            stale = [entry for entry in entries if entry[1] < cutoff]
+            for entry in stale:
+                entries.remove(entry)
+                self.open_count[key] -= 1
+                self.counts['evictions'] += 1
+                evicted.append(entry[0])
+        if len(evicted) > 0:
+            self.condition.notify_all()
+        return evicted
+
+    def track(self, key, cxn):
+        '''Watch a checked-out connection so its slot comes back if it's collected without a checkin. Call with the condition held.'''
+        try:
+            finalizer = weakref.finalize(cxn, self.leaked.append, key)
+        except TypeError:
+            # a driver whose connections can't be weakly referenced just isn't tracked
+            return
+        finalizer.atexit = False
+        self.borrowed[id(cxn)] = finalizer
+
+    def untrack(self, cxn):
+        finalizer = self.borrowed.pop(id(cxn), None)
+        if finalizer is not None:
+            finalizer.detach()
+
+    def reclaim_leaked(self):
+        '''Free the slots of connections collected while checked out. Call with the condition held.'''
+        if len(self.leaked) == 0:
+            return
+        while len(self.leaked) > 0:
+            key = self.leaked.popleft()
+            self.open_count[key] -= 1
+            self.counts['leaked'] += 1
+            logger.warning(f"A {key[0]} connection was garbage collected without being checked in; freeing its pool slot.")
+        for ident in [ident for ident, finalizer in self.borrowed.items() if not finalizer.alive]:
+            del self.borrowed[ident]
+        self.condition.notify_all()
+
+    def checkout(self, key, connect, healthy=None):
+        '''
+        Hand out an idle connection for key, or open one with connect() when
+        there isn't one. healthy(cxn, ping) is checked before an idle connection
+        is reused, with ping True once it has been idle past ping_after;
+        unhealthy ones are closed and replaced.
+        '''
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            cxn = None
+            with self.condition:
+                while True:
+                    self.reclaim_leaked()
+                    evicted = self.evict_idle()
+                    entries = self.idle.setdefault(key, [])
+                    if len(entries) > 0:
+                        # still counted in open_count, so the slot stays taken while it's checked
+                        cxn, idle_since = entries.pop()
+                        break
+                    if self.open_count.get(key, 0) < self.max_size:
+                        self.open_count[key] = self.open_count.get(key, 0) + 1
+                        self.counts['misses'] += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No pooled connection came back within {self.checkout_timeout}s (max_size {self.max_size}).")
+                    # wake up now and then to pick up slots freed by garbage collection
+                    self.condition.wait(min(remaining, 1.0))
+            for stale in evicted:
+                self.close_quietly(stale)
+            if cxn is None:
+                break
+            if healthy is None or healthy(cxn, time.monotonic() - idle_since >= self.ping_after):
+                with self.condition:
+                    self.counts['hits'] += 1
+                    self.track(key, cxn)
+                return cxn
+            with self.condition:
+                self.open_count[key] -= 1
+                self.counts['unhealthy'] += 1
+                self.condition.notify_all()
+            self.close_quietly(cxn)
+
+        started = time.monotonic()
+        try:
+            cxn = connect()
+        except Exception:
+            with self.condition:
+                self.open_count[key] -= 1
+                self.condition.notify_all()
+            raise
+        with self.condition:
+            self.counts['connect_seconds'] += time.monotonic() - started
+            self.track(key, cxn)
+        return cxn
+
+    def checkin(self, key, cxn):
+        '''Roll back whatever the borrower left open and put the connection back for reuse.'''
+        try:
+            cxn.rollback()
+            reusable = True
+        except Exception:
+            logger.exception("Pooled connection failed to roll back; closing it instead of reusing it.")
+            reusable = False
+
+        with self.condition:
+            self.untrack(cxn)
+            if reusable:
+                self.idle.setdefault(key, []).append((cxn, time.monotonic()))
+            else:
+                self.open_count[key] -= 1
+            evicted = self.evict_idle()
+            self.condition.notify_all()
+        if not reusable:
+            self.close_quietly(cxn)
+        for stale in evicted:
+            self.close_quietly(stale)
+
+    def discard(self, key, cxn):
+        '''Close a checked-out connection instead of returning it.'''
+        with self.condition:
+            self.untrack(cxn)
+            self.open_count[key] -= 1
+            self.condition.notify_all()
+        self.close_quietly(cxn)
+
+    def close_all(self):
+        '''Close every idle connection. Checked-out ones are left alone.'''
+        closing = []
+        with self.condition:
+            for key, entries in self.idle.items():
+                for cxn, _ in entries:
+                    self.open_count[key] -= 1
+                    closing.append(cxn)
+                entries.clear()
+            self.condition.notify_all()
+        for cxn in closing:
+            self.close_quietly(cxn)
+
+    def stats(self):
+        '''
+        Hit/miss/eviction counts plus how many connections are open and idle right
+        now. saved_seconds estimates the handshake time hits avoided, from the
+        average time the misses spent connecting.
+        '''
+        with self.condition:
+            stats = dict(self.counts)
+            if stats['misses'] > 0:
+                stats['saved_seconds'] = stats['hits'] * stats['connect_seconds'] / stats['misses']
+            else:
+                stats['saved_seconds'] = 0.0
+            stats['open'] = sum(self.open_count.values())
+            stats['idle'] = sum(len(entries) for entries in self.idle.values())
+            stats['checked_out'] = stats['open'] - stats['idle']
+        return stats
+
+connection_pool = ConnectionPool()
+atexit.register(connection_pool.close_all)
@@ -1,4 +1,17 @@
 from .datastore import Database
+from .cache import statement_cache
+from .cleaning import is_null, to_bool
+from .metrics import measured_load
+
+import datetime
+import io
+import json
+import logging
+import queue
+import struct
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 ## this is clumsy but its better than before
 def import_psycopg2():
@@ -14,6 +27,113 @@ def import_execute():
     from psycopg2.extras import execute_values
     return execute_values
 
+## COPY ... WITH (FORMAT binary) framing and per-type encoders
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+COPY_BINARY_TRAILER = struct.pack('!h', -1)
+COPY_BINARY_NULL = struct.pack('!i', -1)
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+
+def parse_timestamp(value):
+    if type(value) == str:
+        value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value
+
+def pack_timestamp(value):
+    delta = value - PG_EPOCH
+    return struct.pack('!q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+def encode_timestamp(value):
+    # like the text input for timestamp without time zone, any offset is ignored
+    return pack_timestamp(parse_timestamp(value).replace(tzinfo=None))
+
+def encode_timestamptz(value):
+    # naive values are taken as UTC
+    value = parse_timestamp(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return pack_timestamp(value)
+
+def utc_timestamp_text(value):
+    '''timestamptz text for csv COPY, with naive values taken as UTC like encode_timestamptz does.'''
+    value = parse_timestamp(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.isoformat()
+
+def encode_date(value):
+    if type(value) == str:
+        value = datetime.date.fromisoformat(value[:10])
+    if isinstance(value, datetime.datetime):
+        # pd.Timestamp out of dataframes too
+        value = value.date()
+    return struct.pack('!i', (value - PG_EPOCH.date()).days)
+
+def encode_bool(value):
+    if type(value) != bool:
+        # numpy bools out of dataframes, and text like 'f' that postgres would read as false
+        try:
+            converted = to_bool(value.item() if hasattr(value, 'item') else value)
+        except (KeyError, TypeError):
+            converted = None
+        if converted is None:
+            raise ValueError(f"{value!r} isn't a boolean")
+        value = converted
+    return struct.pack('!?', value)
+
+def encode_text(value):
+    if type(value) == dict:
+        value = json.dumps(value)
+    return str(value).encode('utf-8')
+
+BINARY_ENCODERS = {
+    'smallint': lambda value: struct.pack('!h', int(value)),
+    'int2': lambda value: struct.pack('!h', int(value)),
+    'int': lambda value: struct.pack('!i', int(value)),
+    'integer': lambda value: struct.pack('!i', int(value)),
+    'int4': lambda value: struct.pack('!i', int(value)),
+    'bigint': lambda value: struct.pack('!q', int(value)),
+    'int8': lambda value: struct.pack('!q', int(value)),
+    'real': lambda value: struct.pack('!f', float(value)),
+    'float4': lambda value: struct.pack('!f', float(value)),
+    'float': lambda value: struct.pack('!d', float(value)),
+    'float8': lambda value: struct.pack('!d', float(value)),
+    'double precision': lambda value: struct.pack('!d', float(value)),
+    'boolean': encode_bool,
+    'bool': encode_bool,
+    'text': encode_text,
+    'varchar': encode_text,
+    'character varying': encode_text,
+    'json': encode_text,
+    'jsonb': lambda value: b'\x01' + encode_text(value),
+    'timestamp': encode_timestamp,
+    'timestamp without time zone': encode_timestamp,
+    'timestamptz': encode_timestamptz,
+    'timestamp with time zone': encode_timestamptz,
+    'date': encode_date,
+}
+
+## csv COPY writes most values as str() does; these types need converting first
+CSV_CONVERSIONS = {
+    'timestamptz': utc_timestamp_text,
+    'timestamp with time zone': utc_timestamp_text,
+}
+
+def column_type(typ: str):
+    return typ.lower().split('(')[0].strip()
+
+class ShardedUpsertError(Exception):
+    '''Raised by a sharded upsert that failed, with every failed shard's exception in errors.'''
+    def __init__(self, errors: dict):
+        self.errors = errors
+        super().__init__(f"{len(errors)} shard(s) of the upsert failed: " + '; '.join([f"shard {shard}: {exc!r}" for shard, exc in sorted(errors.items())]))
+
+def shard_of(key: tuple, shards: int):
+    try:
+        return hash(key) % shards
+    except TypeError:
+        # lists and dicts in the key
+        return hash(json.dumps(key, default=str)) % shards
+
 class Postgres(Database):
     '''Connection to a postgres database.'''
     def __init__(self):
@@ -28,16 +148,25 @@ class Postgres(Database):
         self.cxn = self.psycopg2.connect(**creds)
         self.logger.info(f"Set up connection to {creds['dbname']} Postgres db successfully.")
 
-    def get_cursor(self, creds, cursor_type=False):
+    def open_worker_connection(self):
+        '''Open another connection with the creds this instance connected with.'''
+        if not hasattr(self, 'creds'):
+            raise AttributeError("No creds to open worker connections with. Run get_cursor first.")
+        return self.psycopg2.connect(**self.creds)
+
+    def connection_healthy(self, cxn, ping=False):
+        return cxn.closed == 0 and super().connection_healthy(cxn, ping)
+
+    def get_cursor(self, creds, cursor_type=False, pooled=False):
         '''
         Interface to connect to database and get a cursor. Will only connect
-        if there is no existing connection.
+        if there is no existing connection. With pooled, the connection comes
+        out of (and close_connection returns it to) the shared connection pool.
 
         Can pass keywords to cursor type to get different kinds of cursors. Currently
         implemented: 'dictcursor' and default cursor type.
         '''
-        if not hasattr(self, 'cxn'):
-            self.open_connection(creds)
+        self.ensure_connection(creds, pooled)
 
         if cursor_type == 'dictcursor':
             self.cursor = self.cxn.cursor(cursor_factory=self.dictCursor)
@@ -45,6 +174,32 @@ class Postgres(Database):
             self.cursor = self.cxn.cursor()
         self.logger.info("Cursor retrieved.")
 
+    def fetch_chunks(self, query, params=None, batch_size=5000):
+        '''
+        Run query on a named (server-side) cursor so Postgres holds the result
+        set and hands it over batch_size rows per round trip; batch_size is
+        also the cursor's itersize. The cursor lives in the connection's open
+        transaction, or is declared WITH HOLD on autocommit connections.
+        '''
+        cursor = self.cxn.cursor(name=f"ampersand_read_{uuid.uuid4().hex}", withhold=self.cxn.autocommit)
+        cursor.itersize = batch_size
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                yield [col[0] for col in cursor.description], rows
+        finally:
+            cursor.close()
+
+    def select_sql(self, target_table, schema, columns=None):
+        return self.sql.SQL("SELECT {columns} FROM {schema}.{target_table}").format(
+            columns = self.sql.SQL('*') if columns is None else self.sql.SQL(',').join([self.sql.Identifier(col) for col in columns]),
+            schema = self.sql.Identifier(schema),
+            target_table = self.sql.Identifier(target_table)
+        )
+
     def create_object(self, target_table: str, schema: str, primary_key_list: list):
         if not hasattr(self, 'target'):
             raise AttributeError("Target object not staged within Database object. Run stage_object first.")
@@ -53,6 +208,9 @@ class Postgres(Database):
         if len(self.type_conversion_dict) > 0:
             raise NotImplementedError("Type conversion not yet implemented for Postgres!")
 
+        if self.table_known(target_table, schema, primary_key_list):
+            return
+
         columns = self.sql.SQL("{columns}").format(
             columns = self.sql.SQL(",").join([
                     (self.sql.SQL("{col} {type}").format(col = self.sql.Identifier(col), type = self.sql.SQL(type))) for col, type in self.target.model_columns.items()
@@ -71,8 +229,10 @@ class Postgres(Database):
             columns = columns
         )
         self.logger.info(f"Creating table using the following SQL: {create_if_not_exists.as_string(self.cursor)}")
-        self.cursor.execute(create_if_not_exists)
-        self.cxn.commit()
+        with self.phase('create'):
+            self.cursor.execute(create_if_not_exists)
+            self.commit()
+        self.remember_table(target_table, schema, primary_key_list)
         self.logger.info("Created.")
 
     def drop_object(self, target_table, schema):
@@ -80,17 +240,19 @@ class Postgres(Database):
             raise AttributeError("Target object not staged within Database object. Run stage_object first.")
 
         drop_table = self.sql.SQL("DROP TABLE {schema}.{target_table}").format(schema=self.sql.Identifier(schema),target_table=self.sql.Identifier(target_table))
+        self.forget_table(target_table, schema)
         self.cursor.execute(drop_table)
-        self.cxn.commit()
+        self.commit()
         self.logger.info(f"Table {schema}.{target_table} dropped.")
 
-    def upsert_object(self, target_table, schema, primary_key_list):
-        '''Convenience wrapper to perform checks, drops and upserts as needed.'''
-        self.create_object(target_table, schema, primary_key_list)
-
-        upsert_sql = self.sql.SQL("""INSERT INTO {schema}.{target_table}
+    def build_upsert_sql(self, target_table, schema, primary_key_list, source):
+        '''
+        Compose INSERT ... ON CONFLICT DO UPDATE into schema.target_table. Source is
+        the sql.Composable that supplies the rows (a VALUES placeholder or a SELECT).
+        '''
+        return self.sql.SQL("""INSERT INTO {schema}.{target_table}
         ({col_string})
-        VALUES {val_string}
+        {source}
         ON CONFLICT ({primary_keys})
         DO
         UPDATE SET {update_cols}
@@ -100,7 +262,7 @@ class Postgres(Database):
                     col_string = self.sql.SQL(',').join([
                         self.sql.Identifier(field) for field in self.target.model_columns.keys()
                     ]),
-                    val_string = self.sql.Placeholder(),
+                    source = source,
                     primary_keys = self.sql.SQL(',').join([
                         self.sql.Identifier(pk) for pk in primary_key_list
                     ]),
@@ -109,14 +271,366 @@ class Postgres(Database):
                     ])
                    )
 
-        self.logger.info(f"Using this SQL to upsert: {upsert_sql.as_string(self.cursor)}")
-        self.execute_values(
-            self.cursor,
-            upsert_sql,
-            self.target.formatted_data,
-            self.sql.SQL("({arglist})").format(arglist=self.sql.SQL(',').join([self.sql.Placeholder(col) for col in self.target.model_columns.keys()]))
+    @measured_load
+    def upsert_object(self, target_table, schema, primary_key_list, batch_size=5000, method='values', copy_format='csv', delta_index=None, journal=None, load_id=None, parallelism=1, page_size=100, dedupe=None, coerce=False):
+        '''
+        Convenience wrapper to perform checks, drops and upserts as needed.
+
+        Rows are sent batch_size at a time and committed once at the end, so
+        streamed targets never have to be held in memory all at once. Inside a
+        load_batch nothing is committed until the batch is.
+
+        method: 'values' sends the rows through execute_values as INSERT ... VALUES.
+        'copy' streams them into a session temp table with COPY FROM STDIN in
+        copy_format ('csv' or 'binary') and merges that into the target with a
+        single INSERT ... SELECT ... ON CONFLICT. Much faster for big loads.
+
+        delta_index: a delta.RowHashIndex. Only rows that are new or changed since
+        the last committed load through that index are sent.
+
+        journal, load_id: a journal.LoadJournal and a name for this load that
+        stays the same across retries, to make a big load resumable. Every batch
+        is committed on its own and recorded in the journal, and a retry of a
+        failed load skips the batches that already committed. 'values' then
+        upserts straight into the target batch by batch; 'copy' copies into an
+        unlogged staging table that survives the failure and is only merged
+        (and dropped) once every batch is in.
+
+        parallelism: split the rows into this many shards by primary key and
+        upsert the shards at once, each on its own connection; see sharded_upsert.
+
+        page_size: rows per statement execute_values renders for 'values'.
+
+        dedupe: 'last' or 'first' to drop rows repeating a primary key before
+        loading, keeping the last or first row per key, since ON CONFLICT can't
+        update a row twice in one statement. See clean_staged.
+
+        coerce: True to coerce the staged rows before anything is sent; see check_staged.
+        '''
+        if method not in ('values', 'copy'):
+            raise ValueError(f"Unknown upsert method {method} -- use 'values' or 'copy'.")
+        if method == 'copy' and copy_format == 'binary':
+            unsupported = self.unsupported_binary_columns()
+            if len(unsupported) > 0:
+                self.logger.warning(f"Binary COPY doesn't support {', '.join([f'{col} ({typ})' for col, typ in unsupported])}; using copy_format='csv' instead.")
+                copy_format = 'csv'
+        if parallelism > 1 and (journal is not None or self.batch is not None):
+            raise ValueError("Sharded upserts commit on their own connections, so they can't be resumable or run inside a load batch.")
+
+        self.check_staged(primary_key_list, dedupe, coerce, batch_size)
+        self.create_object(target_table, schema, primary_key_list)
+
+        staging_table = None
+        try:
+            if delta_index is not None:
+                self.stage_delta(delta_index, target_table, schema, primary_key_list, batch_size)
+            if journal is not None:
+                staging_table = self.stage_resume(journal, load_id, target_table, schema, batch_size, f"{target_table}_resume_{uuid.uuid4().hex[:12]}" if method == 'copy' else None)
+            if parallelism > 1:
+                self.sharded_upsert(target_table, schema, primary_key_list, batch_size, method, copy_format, parallelism, page_size)
+            elif method == 'copy':
+                self.copy_upsert(target_table, schema, primary_key_list, batch_size, copy_format, staging_table)
+            else:
+                if staging_table is not None:
+                    raise ValueError(f"Load {load_id} was started with method='copy' and has rows waiting in {staging_table}; resume it with method='copy'.")
+                self.values_upsert(target_table, schema, primary_key_list, batch_size, resumable=journal is not None, page_size=page_size)
+        except Exception:
+            self.finish_delta(False)
+            self.finish_resume(False)
+            raise
+        self.finish_delta(True)
+        self.finish_resume(True)
+
+    def values_statement(self, target_table, schema, primary_key_list):
+        return statement_cache.get(
+            ('postgres', 'values', schema, target_table, tuple(self.target.model_columns.keys()), tuple(primary_key_list)),
+            lambda: self.build_upsert_sql(target_table, schema, primary_key_list, self.sql.SQL("VALUES {val_string}").format(val_string = self.sql.Placeholder())).as_string(self.cursor)
         )
-        self.cxn.commit()
+
+    def copy_statements(self, target_table, schema, primary_key_list, copy_format):
+        return statement_cache.get(
+            ('postgres', 'copy', copy_format, schema, target_table, tuple(self.target.model_columns.keys()), tuple(primary_key_list)),
+            lambda: self.compile_copy_statements(target_table, schema, primary_key_list, copy_format)
+        )
+
+    def values_upsert(self, target_table, schema, primary_key_list, batch_size=5000, resumable=False, page_size=100):
+        '''Upsert through execute_values, committing once after the last batch (or after every batch if resumable).'''
+        upsert_sql = self.values_statement(target_table, schema, primary_key_list)
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Using this SQL to upsert: {upsert_sql}")
+        for batch in self.iter_batches(batch_size):
+            with self.phase('execute'):
+                self.execute_values(self.cursor, upsert_sql, batch, page_size=page_size)
+            self.count(rows=len(batch), chunks=1)
+            if resumable:
+                with self.phase('commit'):
+                    self.commit()
+                self.checkpoint()
+        with self.phase('commit'):
+            self.commit()
+
+    def copy_upsert(self, target_table, schema, primary_key_list, batch_size=5000, copy_format='csv', staging_table=None):
+        '''
+        Bulk upsert through COPY. The temp table is built LIKE the target, so it
+        picks up whatever create_object made, and is dropped on commit or rollback
+        (or straight after the merge inside a load batch).
+
+        staging_table: copy into this unlogged table in schema instead, committing
+        and checkpointing every batch, for resumable loads. It's dropped after the merge.
+        '''
+        if copy_format not in ('csv', 'binary'):
+            raise ValueError(f"Unknown COPY format {copy_format} -- use 'csv' or 'binary'.")
+
+        if staging_table is None:
+            create_temp, copy_sql, upsert_sql = self.copy_statements(target_table, schema, primary_key_list, copy_format)
+        else:
+            # one-off names, not worth a statement cache entry
+            create_temp, copy_sql, upsert_sql = self.compile_copy_statements(target_table, schema, primary_key_list, copy_format, staging_table)
+
+        try:
+            self.cursor.execute(create_temp)
+            if staging_table is not None:
+                self.commit()
+            if copy_format == 'binary':
+                encoders = self.binary_encoders()
+            row_count = 0
+            for batch in self.iter_batches(batch_size):
+                with self.phase('encode'):
+                    if copy_format == 'binary':
+                        buffer = self.copy_binary_buffer(batch, encoders)
+                    else:
+                        buffer = self.copy_csv_buffer(batch)
+                with self.phase('execute'):
+                    self.cursor.copy_expert(copy_sql, buffer)
+                row_count += len(batch)
+                if self.metrics is not None:
+                    self.count(rows=len(batch), chunks=1, bytes=buffer.seek(0, io.SEEK_END))
+                if staging_table is not None:
+                    with self.phase('commit'):
+                        self.commit()
+                    self.checkpoint()
+            self.logger.info(f"Copied {row_count} rows into temp table; merging into {schema}.{target_table}.")
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(f"Using this SQL to upsert: {upsert_sql}")
+            with self.phase('merge'):
+                self.cursor.execute(upsert_sql)
+            if self.batch is not None:
+                # the batch commits later, so free the name for the next copy_upsert into this table
+                self.cursor.execute(self.sql.SQL("DROP TABLE {temp_table}").format(temp_table = self.sql.Identifier(f"{target_table}_copy_temp")))
+            elif staging_table is not None:
+                self.cursor.execute(self.sql.SQL("DROP TABLE {schema}.{staging_table}").format(schema = self.sql.Identifier(schema), staging_table = self.sql.Identifier(staging_table)))
+            with self.phase('commit'):
+                self.commit()
+        except Exception:
+            self.logger.exception(f"COPY upsert into {schema}.{target_table} failed; rolling back.")
+            self.cxn.rollback()
+            raise
+        self.logger.info("Committed upsert.")
+
+    def sharded_upsert(self, target_table, schema, primary_key_list, batch_size=5000, method='values', copy_format='csv', parallelism=4, page_size=100):
+        '''
+        Route every staged row to one of parallelism shards by a hash of its
+        primary key and upsert the shards concurrently, each on its own worker
+        connection and in its own transaction. No two shards touch the same key,
+        so the workers never wait on each other's row locks, and rows sharing a
+        key stay in order within their shard.
+
+        The workers wait for each other before committing and all roll back if
+        any shard failed, raising ShardedUpsertError with every shard's error.
+        A commit that fails after others went through can't be undone.
+        '''
+        columns = list(self.target.model_columns.keys())
+        positions = [columns.index(pk) for pk in primary_key_list]
+        if method == 'copy':
+            create_temp, copy_sql, upsert_sql = self.copy_statements(target_table, schema, primary_key_list, copy_format)
+            encoders = self.binary_encoders() if copy_format == 'binary' else None
+        else:
+            upsert_sql = self.values_statement(target_table, schema, primary_key_list)
+
+        # a couple of batches per shard in flight, so streamed targets stay bounded
+        queues = [queue.Queue(maxsize=2) for _ in range(parallelism)]
+        errors = {}
+        aborted = threading.Event()
+        barrier = threading.Barrier(parallelism)
+
+        def drain(shard):
+            batch = queues[shard].get()
+            while batch is not None:
+                yield batch
+                batch = queues[shard].get()
+
+        def apply(cursor, batches):
+            if method == 'copy':
+                cursor.execute(create_temp)
+            for batch in batches:
+                if method == 'copy':
+                    with self.phase('encode'):
+                        buffer = self.copy_binary_buffer(batch, encoders) if copy_format == 'binary' else self.copy_csv_buffer(batch)
+                    with self.phase('execute'):
+                        cursor.copy_expert(copy_sql, buffer)
+                else:
+                    with self.phase('execute'):
+                        self.execute_values(cursor, upsert_sql, batch, page_size=page_size)
+                self.count(rows=len(batch), chunks=1)
+            if method == 'copy':
+                with self.phase('merge'):
+                    cursor.execute(upsert_sql)
+
+        def work(shard):
+            cxn = None
+            try:
+                cxn = self.checkout_worker_connection()
+                cursor = cxn.cursor()
+                try:
+                    apply(cursor, drain(shard))
+                finally:
+                    cursor.close()
+            except Exception as e:
+                errors[shard] = e
+                # keep taking batches so the producer never blocks on this shard
+                for _ in drain(shard):
+                    pass
+            try:
+                barrier.wait()
+                if cxn is None:
+                    return
+                if len(errors) == 0 and not aborted.is_set():
+                    with self.phase('commit'):
+                        cxn.commit()
+                else:
+                    cxn.rollback()
+            except Exception as e:
+                errors.setdefault(shard, e)
+            finally:
+                if cxn is not None:
+                    self.release_worker_connection(cxn)
+
+        row_count = 0
+        buffers = [[] for _ in range(parallelism)]
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            for shard in range(parallelism):
+                pool.submit(work, shard)
+            try:
+                for batch in self.iter_batches(batch_size):
+                    for row in batch:
+                        shard = shard_of(tuple([row[position] for position in positions]), parallelism)
+                        buffers[shard].append(row)
+                        if len(buffers[shard]) >= batch_size:
+                            queues[shard].put(buffers[shard])
+                            buffers[shard] = []
+                    row_count += len(batch)
+                    if len(errors) > 0:
+                        break
+            except Exception:
+                aborted.set()
+                raise
+            finally:
+                for shard in range(parallelism):
+                    if len(buffers[shard]) > 0 and len(errors) == 0 and not aborted.is_set():
+                        queues[shard].put(buffers[shard])
+                    queues[shard].put(None)
+
+        if len(errors) > 0:
+            for shard in sorted(errors):
+                self.logger.error(f"Shard {shard} of the upsert into {schema}.{target_table} failed: {errors[shard]}")
+            raise ShardedUpsertError(errors)
+        self.logger.info(f"Upserted {row_count} rows into {schema}.{target_table} over {parallelism} shards.")
+
+    def compile_copy_statements(self, target_table, schema, primary_key_list, copy_format, staging_table=None):
+        '''Render the temp table DDL, the COPY and the merge for copy_upsert.'''
+        columns = list(self.target.model_columns.keys())
+        if staging_table is None:
+            temp_table = self.sql.Identifier(f"{target_table}_copy_temp")
+            create_temp = self.sql.SQL("CREATE TEMP TABLE {temp_table} (LIKE {schema}.{target_table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        else:
+            temp_table = self.sql.Identifier(schema, staging_table)
+            create_temp = self.sql.SQL("CREATE UNLOGGED TABLE IF NOT EXISTS {temp_table} (LIKE {schema}.{target_table} INCLUDING DEFAULTS)")
+        create_temp = create_temp.format(
+            temp_table = temp_table,
+            schema = self.sql.Identifier(schema),
+            target_table = self.sql.Identifier(target_table)
+        )
+        col_string = self.sql.SQL(',').join([self.sql.Identifier(col) for col in columns])
+        copy_sql = self.sql.SQL("COPY {temp_table} ({col_string}) FROM STDIN WITH (FORMAT {copy_format})").format(
+            temp_table = temp_table,
+            col_string = col_string,
+            copy_format = self.sql.SQL(copy_format)
+        )
+        upsert_sql = self.build_upsert_sql(target_table, schema, primary_key_list, self.sql.SQL("SELECT {col_string} FROM {temp_table}").format(
+            col_string = col_string,
+            temp_table = temp_table
+        ))
+        return tuple(statement.as_string(self.cursor) for statement in (create_temp, copy_sql, upsert_sql))
+
+    def copy_csv_value(self, value):
+        '''
+        Render one value for COPY's csv format. Everything non-null is quoted and
+        nulls are left empty, which is how COPY tells an empty string from a NULL.
+        '''
+        if is_null(value):
+            return ''
+        if type(value) in (list, tuple):
+            value = "{" + ",".join(['NULL' if item is None else '"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"' for item in value]) + "}"
+        elif type(value) == dict:
+            value = json.dumps(value)
+        return '"' + str(value).replace('"', '""') + '"'
+
+    def csv_conversions(self):
+        '''Per column, None or the conversion from CSV_CONVERSIONS its model_columns type needs.'''
+        return [CSV_CONVERSIONS.get(column_type(typ), None) for typ in self.target.model_columns.values()]
+
+    def copy_csv_buffer(self, batch):
+        '''Write a batch out as COPY csv.'''
+        conversions = self.csv_conversions()
+        converted = [position for position, convert in enumerate(conversions) if convert is not None]
+        buffer = io.StringIO()
+        for row in batch:
+            if len(converted) > 0:
+                row = list(row)
+                for position in converted:
+                    if not is_null(row[position]):
+                        row[position] = conversions[position](row[position])
+            buffer.write(','.join([self.copy_csv_value(value) for value in row]))
+            buffer.write('\n')
+        buffer.seek(0)
+        return buffer
+
+    def unsupported_binary_columns(self):
+        '''(column, type) for every model column binary COPY has no encoder for.'''
+        return [(col, typ) for col, typ in self.target.model_columns.items() if column_type(typ) not in BINARY_ENCODERS]
+
+    def binary_encoders(self):
+        '''
+        One encoder per column for COPY's binary format, picked from model_columns.
+        Binary COPY needs the exact wire type of each column, so anything not
+        covered here has to go through csv instead (upsert_object switches on its own).
+        '''
+        encoders = []
+        for col, typ in self.target.model_columns.items():
+            encoder = BINARY_ENCODERS.get(column_type(typ), None)
+            if encoder is None:
+                raise NotImplementedError(f"Binary COPY doesn't support the {typ} type of column {col} yet -- use copy_format='csv'.")
+            encoders.append(encoder)
+        return encoders
+
+    def copy_binary_buffer(self, batch, encoders):
+        '''Write a batch out as a complete COPY binary stream (header, tuples, trailer).'''
+        buffer = io.BytesIO()
+        buffer.write(COPY_BINARY_HEADER)
+        field_count = struct.pack('!h', len(encoders))
+        for row in batch:
+            buffer.write(field_count)
+            for encoder, value in zip(encoders, row):
+                if is_null(value):
+                    buffer.write(COPY_BINARY_NULL)
+                else:
+                    data = encoder(value)
+                    buffer.write(struct.pack('!i', len(data)))
+                    buffer.write(data)
+        buffer.write(COPY_BINARY_TRAILER)
+        buffer.seek(0)
+        return buffer
 
     def recreate_object(self, target_table, schema, primary_key_list):
         '''Convenience wrapper for drop and create methods.'''
@@ -0,0 +1,71 @@
+'''Name -> connector class lookup, importing each connector module only when it's asked for.'''
+
+import importlib
+import threading
+
+ENTRY_POINT_GROUP = 'ampersand_datastore.connectors'
+
+class ConnectorRegistry(object):
+    '''
+    Connectors are registered as 'module:Class' strings (or classes) under a
+    lowercase name and only imported by get. Third-party packages can add
+    theirs from setup.py without this package importing them up front:
+
+        entry_points={'ampersand_datastore.connectors': ['redshift = my_package.redshift:Redshift']}
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connectors = {}
+        self.entry_points_loaded = False
+
+    def register(self, name: str, connector):
+        with self.lock:
+            self.connectors[name.lower()] = connector
+
+    def load_entry_points(self):
+        '''Pick up connectors other packages advertise, once per process.'''
+        if self.entry_points_loaded:
+            return
+        from importlib.metadata import entry_points
+        try:
+            found = entry_points(group=ENTRY_POINT_GROUP)
+        except TypeError:
+            # python 3.9 doesn't take group yet
+            found = entry_points().get(ENTRY_POINT_GROUP, [])
+        with self.lock:
+            for entry_point in found:
+                self.connectors.setdefault(entry_point.name.lower(), entry_point.value)
+            self.entry_points_loaded = True
+
+    def get(self, name: str):
+        '''The connector class registered as name, importing its module on first use.'''
+        key = name.lower()
+        if key not in self.connectors:
+            self.load_entry_points()
+        with self.lock:
+            connector = self.connectors.get(key, None)
+        if connector is None:
+            raise ValueError(f"No connector registered as {name} -- known connectors: {', '.join(self.names())}.")
+        if type(connector) == str:
+            module_name, _, class_name = connector.partition(':')
+            connector = getattr(importlib.import_module(module_name), class_name)
+            with self.lock:
+                self.connectors[key] = connector
+        return connector
+
+    def names(self):
+        self.load_entry_points()
+        with self.lock:
+            return sorted(self.connectors)
+
+connector_registry = ConnectorRegistry()
+connector_registry.register('postgres', 'ampersand_datastore.postgres:Postgres')
+connector_registry.register('snowflake', 'ampersand_datastore.snowflake:Snowflake')
+connector_registry.register('bigquery', 'ampersand_datastore.bigquery:BigQuery')
+
+def register_connector(name: str, connector):
+    '''Make connector (a Database subclass or a 'module:Class' string) available as get_connector(name).'''
+    connector_registry.register(name, connector)
+
+def get_connector(name: str):
+    return connector_registry.get(name)
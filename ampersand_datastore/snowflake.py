@@ -1,12 +1,55 @@
-from ampersand_datastore.datastore import Database
+from ampersand_datastore.datastore import Database, import_pandas
+from ampersand_datastore.cache import statement_cache
+from ampersand_datastore.chunking import AdaptiveChunker, MAX_BYTES
+from ampersand_datastore.metrics import measured_load
 import os
+import io
+import gzip
 import json
 import logging
+import tempfile
+import uuid
 
 def import_snowflake():
     import snowflake.connector
     return snowflake.connector
 
+def import_parquet():
+    import pyarrow
+    import pyarrow.parquet
+    return pyarrow, pyarrow.parquet
+
+## stands in for the per-load staging table name in cached MERGE statements
+STAGING_TABLE = '{staging_table}'
+
+## the messages Snowflake rejects an oversized statement or bind set with
+CHUNK_TOO_LARGE_ERRORS = (
+    'statement is too large',
+    'statement size exceeds',
+    'request entity too large',
+    'number of binding variables exceeds',
+    'too many bind variables',
+)
+
+## parquet stage file types for model_columns types that have a native one; the rest are written as text
+PARQUET_TYPES = {
+    'int': 'int64',
+    'integer': 'int64',
+    'bigint': 'int64',
+    'smallint': 'int64',
+    'float': 'float64',
+    'double': 'float64',
+    'real': 'float64',
+    'boolean': 'bool_',
+}
+
+## conversions applied in the SELECT list when loading string-ish values
+SELECT_CONVERSIONS = {
+    'ARRAY': 'PARSE_JSON',
+    'timestamp': 'TO_TIMESTAMP',
+    'date': 'TO_DATE'
+}
+
 class Snowflake(Database):
     '''Connection to a particular Snowflake instance.'''
     def __init__(self):
@@ -68,22 +111,59 @@ class Snowflake(Database):
         self.cxn = self.snow.connect(**creds)
         self.logger.info(f"Set up connection to {creds['account']} Snowflake instance successfully.")
 
-    def get_cursor(self, creds, cursor_type=False):
+    def open_worker_connection(self):
+        '''Open another connection with the creds this instance connected with.'''
+        if not hasattr(self, 'creds'):
+            raise AttributeError("No creds to open worker connections with. Run get_cursor first.")
+        return self.snow.connect(**self.creds)
+
+    def connection_healthy(self, cxn, ping=False):
+        return not cxn.is_closed() and super().connection_healthy(cxn, ping)
+
+    def get_cursor(self, creds, cursor_type=False, pooled=False):
         '''
         Interface to connect to database and get a cursor. Will only connect
-        if there is no existing connection.
+        if there is no existing connection. With pooled, the connection comes
+        out of (and close_connection returns it to) the shared connection pool.
 
         Can pass keywords to cursor type to get different kinds of cursors. Currently
         implemented: default cursor type.
         '''
-        if not hasattr(self, 'cxn'):
-            self.open_connection(creds)
+        self.ensure_connection(creds, pooled)
 
         self.cursor = self.cxn.cursor()
         self.logger.info("Cursor retrieved.")
 
-    def create_object(self, target_table: str, schema: str, primary_key_list: list):
-        '''Create table corresponding to object in target database.'''
+    def fetch_chunks(self, query, params=None, batch_size=5000):
+        '''
+        Walk the query's result batches, the chunks Snowflake already splits
+        results into; each is only downloaded when it's iterated. Chunk sizes
+        are Snowflake's, so batch_size doesn't apply.
+        '''
+        cursor = self.cxn.cursor()
+        try:
+            cursor.execute(query, params)
+            columns = [col[0] for col in cursor.description]
+            for batch in cursor.get_result_batches() or []:
+                yield columns, batch
+        finally:
+            cursor.close()
+
+    def read_frames(self, query, params=None, batch_size=5000):
+        '''One DataFrame per result batch, converted straight from Arrow where the result came back as Arrow.'''
+        for columns, batch in self.fetch_chunks(query, params, batch_size):
+            try:
+                yield batch.to_pandas()
+            except self.snow.NotSupportedError:
+                # JSON result format; build it from the rows instead
+                yield import_pandas().DataFrame.from_records(list(batch), columns=columns)
+
+    def select_sql(self, target_table, schema, columns=None):
+        col_string = '*' if columns is None else ','.join([self.check_safe(col) for col in columns])
+        return f"SELECT {col_string} FROM {self.check_safe(schema)}.{self.check_safe(target_table)}"
+
+    def create_object(self, target_table: str, schema: str, primary_key_list: list, table_type=None):
+        '''Create table corresponding to object in target database. table_type: e.g. 'temporary' or 'transient'.'''
         if not hasattr(self, 'target'):
             raise AttributeError("Target object not staged within Database object. Run stage_object first.")
 
@@ -94,6 +174,9 @@ class Snowflake(Database):
                     self.logger.info(f"Debugging: converting {typ} to {converted_type}")
                     self.target.model_columns[col] = converted_type
 
+        if self.table_known(target_table, schema, primary_key_list):
+            return
+
         columns = ",".join([
             "{col} {typ}".format(col = self.check_safe(col), typ = self.check_safe(typ)) for col, typ in self.target.model_columns.items()
         ])
@@ -107,14 +190,17 @@ class Snowflake(Database):
                     ])),
                 columns = columns)
 
-        create_if_not_exists = "CREATE TABLE IF NOT EXISTS {schema}.{target_table} ({columns})".format(
+        create_if_not_exists = "CREATE {table_type}TABLE IF NOT EXISTS {schema}.{target_table} ({columns})".format(
+            table_type = '' if table_type is None else f"{table_type.upper()} ",
             schema = self.check_safe(schema),
             target_table = self.check_safe(target_table),
             columns = columns
         )
         self.logger.info(f"Creating table using the following SQL: {create_if_not_exists}")
-        self.cursor.execute(create_if_not_exists)
-        self.cxn.commit()
+        with self.phase('create'):
+            self.cursor.execute(create_if_not_exists)
+            self.cxn.commit()
+        self.remember_table(target_table, schema, primary_key_list)
         self.logger.info("Created.")
 
     def drop_object(self, target_table, schema):
@@ -123,75 +209,86 @@ class Snowflake(Database):
             raise AttributeError("Target object not staged within Database object. Run stage_object first.")
 
         drop_table = "DROP TABLE IF EXISTS {schema}.{target_table}".format(schema=self.check_safe(schema),target_table=self.check_safe(target_table))
+        self.forget_table(target_table, schema)
         self.cursor.execute(drop_table)
         self.cxn.commit()
         self.logger.info(f"Table {schema}.{target_table} dropped.")
 
-    def upsert_object(self, target_table, schema, primary_key_list, update_existing=True):
-        '''Convenience wrapper to perform checks, drops and upserts as needed.'''
+    @measured_load
+    def upsert_object(self, target_table, schema, primary_key_list, update_existing=True, batch_size=5000, method='literal', file_format='csv', stage='temporary', parallelism=1, delta_index=None, chunk_bytes=None, journal=None, load_id=None, dedupe=None, coerce=False):
+        '''
+        Convenience wrapper to perform checks, drops and upserts as needed.
+        Method, parallelism, chunk_bytes and coerce work as in append_object.
+        If any chunk fails the temp table is dropped and nothing is merged.
+
+        dedupe: 'last' or 'first' to drop rows repeating a primary key before
+        loading, keeping the last or first row per key, so the MERGE never sees
+        a key twice. See clean_staged.
+
+        Every upsert stages into its own uniquely named table (see
+        staging_table_type), so any number of loaders can upsert into the same
+        target at once. Parallel and resumable upserts stage into TRANSIENT
+        tables, which outlive the session: if the process dies before it can
+        drop one, it stays behind until drop_orphaned_staging_tables sweeps it.
+
+        Errors are logged and rolled back rather than raised; the exception is returned.
+
+        delta_index: a delta.RowHashIndex. Only rows that are new or changed since
+        the last committed load through that index are sent.
+
+        Inside a load_batch the temp table is loaded right away but the MERGE
+        runs when the batch commits, and failures raise.
+
+        journal, load_id: make the load resumable (see append_object). A failed
+        upsert then keeps its temp table, and a retry with the same load_id
+        only loads the chunks that hadn't committed to it before merging.
+        '''
+        deferred = False
+        merged = False
+        temp_table = f"{target_table}_temp_{uuid.uuid4().hex}"
+        table_type = self.staging_table_type(parallelism, resumable=journal is not None)
+        if journal is not None:
+            self.check_resumable(method, parallelism, chunk_bytes)
+        if len(primary_key_list) == 0:
+            self.logger.error("No primary keys declared for table -- you cannot upsert without at least one. Appending is still an option.")
+            raise ValueError
+        # before the try, so nothing -- not even the temp table's cleanup -- is sent for rows that fail
+        self.check_staged(primary_key_list, dedupe, coerce, batch_size)
         try:
             self.create_object(target_table, schema, primary_key_list)
 
-            if len(primary_key_list) == 0:
-                self.logger.error("No primary keys declared for table -- you cannot upsert without at least one. Appending is still an option.")
-                raise ValueError
+            if delta_index is not None:
+                self.stage_delta(delta_index, target_table, schema, primary_key_list, batch_size)
+            if journal is not None:
+                temp_table = self.stage_resume(journal, load_id, target_table, schema, batch_size, temp_table)
 
             ## LOAD TEMP TABLE
             self.logger.info("Creating temp table")
-            exc = self.append_object(f"{target_table}_temp", schema, primary_key_list)
+            exc = self.load_table(temp_table, schema, primary_key_list, batch_size=batch_size, method=method, file_format=file_format, stage=stage, parallelism=parallelism, chunk_bytes=chunk_bytes, table_type=table_type)
             if exc:
                 raise self.snow.ProgrammingError(f'Bubbling up from append. Exception: {exc}')
 
-            if update_existing is True:
-                upsert_sql = """MERGE INTO {schema}.{target_table} as a
-                USING {schema}.{target_table}_temp as b
-                ON {primary_key_expression}
-                WHEN MATCHED THEN UPDATE SET {update_cols}
-                WHEN NOT MATCHED THEN INSERT ({insert_cols}) VALUES ({insert_vals})
-                """.format(
-                            schema = self.check_safe(schema),
-                            target_table = self.check_safe(target_table),
-                            col_string = ','.join([
-                                self.check_safe(field) for field in self.target.model_columns.keys()
-                            ]),
-                            primary_key_expression = ','.join([
-                                f"a.{self.check_safe(pk)} = b.{self.check_safe(pk)}" for pk in primary_key_list
-                            ]),
-                            update_cols = ','.join([
-                                "a.{field} = b.{field}".format(field = self.check_safe(field)) for field in self.target.model_columns if field not in primary_key_list
-                            ]),
-                            insert_cols = ",".join([
-                                self.check_reserved(field) for field in self.target.model_columns
-                            ]),
-                            insert_vals = ",".join([
-                                f'b.{self.check_reserved(field)}' for field in self.target.model_columns
-                            ])
-                        )
-            else:
-                upsert_sql = """MERGE INTO {schema}.{target_table} as a
-                USING {schema}.{target_table}_temp as b
-                ON {primary_key_expression}
-                WHEN NOT MATCHED THEN INSERT ({insert_cols}) VALUES ({insert_vals})
-                """.format(
-                            schema = self.check_safe(schema),
-                            target_table = self.check_safe(target_table),
-                            col_string = ','.join([
-                                self.check_safe(field) for field in self.target.model_columns.keys()
-                            ]),
-                            primary_key_expression = ','.join([
-                                f"a.{self.check_safe(pk)} = b.{self.check_safe(pk)}" for pk in primary_key_list
-                            ]),
-                            insert_cols = ",".join([
-                                field for field in self.target.model_columns
-                            ]),
-                            insert_vals = ",".join([
-                                f"b.{field}" for field in self.target.model_columns
-                            ])
-                        )                
+            # cached with a placeholder, since the staging table's name is new every load
+            upsert_sql = statement_cache.get(
+                ('snowflake', schema, target_table, tuple(self.target.model_columns.keys()), tuple(primary_key_list), update_existing),
+                lambda: self.build_merge_sql(target_table, schema, primary_key_list, update_existing, STAGING_TABLE)
+            ).replace(STAGING_TABLE, temp_table)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(f"Using this SQL to upsert: {upsert_sql}")
+
+            if self.batch is not None:
+                # DDL commits implicitly, so the MERGE waits for the batch's own transaction
+                self.batch.defer(upsert_sql, temp_table, schema)
+                deferred = True
+                self.logger.info("Deferred upsert to the load batch's commit.")
+                return
 
             # self.logger.info("Upserting {len}") # length of rows to upsert
-            self.cursor.execute(upsert_sql)
-            self.cxn.commit()
+            with self.phase('merge'):
+                self.cursor.execute(upsert_sql)
+            with self.phase('commit'):
+                self.cxn.commit()
+            merged = True
             self.logger.info("Committed upsert.")
         except self.snow.ProgrammingError as e:
             self.logger.exception("Something went wrong during the upsert routine.")
@@ -229,138 +326,698 @@ class Snowflake(Database):
                                 data=json.dumps(error_payload),
                                 headers={'Content-Type': 'application/json'})
             self.cxn.rollback()
+            if self.batch is not None:
+                raise
+            return e
 
         finally:
-            self.logger.info("Cleaning up temp table...")
-            self.cursor.execute(f"DROP TABLE IF EXISTS {schema}.{target_table}_temp")
-            self.cxn.commit()
+            # whatever stopped the upsert, rows that weren't merged have to be sent again next time
+            self.finish_delta(merged or deferred)
+            self.finish_resume(merged)
+            # a resumable load keeps its temp table until the merge, for the retry to load into
+            if not deferred and (journal is None or merged):
+                self.logger.info("Cleaning up temp table...")
+                self.drop_temp_table(temp_table, schema)
 
-    def append_object(self, target_table, schema, primary_key_list):
-        self.logger.info("Creating table if does not exist")
-        self.create_object(target_table, schema, primary_key_list)
+    def staging_table_type(self, parallelism=1, resumable=False):
+        '''
+        Staging tables are TEMPORARY, so Snowflake drops them with the session
+        even if this process dies before it can. Parallel loads write from
+        worker sessions and resumable loads come back in a later one, which
+        can't see another session's temporary tables; those stage into
+        TRANSIENT tables instead, which at least skip fail-safe storage.
+        '''
+        if parallelism > 1 or resumable is True:
+            return 'transient'
+        return 'temporary'
+
+    def drop_orphaned_staging_tables(self, schema, older_than_hours=24):
+        '''
+        Drop the TRANSIENT staging tables (<target>_temp_<hex> and
+        <target>_batch_<hex>) in schema that were created more than
+        older_than_hours ago, which is what a crashed parallel or resumable load
+        leaves behind. A failed resumable upsert keeps its staging table for the
+        retry on purpose, so keep older_than_hours above the longest you'd wait
+        before retrying one. Returns the names of the tables dropped.
+        '''
+        hours = int(older_than_hours)
+        self.cursor.execute(f"""SELECT table_name
+            FROM INFORMATION_SCHEMA.TABLES
+            WHERE table_schema = UPPER('{self.check_safe(schema).replace("'", "''")}')
+            AND is_transient = 'YES'
+            AND RLIKE(table_name, '.+_(TEMP|BATCH)_[0-9A-F]{{32}}', 'i')
+            AND created < DATEADD(hour, -{hours}, CURRENT_TIMESTAMP())
+            """)
+        orphans = [row[0] for row in self.cursor.fetchall()]
+        for table_name in orphans:
+            self.logger.info(f"Dropping staging table {schema}.{table_name}, left over from a load more than {hours} hours ago.")
+            self.drop_temp_table(table_name, schema)
+        return orphans
 
-        val_string = ''
+    def drop_temp_table(self, temp_table, schema):
+        self.forget_table(temp_table, schema)
+        self.cursor.execute(f"DROP TABLE IF EXISTS {schema}.{temp_table}")
+        self.cxn.commit()
 
-        chunked_data = []
-        max_chunk_size = 5000
+    def commit_batch(self, statements: list):
+        '''Snowflake has no transactional DDL, so a load batch's deferred statements get an explicit transaction.'''
+        self.cursor.execute("BEGIN")
+        for statement in statements:
+            self.cursor.execute(statement)
+        self.cxn.commit()
 
-        if len(self.target.formatted_data) > max_chunk_size:
-            for i in range(0, len(self.target.formatted_data), max_chunk_size):
-                chunked_data.append(self.target.formatted_data[i:i+max_chunk_size])
+    def build_merge_sql(self, target_table, schema, primary_key_list, update_existing=True, staging_table=None):
+        '''MERGE from staging_table (by default {target_table}_temp) into target_table on primary_key_list.'''
+        if staging_table is None:
+            staging_table = f"{target_table}_temp"
+        if update_existing is True:
+            merge_sql = """MERGE INTO {schema}.{target_table} as a
+            USING {schema}.{staging_table} as b
+            ON {primary_key_expression}
+            WHEN MATCHED THEN UPDATE SET {update_cols}
+            WHEN NOT MATCHED THEN INSERT ({insert_cols}) VALUES ({insert_vals})
+            """.format(
+                        schema = self.check_safe(schema),
+                        target_table = self.check_safe(target_table),
+                        staging_table = staging_table,
+                        col_string = ','.join([
+                            self.check_safe(field) for field in self.target.model_columns.keys()
+                        ]),
+                        primary_key_expression = ','.join([
+                            f"a.{self.check_safe(pk)} = b.{self.check_safe(pk)}" for pk in primary_key_list
+                        ]),
+                        update_cols = ','.join([
+                            "a.{field} = b.{field}".format(field = self.check_safe(field)) for field in self.target.model_columns if field not in primary_key_list
+                        ]),
+                        insert_cols = ",".join([
+                            self.check_reserved(field) for field in self.target.model_columns
+                        ]),
+                        insert_vals = ",".join([
+                            f'b.{self.check_reserved(field)}' for field in self.target.model_columns
+                        ])
+                    )
         else:
-            chunked_data = [self.target.formatted_data]
-
-        for chunk in chunked_data:
-            val_string = ''
-            for row in chunk:
-                new_row = "("
-                for col, typ in self.target.model_columns.items():
-                    safe_col = self.check_safe(row[col])
-                    # handle type idiosyncrasies
-                    if typ == 'varchar':
-                        if safe_col is None:
-                            safe_col = 'NULL'
-                        if safe_col == '':
-                            safe_col = 'NULL'
-                        if type(safe_col) == int:
-                            self.logger.warning(f"Integer {safe_col} detected in varchar column -- brute force converting to string.")
-                            safe_col = str(safe_col)
-                        if type(safe_col) != str:
-                            self.logger.exception(f"{type(safe_col)} detected in varchar column -- column name is: {col}")
-                            raise Exception(f"Type exception ({type(safe_col)}) in varchar upsert for column {col}.")
-                        else:
-                            safe_col = self.escape_varchar(safe_col)
-                            try:
-                                if safe_col[0] != "'":
-                                    safe_col = f"'{safe_col}"
-                                if safe_col[-1] != "'":
-                                    safe_col = f"{safe_col}'"
-                                if safe_col[-1] == "'" and safe_col[-2] == "\\":
-                                    safe_col = f"{safe_col}'"
-                            except Exception as e:
-                                self.logger.exception(f"Type mismtach for {col} column within {target_table} append.")
-                                return e
-
-                    # you cannot insert a python array directly into snowflake yet
-                    # this makes exclusively str arrays
-                    if typ == 'ARRAY':
-                        safe_col = self.check_safe(f"{str(row[col])}").replace("'", "\\'")
-                        if safe_col is None:
-                            safe_col = 'NULL'
-                        elif safe_col == 'None':
-                            safe_col = 'NULL'
-                        else:
-                            safe_col = f"'{safe_col}'"
-
-                    if typ == 'timestamp':
-                        if safe_col is None:
-                            safe_col = 'NULL'
-                        else:
-                            safe_col = f"'{safe_col}'"
-
-                    if typ == 'date':
-                        if safe_col is None:
-                            safe_col = 'NULL'
-                        elif safe_col == '':
-                            safe_col = 'NULL'
-                        else:
-                            safe_col = f"'{safe_col}'"
-
-                    if typ == 'int':
-                        if safe_col == '':
-                            safe_col = None
-
-                    if safe_col is None:
-                        safe_col = 'NULL'
-                    # format the insert vals statement
-                    if new_row == "(":
-                        new_row = f"{new_row}{safe_col}"
-                    else:
-                        new_row = ','.join([new_row, str(safe_col)])
-                new_row = f"{new_row})"
-                if val_string == '':
-                    val_string = new_row
-                else:
-                    val_string = ','.join([val_string, new_row])
-            # self.logger.debug(f"Values string: {val_string}")
-
-            select_str = ''
-            countah = 1
-            for typ in self.target.model_columns.values():
-                counter = f"${countah}"
-                if typ == 'ARRAY':
-                    counter = f"PARSE_JSON({counter})"
-                if typ == 'timestamp':
-                    counter = f"TO_TIMESTAMP({counter})"
-                if typ == 'date':
-                    counter = f"TO_DATE({counter})"
-                counter = f"{counter},"
-                select_str = f"{select_str}{counter}"
-                countah += 1
-            select_str = select_str[:-1]
-
-            insert_sql = """INSERT INTO {schema}.{target_table}
-            ({col_string})
-            SELECT {select_str}
-            FROM VALUES {val_string}
+            merge_sql = """MERGE INTO {schema}.{target_table} as a
+            USING {schema}.{staging_table} as b
+            ON {primary_key_expression}
+            WHEN NOT MATCHED THEN INSERT ({insert_cols}) VALUES ({insert_vals})
             """.format(
                         schema = self.check_safe(schema),
                         target_table = self.check_safe(target_table),
+                        staging_table = staging_table,
                         col_string = ','.join([
                             self.check_safe(field) for field in self.target.model_columns.keys()
                         ]),
+                        primary_key_expression = ','.join([
+                            f"a.{self.check_safe(pk)} = b.{self.check_safe(pk)}" for pk in primary_key_list
+                        ]),
+                        insert_cols = ",".join([
+                            field for field in self.target.model_columns
+                        ]),
+                        insert_vals = ",".join([
+                            f"b.{field}" for field in self.target.model_columns
+                        ])
+                    )
+        return merge_sql
+
+    def varchar_formatter(self, col, checked=False):
+        def quote_varchar(value):
+            # escaping means the value can never start with a bare quote
+            value = f"'{self.escape_varchar(value)}"
+            if value[-1] != "'":
+                value = f"{value}'"
+            if value[-2] == "\\":
+                value = f"{value}'"
+            return value
+
+        def format_checked_varchar(value):
+            # coerced already, so the value is a str or None
+            value = self.check_safe(value)
+            if value is None or value == '':
+                value = 'NULL'
+            return quote_varchar(value)
+
+        def format_varchar(value):
+            value = self.check_safe(value)
+            if value is None:
+                value = 'NULL'
+            if value == '':
+                value = 'NULL'
+            if type(value) == int:
+                self.logger.warning(f"Integer {value} detected in varchar column -- brute force converting to string.")
+                value = str(value)
+            if type(value) != str:
+                self.logger.exception(f"{type(value)} detected in varchar column -- column name is: {col}")
+                raise TypeError(f"Type exception ({type(value)}) in varchar upsert for column {col}. Load with coerce=True to check values before anything is sent.")
+            return quote_varchar(value)
+        return format_checked_varchar if checked else format_varchar
+
+    def array_formatter(self, col):
+        # you cannot insert a python array directly into snowflake yet
+        # this makes exclusively str arrays
+        def format_array(value):
+            value = self.check_safe(str(value)).replace("'", "\\'")
+            if value == 'None':
+                return 'NULL'
+            return f"'{value}'"
+        return format_array
+
+    def timestamp_formatter(self, col):
+        def format_timestamp(value):
+            value = self.check_safe(value)
+            if value is None:
+                return 'NULL'
+            return f"'{value}'"
+        return format_timestamp
+
+    def date_formatter(self, col):
+        def format_date(value):
+            value = self.check_safe(value)
+            if value is None or value == '':
+                return 'NULL'
+            return f"'{value}'"
+        return format_date
+
+    def int_formatter(self, col):
+        def format_int(value):
+            value = self.check_safe(value)
+            if value is None or value == '':
+                return 'NULL'
+            return str(value)
+        return format_int
+
+    def default_formatter(self, col):
+        def format_default(value):
+            value = self.check_safe(value)
+            if value is None:
+                return 'NULL'
+            return str(value)
+        return format_default
+
+    def compile_row_encoder(self):
+        '''
+        Build the per-column formatters and the SELECT list for the current
+        model_columns once, instead of re-checking every column's type for every
+        cell. Compiled encoders are kept per column layout.
+        '''
+        if not hasattr(self, 'row_encoders'):
+            self.row_encoders = {}
+        checked = getattr(self.target, 'staged_checked', False)
+        key = (checked, tuple(self.target.model_columns.items()))
+        if key in self.row_encoders:
+            return self.row_encoders[key]
+
+        formatter_factories = {
+            'varchar': self.varchar_formatter,
+            'ARRAY': self.array_formatter,
+            'timestamp': self.timestamp_formatter,
+            'date': self.date_formatter,
+            'int': self.int_formatter
+        }
+        formatters = []
+        select_cols = []
+        for position, (col, typ) in enumerate(self.target.model_columns.items(), start=1):
+            if typ == 'varchar':
+                formatters.append(self.varchar_formatter(col, checked))
+            else:
+                formatters.append(formatter_factories.get(typ, self.default_formatter)(col))
+            conversion = SELECT_CONVERSIONS.get(typ, None)
+            select_cols.append(f"{conversion}(${position})" if conversion else f"${position}")
+
+        self.row_encoders[key] = (formatters, ','.join(select_cols))
+        return self.row_encoders[key]
+
+    def encode_row(self, row, formatters):
+        return '(' + ','.join([formatter(value) for formatter, value in zip(formatters, row)]) + ')'
+
+    def encode_values(self, chunk, formatters):
+        '''Render a chunk of row tuples as the body of a VALUES clause in one buffer.'''
+        buffer = io.StringIO()
+        separator = ''
+        for row in chunk:
+            buffer.write(separator)
+            buffer.write(self.encode_row(row, formatters))
+            separator = ','
+        return buffer.getvalue()
+
+    def bind_converter(self, col, typ, checked=False):
+        '''
+        Bound values only need python-side cleanup; quoting and the PARSE_JSON/TO_*
+        conversions live in the statement. Empty strings bind as real NULLs.
+        '''
+        def convert_checked_varchar(value):
+            # coerced already, so the value is a str or None
+            if value == '':
+                return None
+            return value
+
+        def convert_varchar(value):
+            if value is None or value == '':
+                return None
+            if type(value) == int:
+                self.logger.warning(f"Integer {value} detected in varchar column -- brute force converting to string.")
+                return str(value)
+            if type(value) != str:
+                self.logger.exception(f"{type(value)} detected in varchar column -- column name is: {col}")
+                raise TypeError(f"Type exception ({type(value)}) in varchar upsert for column {col}. Load with coerce=True to check values before anything is sent.")
+            return value
+
+        def convert_array(value):
+            if value is None or type(value) == str:
+                return value
+            return json.dumps(list(value))
+
+        def convert_blank(value):
+            if value == '':
+                return None
+            return value
+
+        if typ == 'varchar':
+            return convert_checked_varchar if checked else convert_varchar
+        if typ == 'ARRAY':
+            return convert_array
+        if typ in ('timestamp', 'date', 'int'):
+            return convert_blank
+        return None
+
+    def compile_bind_encoder(self):
+        '''
+        Build the per-column bind converters and the VALUES placeholder list for
+        the current model_columns once. Uses the connection's paramstyle, which
+        has to be qmark or numeric (pass paramstyle in creds) for server-side binding.
+        '''
+        paramstyle = getattr(self.cxn, '_paramstyle', None) or self.snow.paramstyle
+        if paramstyle not in ('qmark', 'numeric'):
+            raise ValueError(f"Bind inserts need a qmark or numeric paramstyle connection, not {paramstyle} -- add paramstyle to creds.")
+
+        if not hasattr(self, 'bind_encoders'):
+            self.bind_encoders = {}
+        checked = getattr(self.target, 'staged_checked', False)
+        key = (paramstyle, checked, tuple(self.target.model_columns.items()))
+        if key in self.bind_encoders:
+            return self.bind_encoders[key]
+
+        converters = [self.bind_converter(col, typ, checked) for col, typ in self.target.model_columns.items()]
+        if paramstyle == 'numeric':
+            placeholders = ','.join([f":{position}" for position in range(1, len(converters) + 1)])
+        else:
+            placeholders = ','.join(['?'] * len(converters))
+
+        self.bind_encoders[key] = (converters, placeholders)
+        return self.bind_encoders[key]
+
+    def encode_bind_rows(self, chunk, converters):
+        '''Run a chunk of row tuples through the bind converters, leaving unconverted columns as they are.'''
+        if all(convert is None for convert in converters):
+            return chunk
+        return [
+            tuple([value if convert is None else convert(value) for convert, value in zip(converters, row)])
+            for row in chunk
+        ]
+
+    def csv_stage_value(self, value):
+        '''Quote everything but nulls, so EMPTY_FIELD_AS_NULL can tell an empty string from a NULL.'''
+        if value is None:
+            return ''
+        return '"' + str(value).replace('"', '""') + '"'
+
+    def write_stage_files(self, directory, file_format='csv', batch_size=5000, max_file_bytes=100 * 1024 * 1024):
+        '''
+        Write the staged rows into directory as gzipped csv or parquet parts of
+        roughly max_file_bytes each (uncompressed for csv, on disk for parquet)
+        and return their paths. Values get the same cleanup as bind inserts.
+        '''
+        if file_format not in ('csv', 'parquet'):
+            raise ValueError(f"Unknown stage file format {file_format} -- use 'csv' or 'parquet'.")
+
+        checked = getattr(self.target, 'staged_checked', False)
+        converters = [self.bind_converter(col, typ, checked) for col, typ in self.target.model_columns.items()]
+        columns = list(self.target.model_columns.keys())
+        if file_format == 'parquet':
+            pyarrow, parquet = import_parquet()
+            schema = self.parquet_schema(pyarrow)
+
+        paths = []
+        part = None
+        written = 0
+        if file_format == 'parquet':
+            record_batches = self.iter_arrow_batches(batch_size)
+            if record_batches is not None:
+                return self.write_arrow_stage_files(directory, record_batches, max_file_bytes, pyarrow, parquet)
+        for chunk in self.iter_batches(batch_size):
+            if part is None or written >= max_file_bytes:
+                if part is not None:
+                    part.close()
+                paths.append(os.path.join(directory, f"part_{len(paths):05d}.{'csv.gz' if file_format == 'csv' else 'parquet'}"))
+                part = gzip.open(paths[-1], 'wt', encoding='utf-8', newline='') if file_format == 'csv' else None
+                written = 0
+
+            with self.phase('encode'):
+                rows = self.encode_bind_rows(chunk, converters)
+                if file_format == 'csv':
+                    for row in rows:
+                        line = ','.join([self.csv_stage_value(value) for value in row]) + '\n'
+                        part.write(line)
+                        written += len(line)
+                else:
+                    table = pyarrow.Table.from_arrays([self.parquet_column(pyarrow, col, [row[i] for row in rows], schema.field(col).type) for i, col in enumerate(columns)], schema=schema)
+                    if part is None:
+                        part = parquet.ParquetWriter(paths[-1], schema)
+                    part.write_table(table)
+                    written = os.path.getsize(paths[-1])
+            self.count(rows=len(chunk))
+
+        if part is not None:
+            part.close()
+        self.logger.info(f"Wrote {len(paths)} {file_format} stage file(s).")
+        return paths
+
+    def write_arrow_stage_files(self, directory, record_batches, max_file_bytes, pyarrow, parquet):
+        '''Parquet stage files straight from Arrow-staged data, with no per-value conversion.'''
+        paths = []
+        part = None
+        for record_batch in record_batches:
+            if part is None or os.path.getsize(paths[-1]) >= max_file_bytes:
+                if part is not None:
+                    part.close()
+                paths.append(os.path.join(directory, f"part_{len(paths):05d}.parquet"))
+                part = parquet.ParquetWriter(paths[-1], record_batch.schema)
+            with self.phase('encode'):
+                table = pyarrow.Table.from_batches([record_batch])
+                if not table.schema.equals(part.schema):
+                    table = table.cast(part.schema)
+                part.write_table(table)
+            self.count(rows=record_batch.num_rows)
+        if part is not None:
+            part.close()
+        self.logger.info(f"Wrote {len(paths)} parquet stage file(s) from Arrow.")
+        return paths
+
+    def parquet_schema(self, pyarrow):
+        '''
+        Stage file schema from model_columns, so every part agrees on each
+        column's type even when a column is all null in the first chunk. Types
+        without a native parquet match go in as text, which stage_select already
+        reads as varchar before converting.
+        '''
+        return pyarrow.schema([
+            (col, getattr(pyarrow, PARQUET_TYPES.get(typ.lower().split('(')[0].strip(), 'string'))()) for col, typ in self.target.model_columns.items()
+        ])
+
+    def parquet_column(self, pyarrow, col, values, arrow_type):
+        if arrow_type == pyarrow.string():
+            return pyarrow.array([value if value is None or type(value) == str else str(value) for value in values], type=arrow_type)
+        try:
+            return pyarrow.array(values, type=arrow_type)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError) as e:
+            raise ValueError(f"Column {col} has values that don't fit its {arrow_type} parquet type: {e}") from e
+
+    def stage_select(self, file_format):
+        '''SELECT list that maps staged file columns onto the table, with the same conversions as the VALUES path.'''
+        select_cols = []
+        for position, (col, typ) in enumerate(self.target.model_columns.items(), start=1):
+            source = f"${position}" if file_format == 'csv' else f'$1:"{col}"'
+            conversion = SELECT_CONVERSIONS.get(typ, None)
+            if conversion is None:
+                select_cols.append(source)
+            elif file_format == 'csv':
+                select_cols.append(f"{conversion}({source})")
+            else:
+                select_cols.append(f"{conversion}({source}::varchar)")
+        return ','.join(select_cols)
+
+    def stage_file_append(self, target_table, schema, batch_size=5000, file_format='csv', stage='temporary', max_file_bytes=100 * 1024 * 1024):
+        '''
+        Load the staged rows through local files: write compressed parts, PUT them
+        to a temporary stage made for this load ('temporary'), the user stage
+        ('user') or a named stage, then load them all with a single COPY INTO.
+        Table stages can't be the source of a COPY that transforms columns, which
+        every load here does, so they aren't an option. Staged files are purged
+        by the COPY, or removed if the PUTs or the COPY fail; a temporary stage is
+        dropped either way, and the local files are always deleted.
+        '''
+        temporary_stage = None
+        if stage == 'temporary':
+            temporary_stage = f"{self.check_safe(schema)}.ampersand_stage_{uuid.uuid4().hex}"
+            stage_location = f"@{temporary_stage}"
+        elif stage == 'table':
+            raise ValueError("Table stages can't be the source of a transforming COPY -- use stage='temporary', 'user' or a named stage.")
+        elif stage == 'user':
+            stage_location = "@~"
+        else:
+            stage_location = f"@{self.check_safe(stage)}"
+        stage_location = f"{stage_location}/ampersand/{target_table}/{uuid.uuid4().hex}"
+
+        if file_format == 'csv':
+            file_format_sql = "TYPE = CSV COMPRESSION = GZIP FIELD_OPTIONALLY_ENCLOSED_BY = '\"' EMPTY_FIELD_AS_NULL = TRUE"
+        else:
+            file_format_sql = "TYPE = PARQUET"
+
+        if temporary_stage is not None:
+            # dropped at the end of the session at the latest, even if the DROP below never runs
+            self.cursor.execute(f"CREATE TEMPORARY STAGE {temporary_stage}")
+        try:
+            with tempfile.TemporaryDirectory(prefix='ampersand_stage_') as directory:
+                paths = self.write_stage_files(directory, file_format, batch_size, max_file_bytes)
+                if len(paths) == 0:
+                    self.logger.info("Nothing staged; skipping PUT and COPY.")
+                    return
+
+                for path in paths:
+                    put_sql = f"PUT 'file://{path}' {stage_location} AUTO_COMPRESS = FALSE OVERWRITE = TRUE"
+                    self.logger.info(f"Uploading {os.path.basename(path)} to {stage_location}...")
+                    with self.phase('upload'):
+                        self.cursor.execute(put_sql)
+                    self.count(chunks=1, bytes=os.path.getsize(path))
+
+            copy_sql = """COPY INTO {schema}.{target_table}
+                ({col_string})
+                FROM (SELECT {select_str} FROM {stage_location})
+                FILE_FORMAT = ({file_format_sql})
+                PURGE = TRUE
+                """.format(
+                            schema = self.check_safe(schema),
+                            target_table = self.check_safe(target_table),
+                            col_string = ','.join([
+                                self.check_safe(field) for field in self.target.model_columns.keys()
+                            ]),
+                            select_str = self.stage_select(file_format),
+                            stage_location = stage_location,
+                            file_format_sql = file_format_sql
+                        )
+            self.logger.info(f"Copying {len(paths)} file(s) into {schema}.{target_table}...")
+            with self.phase('copy'):
+                self.cursor.execute(copy_sql)
+            with self.phase('commit'):
+                self.cxn.commit()
+            self.logger.info("Committed copy.")
+        except Exception:
+            if temporary_stage is None:
+                self.remove_staged(stage_location)
+            raise
+        finally:
+            if temporary_stage is not None:
+                self.drop_stage(temporary_stage)
+
+    def remove_staged(self, stage_location):
+        '''Clear a failed load's files out of the stage; a COPY that goes through purges them itself.'''
+        try:
+            self.cursor.execute(f"REMOVE {stage_location}")
+        except Exception:
+            self.logger.exception(f"Couldn't remove the files staged at {stage_location}.")
+
+    def drop_stage(self, stage_name):
+        '''Drop a load's temporary stage, along with any files still in it.'''
+        try:
+            self.cursor.execute(f"DROP STAGE IF EXISTS {stage_name}")
+        except Exception:
+            self.logger.exception(f"Couldn't drop the temporary stage {stage_name}.")
+
+    def chunk_too_large(self, exc):
+        '''
+        Whether an insert failed because of the statement's size or its number
+        of binds, so splitting the chunk could help. Data errors (a string too
+        long for its column, say) fail the same way at any size, so they don't count.
+        '''
+        message = str(exc).lower()
+        return any(hint in message for hint in CHUNK_TOO_LARGE_ERRORS)
+
+    @measured_load
+    def append_object(self, target_table, schema, primary_key_list, batch_size=5000, method='literal', file_format='csv', stage='temporary', parallelism=1, chunk_bytes=None, journal=None, load_id=None, coerce=False):
+        '''
+        Insert the staged rows batch_size at a time, committing after each batch.
+        Streamed targets are pulled one batch at a time.
+
+        method: 'literal' renders every chunk into a hand-escaped INSERT ... FROM VALUES
+        statement. 'bind' sends one fixed statement through executemany with the
+        chunk as bound parameters, so the server can reuse the parsed statement.
+        'stage' writes file_format ('csv' or 'parquet') files, PUTs them to stage
+        ('temporary', 'user' or a named stage) and loads them with one COPY INTO
+        -- the way to go past a few hundred thousand rows. See stage_file_append.
+
+        parallelism: for 'literal' and 'bind', encode and send up to this many
+        chunks at once, each on its own connection opened with the same creds.
+        Returns the exception from the earliest failed chunk, if any.
+
+        chunk_bytes: for sequential 'literal' and 'bind' sends, size chunks by
+        encoded bytes instead of rows, starting at chunk_bytes and adapting to
+        how long each chunk takes (see chunking.AdaptiveChunker, kept as
+        self.chunker). Chunks that fail for being too large are split in half
+        and retried. batch_size then only sets how many rows are pulled at a time.
+
+        Inside a load_batch the rows go to a staging table instead and are only
+        inserted into target_table when the batch commits; see batch_append.
+
+        journal, load_id: a journal.LoadJournal and a name for this load that
+        stays the same across retries. Every committed chunk is recorded, and a
+        retry of a failed load skips the chunks that already committed. Only
+        for sequential 'literal' and 'bind' sends without chunk_bytes, whose
+        chunks line up from one attempt to the next.
+
+        coerce: True to coerce the staged rows before anything is sent; see check_staged.
+        '''
+        if method not in ('literal', 'bind', 'stage'):
+            raise ValueError(f"Unknown append method {method} -- use 'literal', 'bind' or 'stage'.")
+        self.check_staged(primary_key_list, coerce=coerce, batch_size=batch_size)
+
+        options = dict(batch_size=batch_size, method=method, file_format=file_format, stage=stage, parallelism=parallelism, chunk_bytes=chunk_bytes)
+        if self.batch is not None:
+            return self.batch_append(target_table, schema, primary_key_list, **options)
+        if journal is not None:
+            self.check_resumable(method, parallelism, chunk_bytes)
+            self.stage_resume(journal, load_id, target_table, schema, batch_size)
+            exc = None
+            try:
+                exc = self.load_table(target_table, schema, primary_key_list, **options)
+            except Exception as e:
+                exc = e
+                raise
+            finally:
+                self.finish_resume(exc is None)
+            return exc
+        return self.load_table(target_table, schema, primary_key_list, **options)
+
+    def check_resumable(self, method, parallelism, chunk_bytes):
+        if method == 'stage' or parallelism > 1 or chunk_bytes is not None:
+            raise ValueError("Resumable loads need the sequential 'literal' or 'bind' method, without parallelism or chunk_bytes.")
+        if self.batch is not None:
+            raise ValueError("Resumable loads commit chunk by chunk, so they can't run inside a load batch.")
+
+    def batch_append(self, target_table, schema, primary_key_list, **options):
+        '''
+        Append inside a load batch: load a staging table now and defer the
+        INSERT ... SELECT into target_table to the batch's transaction, since
+        the DDL along the way would commit anything already sent to the target.
+        '''
+        self.create_object(target_table, schema, primary_key_list)
+        temp_table = f"{target_table}_batch_{uuid.uuid4().hex}"
+        exc = self.load_table(temp_table, schema, primary_key_list, table_type=self.staging_table_type(options['parallelism']), **options)
+        if exc:
+            self.drop_temp_table(temp_table, schema)
+            raise exc
+        col_string = ','.join([self.check_safe(field) for field in self.target.model_columns.keys()])
+        self.batch.defer(
+            f"INSERT INTO {self.check_safe(schema)}.{self.check_safe(target_table)} ({col_string}) SELECT {col_string} FROM {self.check_safe(schema)}.{temp_table}",
+            temp_table,
+            schema
+        )
+
+    def load_table(self, target_table, schema, primary_key_list, batch_size=5000, method='literal', file_format='csv', stage='temporary', parallelism=1, chunk_bytes=None, table_type=None):
+        '''Create target_table (as table_type, if given) if needed and insert the staged rows straight into it. See append_object.'''
+        self.logger.info("Creating table if does not exist")
+        self.create_object(target_table, schema, primary_key_list, table_type)
+
+        if method == 'stage':
+            try:
+                self.stage_file_append(target_table, schema, batch_size, file_format, stage)
+            except Exception as e:
+                self.logger.exception(f"Something went wrong with the stage load into {schema}.{target_table}.")
+                return e
+            return
+
+        formatters, select_str = self.compile_row_encoder()
+        col_string = ','.join([
+            self.check_safe(field) for field in self.target.model_columns.keys()
+        ])
+        insert_template = """INSERT INTO {schema}.{target_table}
+            ({col_string})
+            SELECT {select_str}
+            FROM VALUES {val_string}
+            """
+        if method == 'bind':
+            converters, placeholders = self.compile_bind_encoder()
+            bind_sql = insert_template.format(
+                        schema = self.check_safe(schema),
+                        target_table = self.check_safe(target_table),
+                        col_string = col_string,
                         select_str = select_str,
-                        val_string = val_string
+                        val_string = f"({placeholders})"
                     )
-            self.logger.info(f"Inserting {len(chunk)} rows into {schema}.{target_table}...")
+
+        def send_payloads(cursor, cxn, payloads, row_count):
+            # payloads are bound row tuples for 'bind', pieces of the VALUES body for 'literal'
+            if method == 'bind':
+                insert_sql = bind_sql
+            else:
+                with self.phase('encode'):
+                    insert_sql = insert_template.format(
+                                schema = self.check_safe(schema),
+                                target_table = self.check_safe(target_table),
+                                col_string = col_string,
+                                select_str = select_str,
+                                val_string = ','.join(payloads)
+                            )
+            self.logger.info(f"Inserting {row_count} rows into {schema}.{target_table}...")
             try:
-                self.cursor.execute(insert_sql)
-                self.cxn.commit()
+                with self.phase('execute'):
+                    if method == 'bind':
+                        cursor.executemany(insert_sql, payloads)
+                    else:
+                        cursor.execute(insert_sql)
+                with self.phase('commit'):
+                    cxn.commit()
             except Exception as e:
                 self.logger.exception(f"Something went wrong with the insert. Query: {insert_sql}")
                 return e
+            if self.metrics is not None:
+                # bound parameters are counted by their string length, a rough stand-in for the wire size
+                sent_bytes = sum([len(str(value)) for row in payloads for value in row]) if method == 'bind' else len(insert_sql)
+                self.count(rows=row_count, chunks=1, bytes=sent_bytes)
             self.logger.info("Committed insert.")
 
+        def send_chunk(cursor, cxn, chunk):
+            with self.phase('encode'):
+                if method == 'bind':
+                    payloads = self.encode_bind_rows(chunk, converters)
+                else:
+                    payloads = [self.encode_values(chunk, formatters)]
+            return send_payloads(cursor, cxn, payloads, len(chunk))
+
+        def encode_sized(chunk):
+            with self.phase('encode'):
+                if method == 'bind':
+                    return [(row, sum([len(str(value)) for value in row]) + len(row)) for row in self.encode_bind_rows(chunk, converters)]
+                return [(encoded, len(encoded) + 1) for encoded in [self.encode_row(row, formatters) for row in chunk]]
+
+        if parallelism > 1:
+            return self.parallel_send(send_chunk, self.iter_batches(batch_size), parallelism)
+
+        if chunk_bytes is not None:
+            self.chunker = AdaptiveChunker(target_bytes=chunk_bytes, max_bytes=max(chunk_bytes, MAX_BYTES))
+            return self.adaptive_send(
+                self.chunker,
+                self.iter_batches(batch_size),
+                encode_sized,
+                lambda payloads: send_payloads(self.cursor, self.cxn, payloads, len(payloads)),
+                self.chunk_too_large
+            )
+
+        for chunk in self.iter_batches(batch_size):
+            exc = send_chunk(self.cursor, self.cxn, chunk)
+            if exc:
+                return exc
+            self.checkpoint()
+
     def recreate_object(self, target_table, schema, primary_key_list):
         '''Convenience wrapper for drop and create methods.'''
         self.drop_object(target_table, schema)
@@ -0,0 +1,69 @@
+'''
+Synthetic targets for the benchmarks: reproducible rows of a given size and
+width, as a list of dicts, a dataframe or a stream. Columns cycle through the
+types every connector can load (int, varchar, float, timestamp, date), with an
+'id' primary key first and a few nulls, empty strings and quotes mixed in.
+'''
+import datetime
+import random
+
+SIZES = {'small': 1000, 'medium': 20000, 'large': 200000}
+WIDTHS = {'narrow': 6, 'wide': 40}
+
+COLUMN_TYPES = ('varchar', 'int', 'float', 'timestamp', 'date')
+
+def model_columns(width):
+    columns = {'id': 'int'}
+    for i in range(1, width):
+        typ = COLUMN_TYPES[(i - 1) % len(COLUMN_TYPES)]
+        columns[f'{typ}_{i}'] = typ
+    return columns
+
+def value(typ, rng, i):
+    if rng.random() < 0.05:
+        return None
+    if typ == 'varchar':
+        return rng.choice(['', f"o'brien {i}", f'plain value {i}', f'{i} with "quotes"'])
+    if typ == 'int':
+        return rng.randrange(-10 ** 6, 10 ** 6)
+    if typ == 'float':
+        return rng.uniform(-1000, 1000)
+    if typ == 'timestamp':
+        return datetime.datetime(2025, 1, 1) + datetime.timedelta(seconds=rng.randrange(10 ** 7))
+    return datetime.date(2025, 1, 1) + datetime.timedelta(days=rng.randrange(1000))
+
+def rows(row_count, width, seed=0):
+    '''row_count dicts with model_columns(width), plus one extra column that staging trims out.'''
+    rng = random.Random(seed)
+    columns = model_columns(width)
+    data = []
+    for i in range(row_count):
+        row = {'id': i, 'untracked': 'trimmed by stage_object'}
+        for col, typ in columns.items():
+            if col != 'id':
+                row[col] = value(typ, rng, i)
+        data.append(row)
+    return data
+
+class Target(object):
+    '''What the connectors expect to be handed to stage_object.'''
+    def __init__(self, data, width):
+        self.data = data
+        self.model_columns = model_columns(width)
+        self.target_table = 'bench'
+
+def list_target(row_count, width):
+    return Target(rows(row_count, width), width)
+
+def frame_target(row_count, width):
+    import pandas
+    # object dtype keeps None as None instead of NaN, like a frame read from an API
+    return Target(pandas.DataFrame(rows(row_count, width), dtype=object), width)
+
+def arrow_target(row_count, width):
+    import pyarrow
+    return Target(pyarrow.Table.from_pylist(rows(row_count, width)), width)
+
+def stream_target(row_count, width):
+    data = rows(row_count, width)
+    return Target((row for row in data), width)
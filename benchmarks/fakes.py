@@ -0,0 +1,302 @@
+'''
+In-process stand-ins for psycopg2, snowflake.connector and google.cloud.bigquery
+that accept everything the connectors send and only record it. install() puts
+them in sys.modules -- replacing the real drivers for the rest of the process --
+so benchmarks measure the library's own client-side work, with no network and no
+accounts.
+
+The fakes do the minimum of each driver's client-side work the connectors lean
+on: execute_values still renders every row into the statement and COPY still
+reads the whole buffer, so those costs stay in the numbers.
+'''
+import datetime
+import json
+import string
+import sys
+import types
+
+class Recorder(object):
+    '''Tally of what a fake connection was sent. Only the last statement is kept.'''
+    def __init__(self):
+        self.statements = 0
+        self.bytes = 0
+        self.rows = 0
+        self.last = None
+
+    def record(self, statement, rows=0, size=None):
+        self.statements += 1
+        self.bytes += len(statement) if size is None else size
+        self.rows += rows
+        self.last = statement
+
+## psycopg2
+
+class Composable(object):
+    def __add__(self, other):
+        return Composed([self, other])
+
+class Composed(Composable):
+    def __init__(self, parts):
+        self.parts = list(parts)
+
+    def as_string(self, context=None):
+        return ''.join([part.as_string(context) for part in self.parts])
+
+    def join(self, joiner):
+        return SQL(joiner).join(self.parts)
+
+class SQL(Composable):
+    def __init__(self, text):
+        self.text = text
+
+    def as_string(self, context=None):
+        return self.text
+
+    def format(self, *args, **kwargs):
+        parts = []
+        position = 0
+        for literal, field, _, _ in string.Formatter().parse(self.text):
+            if literal:
+                parts.append(SQL(literal))
+            if field is None:
+                continue
+            if field == '':
+                parts.append(args[position])
+                position += 1
+            elif field.isdigit():
+                parts.append(args[int(field)])
+            else:
+                parts.append(kwargs[field])
+        return Composed(parts)
+
+    def join(self, parts):
+        joined = []
+        for part in parts:
+            if len(joined) > 0:
+                joined.append(self)
+            joined.append(part)
+        return Composed(joined)
+
+class Identifier(Composable):
+    def __init__(self, *names):
+        self.names = names
+
+    def as_string(self, context=None):
+        return '.'.join(['"' + name.replace('"', '""') + '"' for name in self.names])
+
+class Literal(Composable):
+    def __init__(self, value):
+        self.value = value
+
+    def as_string(self, context=None):
+        return pg_quote(self.value)
+
+class Placeholder(Composable):
+    def __init__(self, name=None):
+        self.name = name
+
+    def as_string(self, context=None):
+        return '%s' if self.name is None else f'%({self.name})s'
+
+def pg_quote(value):
+    '''Roughly what psycopg2's adapters render for a value.'''
+    if value is None:
+        return 'NULL'
+    if type(value) == bool:
+        return 'true' if value else 'false'
+    if type(value) in (int, float):
+        return repr(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return f"'{value.isoformat()}'"
+    if type(value) in (list, tuple):
+        return 'ARRAY[' + ','.join([pg_quote(item) for item in value]) + ']'
+    if type(value) == dict:
+        value = json.dumps(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def execute_values(cur, sql, argslist, template=None, page_size=100):
+    '''Render page_size rows at a time into the statement, like psycopg2.extras.execute_values.'''
+    if not isinstance(sql, str):
+        sql = sql.as_string(cur)
+    before, after = sql.split('%s', 1)
+    for start in range(0, len(argslist), page_size):
+        page = argslist[start:start + page_size]
+        values = ','.join(['(' + ','.join([pg_quote(value) for value in row]) + ')' for row in page])
+        cur.connection.recorder.record(before + values + after, rows=len(page))
+
+class PostgresCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        if not isinstance(sql, str):
+            sql = sql.as_string(self)
+        self.connection.recorder.record(sql)
+
+    def copy_expert(self, sql, file):
+        data = file.read()
+        # rows are only counted for text formats; binary COPY has no line structure
+        self.connection.recorder.record(sql, rows=data.count('\n') if isinstance(data, str) else 0, size=len(data))
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+class PostgresConnection(object):
+    def __init__(self, **creds):
+        self.creds = creds
+        self.closed = 0
+        self.recorder = Recorder()
+
+    def cursor(self, cursor_factory=None):
+        return PostgresCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+def build_psycopg2():
+    psycopg2 = types.ModuleType('psycopg2')
+    sql = types.ModuleType('psycopg2.sql')
+    for cls in (Composable, Composed, SQL, Identifier, Literal, Placeholder):
+        setattr(sql, cls.__name__, cls)
+    extras = types.ModuleType('psycopg2.extras')
+    extras.execute_values = execute_values
+    extras.DictCursor = PostgresCursor
+    psycopg2.sql = sql
+    psycopg2.extras = extras
+    psycopg2.connect = PostgresConnection
+    psycopg2.Error = Exception
+    return {'psycopg2': psycopg2, 'psycopg2.sql': sql, 'psycopg2.extras': extras}
+
+## snowflake.connector
+
+class SnowflakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        self.connection.recorder.record(sql)
+        return self
+
+    def executemany(self, sql, rows):
+        self.connection.recorder.record(sql, rows=len(rows), size=len(sql) + sum([len(str(value)) for row in rows for value in row]))
+        return self
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+class SnowflakeConnection(object):
+    def __init__(self, paramstyle='qmark', **creds):
+        self._paramstyle = paramstyle
+        self.creds = creds
+        self.closed = False
+        self.recorder = Recorder()
+
+    def cursor(self):
+        return SnowflakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def is_closed(self):
+        return self.closed
+
+def build_snowflake():
+    snowflake = types.ModuleType('snowflake')
+    connector = types.ModuleType('snowflake.connector')
+    connector.connect = SnowflakeConnection
+    connector.paramstyle = 'pyformat'
+    connector.ProgrammingError = type('ProgrammingError', (Exception,), {})
+    snowflake.connector = connector
+    return {'snowflake': snowflake, 'snowflake.connector': connector}
+
+## google.cloud.bigquery
+
+class SchemaField(object):
+    def __init__(self, name, field_type, mode='NULLABLE'):
+        self.name = name
+        self.field_type = field_type
+        self.mode = mode
+
+class Table(object):
+    def __init__(self, table_id, schema=None):
+        self.table_id = table_id
+        self.schema = schema
+        self.expires = None
+
+class LoadJobConfig(object):
+    def __init__(self, **options):
+        self.__dict__.update(options)
+
+class ParquetOptions(object):
+    def __init__(self):
+        self.enable_list_inference = None
+
+class Job(object):
+    def __init__(self, output_rows=None):
+        self.output_rows = output_rows
+
+    def result(self):
+        return self
+
+class BigQueryClient(object):
+    def __init__(self, project='benchmarks'):
+        self.project = project
+        self.recorder = Recorder()
+
+    def create_table(self, table, exists_ok=False):
+        self.recorder.record(f"CREATE {table.table_id}")
+        return table
+
+    def delete_table(self, table_id, not_found_ok=False):
+        self.recorder.record(f"DROP {table_id}")
+
+    def load_table_from_file(self, file, table_id, job_config=None):
+        data = file.read()
+        if job_config.source_format == 'NEWLINE_DELIMITED_JSON':
+            rows = data.count(b'\n')
+        else:
+            import pyarrow
+            import pyarrow.parquet
+            rows = pyarrow.parquet.ParquetFile(pyarrow.BufferReader(data)).metadata.num_rows
+        self.recorder.record(f"LOAD {table_id}", rows=rows, size=len(data))
+        return Job(rows)
+
+    def query(self, sql):
+        self.recorder.record(sql)
+        return Job()
+
+def build_bigquery():
+    google = types.ModuleType('google')
+    cloud = types.ModuleType('google.cloud')
+    bigquery = types.ModuleType('google.cloud.bigquery')
+    for cls in (SchemaField, Table, LoadJobConfig, ParquetOptions):
+        setattr(bigquery, cls.__name__, cls)
+    bigquery.Client = BigQueryClient
+    bigquery.SourceFormat = types.SimpleNamespace(NEWLINE_DELIMITED_JSON='NEWLINE_DELIMITED_JSON', PARQUET='PARQUET')
+    bigquery.WriteDisposition = types.SimpleNamespace(WRITE_APPEND='WRITE_APPEND', WRITE_TRUNCATE='WRITE_TRUNCATE')
+    google.cloud = cloud
+    cloud.bigquery = bigquery
+    return {'google': google, 'google.cloud': cloud, 'google.cloud.bigquery': bigquery}
+
+def install():
+    '''Swap the fakes in for the real drivers. Call before creating any connector.'''
+    for modules in (build_psycopg2(), build_snowflake(), build_bigquery()):
+        sys.modules.update(modules)
@@ -0,0 +1,53 @@
+'''
+Time importing the package in fresh interpreters, the way a short-lived task
+pays for it. 'eager' imports every connector module up front, which is what
+`import ampersand_datastore` used to do; the other scenarios go through the
+lazy package attributes. One JSON object per scenario, with the median of
+--runs interpreters:
+
+    python -m benchmarks.import_time --runs 20
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SCENARIOS = {
+    'package': "import ampersand_datastore",
+    'postgres': "from ampersand_datastore import Postgres",
+    'postgres_instance': "from ampersand_datastore import Postgres; Postgres()",
+    'eager': "import ampersand_datastore.postgres, ampersand_datastore.snowflake, ampersand_datastore.bigquery, ampersand_datastore.fanout, ampersand_datastore.delta, ampersand_datastore.metrics",
+}
+
+TIMER = '''
+import sys, time
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+print(elapsed, len([name for name in sys.modules]))
+'''
+
+def time_import(statement):
+    output = subprocess.run([sys.executable, '-c', TIMER.format(statement=statement)], capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), int(output[1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    args = parser.parse_args(argv)
+
+    for name in args.scenarios:
+        timings = [time_import(SCENARIOS[name]) for _ in range(args.runs)]
+        print(json.dumps({
+            'scenario': name,
+            'statement': SCENARIOS[name],
+            'median_seconds': round(statistics.median([seconds for seconds, _ in timings]), 6),
+            'min_seconds': round(min([seconds for seconds, _ in timings]), 6),
+            'modules_loaded': timings[-1][1],
+            'runs': args.runs
+        }))
+
+if __name__ == '__main__':
+    main()
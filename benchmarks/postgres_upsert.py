@@ -0,0 +1,56 @@
+'''
+Compare Postgres.upsert_object's VALUES path against COPY (csv and binary)
+on a local Postgres. Connection details come from the usual PG* environment
+variables; the benchmark table is dropped and recreated on every run.
+
+    PGPASSWORD=... python -m benchmarks.postgres_upsert 200000
+'''
+import datetime
+import os
+import sys
+import time
+
+from ampersand_datastore import Postgres
+
+creds = {
+    'dbname': os.environ.get('PGDATABASE', 'postgres'),
+    'user': os.environ.get('PGUSER', 'postgres'),
+    'password': os.environ.get('PGPASSWORD', ''),
+    'host': os.environ.get('PGHOST', 'localhost'),
+    'port': os.environ.get('PGPORT', '5432')
+}
+schema = os.environ.get('PGSCHEMA', 'public')
+table = 'ampersand_upsert_bench'
+
+class Rows(object):
+    model_columns = {'id': 'bigint', 'name': 'text', 'score': 'double precision', 'updated_at': 'timestamp'}
+
+    def __init__(self, row_count):
+        now = datetime.datetime(2025, 1, 1)
+        self.data = [
+            {'id': i, 'name': f'name {i}', 'score': i / 7, 'updated_at': now + datetime.timedelta(seconds=i)}
+            for i in range(row_count)
+        ]
+
+def run(row_count):
+    rows = Rows(row_count)
+    pg = Postgres()
+    pg.get_cursor(creds)
+    pg.stage_object(rows, table)
+    for method, copy_format in (('values', 'csv'), ('copy', 'csv'), ('copy', 'binary')):
+        pg.cursor.execute(f'DROP TABLE IF EXISTS {schema}.{table}')
+        pg.cxn.commit()
+        # the raw drop bypasses drop_object, so tell the schema cache the table is gone
+        pg.forget_table(table, schema)
+        # first pass inserts, second pass updates every row
+        for phase in ('insert', 'update'):
+            started = time.perf_counter()
+            pg.upsert_object(table, schema, ['id'], method=method, copy_format=copy_format)
+            elapsed = time.perf_counter() - started
+            label = method if method == 'values' else f'{method}/{copy_format}'
+            print(f'{label:12} {phase:7} {row_count} rows in {elapsed:.2f}s ({row_count / elapsed:,.0f} rows/s)')
+    pg.drop_object(table, schema)
+    pg.close_connection()
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,75 @@
+'''
+Compare the client-side cost of Snowflake.append_object's literal VALUES path
+against bind-parameter inserts. Runs against a stub connection that only
+records what it's sent, so no Snowflake account is needed.
+
+    python -m benchmarks.snowflake_append 100000
+'''
+import datetime
+import sys
+import time
+import types
+
+try:
+    import snowflake.connector
+except ImportError:
+    # the driver is only needed for its module-level attributes here
+    connector = types.ModuleType('snowflake.connector')
+    connector.paramstyle = 'pyformat'
+    connector.ProgrammingError = Exception
+    sys.modules['snowflake'] = types.ModuleType('snowflake')
+    sys.modules['snowflake.connector'] = connector
+    sys.modules['snowflake'].connector = connector
+
+from ampersand_datastore import Snowflake
+
+class StubCursor(object):
+    def __init__(self):
+        self.statements = 0
+        self.sql_bytes = 0
+        self.bound_rows = 0
+
+    def execute(self, sql):
+        self.statements += 1
+        self.sql_bytes += len(sql)
+
+    def executemany(self, sql, rows):
+        self.statements += 1
+        self.sql_bytes += len(sql)
+        self.bound_rows += len(rows)
+
+class StubConnection(object):
+    def __init__(self, paramstyle):
+        self._paramstyle = paramstyle
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class Rows(object):
+    def __init__(self, row_count):
+        self.model_columns = {'id': 'int', 'name': 'varchar', 'tags': 'text[]', 'updated_at': 'timestamp', 'day': 'date'}
+        now = datetime.datetime(2025, 1, 1)
+        self.data = [
+            {'id': i, 'name': f"o'name {i}", 'tags': ['a', 'b'], 'updated_at': now + datetime.timedelta(seconds=i), 'day': '2025-01-01'}
+            for i in range(row_count)
+        ]
+
+def run(row_count):
+    rows = Rows(row_count)
+    for method in ('literal', 'bind'):
+        sno = Snowflake()
+        sno.logger.disabled = True
+        sno.cxn = StubConnection('qmark')
+        sno.cursor = StubCursor()
+        sno.stage_object(rows, 'bench')
+        started = time.perf_counter()
+        sno.append_object('bench', 'bench', ['id'], method=method)
+        elapsed = time.perf_counter() - started
+        print(f'{method:8} {row_count} rows in {elapsed:.2f}s ({row_count / elapsed:,.0f} rows/s), '
+              f'{sno.cursor.statements} statements, {sno.cursor.sql_bytes:,} bytes of SQL')
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
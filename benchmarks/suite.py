@@ -0,0 +1,218 @@
+'''
+Benchmark suite over fake drivers (see benchmarks.fakes), so it runs anywhere
+and only measures this library's client-side work. Every case runs at each
+requested size and width and is reported as one JSON object per line:
+
+    {"case": ..., "size": ..., "rows": ..., "width": ..., "seconds": ...,
+     "rows_per_second": ..., "peak_bytes": ..., "version": ...}
+
+seconds is the best of --repeat timed runs. peak_bytes is the peak of new
+allocations during one more run under tracemalloc, which is kept separate
+because tracing slows everything down.
+
+    python -m benchmarks.suite --sizes small medium --widths narrow wide
+    python -m benchmarks.suite --cases 'snowflake/*' --output results.jsonl
+'''
+import argparse
+import fnmatch
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from benchmarks import fakes, datasets
+
+fakes.install()
+
+import ampersand_datastore
+from ampersand_datastore import Postgres, Snowflake, BigQuery
+from ampersand_datastore.cache import schema_cache
+
+PG_CREDS = {'dbname': 'bench', 'user': 'bench', 'password': '', 'host': 'localhost', 'port': 5432}
+SNOWFLAKE_CREDS = {'user': 'bench', 'account': 'bench', 'database': 'bench', 'warehouse': 'bench', 'paramstyle': 'qmark'}
+
+CASES = {}
+
+def case(name):
+    '''Register prepare(row_count, width), which builds everything and returns the function to time.'''
+    def register(prepare):
+        CASES[name] = prepare
+        return prepare
+    return register
+
+def connector(cls, target, columnar=False):
+    db = cls()
+    db.logger.disabled = True
+    if cls is Postgres:
+        db.get_cursor(PG_CREDS)
+    elif cls is Snowflake:
+        db.get_cursor(SNOWFLAKE_CREDS)
+    else:
+        db.open_connection()
+    db.stage_object(target, 'bench', columnar=columnar)
+    return db
+
+## staging
+
+@case('stage/dicts')
+def stage_dicts(row_count, width):
+    target = datasets.list_target(row_count, width)
+    db = Postgres()
+    db.logger.disabled = True
+    return lambda: db.stage_object(target, 'bench')
+
+@case('stage/frame')
+def stage_frame(row_count, width):
+    target = datasets.frame_target(row_count, width)
+    db = Postgres()
+    db.logger.disabled = True
+    return lambda: db.stage_object(target, 'bench')
+
+@case('stage/columnar')
+def stage_columnar(row_count, width):
+    target = datasets.frame_target(row_count, width)
+    db = Postgres()
+    db.logger.disabled = True
+    def run():
+        db.stage_object(target, 'bench', columnar=True)
+        for _ in db.iter_batches():
+            pass
+    return run
+
+@case('stage/clean')
+def stage_clean(row_count, width):
+    '''Coerce and dedupe staged rows that are already clean, the common case.'''
+    target = datasets.list_target(row_count, width)
+    db = Postgres()
+    db.logger.disabled = True
+    def run():
+        db.stage_object(target, 'bench')
+        db.clean_staged(['id'])
+    return run
+
+## encoding only
+
+@case('snowflake/encode_literal')
+def snowflake_encode_literal(row_count, width):
+    db = connector(Snowflake, datasets.list_target(row_count, width))
+    def run():
+        formatters, _ = db.compile_row_encoder()
+        for batch in db.iter_batches():
+            db.encode_values(batch, formatters)
+    return run
+
+@case('snowflake/encode_bind')
+def snowflake_encode_bind(row_count, width):
+    db = connector(Snowflake, datasets.list_target(row_count, width))
+    def run():
+        converters, _ = db.compile_bind_encoder()
+        for batch in db.iter_batches():
+            db.encode_bind_rows(batch, converters)
+    return run
+
+@case('postgres/compose')
+def postgres_compose(row_count, width):
+    '''Compose the VALUES and COPY statements from scratch once per 5000 rows, as if nothing were cached.'''
+    db = connector(Postgres, datasets.list_target(1, width))
+    def run():
+        for _ in range(max(1, row_count // 5000)):
+            db.build_upsert_sql('bench', 'bench', ['id'], db.sql.SQL("VALUES {val_string}").format(val_string = db.sql.Placeholder())).as_string(db.cursor)
+            db.compile_copy_statements('bench', 'bench', ['id'], 'csv')
+    return run
+
+## end to end through the fakes
+
+def load_case(name, cls, operation, make_target=datasets.list_target, **options):
+    @case(name)
+    def prepare(row_count, width):
+        db = connector(cls, make_target(row_count, width))
+        def run():
+            schema_cache.clear()
+            exc = getattr(db, operation)('bench', 'bench', ['id'], **options)
+            if isinstance(exc, Exception):
+                raise exc
+        return run
+    return prepare
+
+load_case('postgres/upsert_values', Postgres, 'upsert_object', method='values')
+load_case('postgres/upsert_copy_csv', Postgres, 'upsert_object', method='copy', copy_format='csv')
+load_case('postgres/upsert_copy_binary', Postgres, 'upsert_object', method='copy', copy_format='binary')
+load_case('postgres/upsert_values_sharded', Postgres, 'upsert_object', method='values', parallelism=4, page_size=500)
+load_case('snowflake/append_literal', Snowflake, 'append_object', method='literal')
+load_case('snowflake/append_bind', Snowflake, 'append_object', method='bind')
+load_case('snowflake/append_stage_csv', Snowflake, 'append_object', method='stage', file_format='csv')
+load_case('snowflake/append_stage_parquet', Snowflake, 'append_object', method='stage', file_format='parquet')
+load_case('bigquery/append_json', BigQuery, 'append_object', file_format='json')
+load_case('bigquery/append_parquet', BigQuery, 'append_object', file_format='parquet')
+load_case('arrow/postgres_upsert_copy_binary', Postgres, 'upsert_object', datasets.arrow_target, method='copy', copy_format='binary')
+load_case('arrow/snowflake_append_stage_parquet', Snowflake, 'append_object', datasets.arrow_target, method='stage', file_format='parquet')
+load_case('arrow/bigquery_append_parquet', BigQuery, 'append_object', datasets.arrow_target, file_format='parquet')
+
+def measure(prepare, row_count, width, repeat):
+    '''Best wall time over repeat runs, then the peak traced allocation of one more run.'''
+    best = None
+    for _ in range(repeat):
+        run = prepare(row_count, width)
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    run = prepare(row_count, width)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], help=f"any of {', '.join(datasets.SIZES)} or a row count")
+    parser.add_argument('--widths', nargs='+', default=['narrow'], help=f"any of {', '.join(datasets.WIDTHS)} or a column count")
+    parser.add_argument('--cases', nargs='+', default=['*'], help='glob patterns over case names')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='also append the results to this file')
+    parser.add_argument('--list', action='store_true', help='list the cases and exit')
+    args = parser.parse_args(argv)
+
+    names = [name for name in CASES if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases)]
+    if args.list:
+        print('\n'.join(names))
+        return
+
+    output = open(args.output, 'a') if args.output else None
+    try:
+        for name in names:
+            for size in args.sizes:
+                for width_name in args.widths:
+                    row_count = datasets.SIZES.get(size) or int(size)
+                    width = datasets.WIDTHS.get(width_name) or int(width_name)
+                    result = {'case': name, 'size': size, 'rows': row_count, 'width': width}
+                    try:
+                        seconds, peak = measure(CASES[name], row_count, width, args.repeat)
+                        result.update({
+                            'seconds': round(seconds, 6),
+                            'rows_per_second': round(row_count / seconds) if seconds > 0 else None,
+                            'peak_bytes': peak
+                        })
+                    except ImportError as e:
+                        # e.g. pandas or pyarrow for the frame and parquet cases
+                        result['skipped'] = str(e)
+                    result.update({'version': ampersand_datastore.__version__, 'python': platform.python_version()})
+                    line = json.dumps(result)
+                    print(line)
+                    sys.stdout.flush()
+                    if output is not None:
+                        output.write(line + '\n')
+    finally:
+        if output is not None:
+            output.close()
+
+if __name__ == '__main__':
+    main()
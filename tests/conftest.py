@@ -0,0 +1,40 @@
+'''
+The tests run against the fake drivers in benchmarks.fakes, so they need no
+database. statements records every SQL statement the fakes are sent.
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fakes
+
+fakes.install()
+
+from ampersand_datastore.cache import schema_cache, statement_cache
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    '''The schema and statement caches are process-wide; start every test cold.'''
+    schema_cache.clear()
+    statement_cache.clear()
+    yield
+
+@pytest.fixture
+def statements(monkeypatch):
+    '''Every statement sent to a fake Snowflake cursor or BigQuery client, in order.'''
+    sent = []
+    snowflake_execute = fakes.SnowflakeCursor.execute
+    def execute(cursor, sql, params=None):
+        sent.append(sql)
+        return snowflake_execute(cursor, sql, params)
+    monkeypatch.setattr(fakes.SnowflakeCursor, 'execute', execute)
+
+    bigquery_query = fakes.BigQueryClient.query
+    def query(client, sql):
+        sent.append(sql)
+        return bigquery_query(client, sql)
+    monkeypatch.setattr(fakes.BigQueryClient, 'query', query)
+    return sent
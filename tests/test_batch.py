@@ -0,0 +1,156 @@
+'''
+Load batches: several loads committed as one transaction, or rolled back
+together with their staging tables and delta hashes when any of them fails.
+'''
+import re
+
+import pytest
+
+from benchmarks import fakes, suite
+from ampersand_datastore import Postgres, Snowflake
+from ampersand_datastore.delta import RowHashIndex
+
+class Target(object):
+    def __init__(self, target_table, count=3):
+        self.data = [{'id': i, 'name': f'{target_table} {i}'} for i in range(count)]
+        self.model_columns = {'id': 'int', 'name': 'varchar'}
+        self.target_table = target_table
+
+@pytest.fixture
+def log(monkeypatch, statements):
+    '''statements, with COMMIT and ROLLBACK wherever a fake connection was asked to.'''
+    for cls in (fakes.SnowflakeConnection, fakes.PostgresConnection):
+        monkeypatch.setattr(cls, 'commit', lambda cxn: statements.append('COMMIT'))
+        monkeypatch.setattr(cls, 'rollback', lambda cxn: statements.append('ROLLBACK'))
+    execute = fakes.PostgresCursor.execute
+    def postgres_execute(cursor, sql, params=None):
+        statements.append(sql if isinstance(sql, str) else sql.as_string(cursor))
+        return execute(cursor, sql, params)
+    monkeypatch.setattr(fakes.PostgresCursor, 'execute', postgres_execute)
+    return statements
+
+@pytest.fixture
+def index(tmp_path):
+    index = RowHashIndex(str(tmp_path / 'hashes.sqlite'))
+    yield index
+    index.close()
+
+def failing(monkeypatch, pattern):
+    '''Make Snowflake statements matching pattern fail.'''
+    # the upsert's error handler reads this to decide whether to post to Slack
+    monkeypatch.setenv('SLACK_MONITOR_WEBHOOK', '')
+    execute = fakes.SnowflakeCursor.execute
+    def fail(cursor, sql, params=None):
+        result = execute(cursor, sql, params)
+        if re.search(pattern, sql):
+            raise RuntimeError('warehouse suspended')
+        return result
+    monkeypatch.setattr(fakes.SnowflakeCursor, 'execute', fail)
+
+def temp_tables(log):
+    return re.findall(r'INSERT INTO sales\.(\w+_(?:temp|batch)_[0-9a-f]{32})', '\n'.join(log))
+
+def test_snowflake_defers_target_statements_into_one_transaction(log):
+    db = suite.connector(Snowflake, Target('orders'))
+    log.clear()
+    with db.load_batch() as batch:
+        batch.upsert(Target('orders'), 'orders', 'sales', ['id'])
+        batch.append(Target('events'), 'events', 'sales', ['id'])
+    begin = log.index('BEGIN')
+    deferred = log[begin + 1:begin + 3]
+    assert deferred[0].lstrip().startswith('MERGE INTO sales.orders')
+    assert deferred[1].startswith('INSERT INTO sales.events (id,name) SELECT id,name FROM sales.events_batch_')
+    assert log[begin + 3] == 'COMMIT'
+    # nothing touched the targets before the transaction started
+    assert not any(sql.lstrip().startswith(('MERGE', 'INSERT INTO sales.orders\n', 'INSERT INTO sales.events ')) for sql in log[:begin])
+    staged = temp_tables(log[:begin])
+    assert len(staged) == 2
+    assert [sql for sql in log[begin + 4:] if sql.startswith('DROP TABLE')] == [f"DROP TABLE IF EXISTS sales.{table}" for table in staged]
+
+def test_snowflake_failing_second_operation_rolls_back_the_batch(monkeypatch, log):
+    db = suite.connector(Snowflake, Target('orders'))
+    failing(monkeypatch, r'^INSERT INTO sales\.order_lines_temp_')
+    log.clear()
+    with pytest.raises(Exception, match='warehouse suspended'):
+        with db.load_batch() as batch:
+            batch.upsert(Target('orders'), 'orders', 'sales', ['id'])
+            batch.upsert(Target('order_lines'), 'order_lines', 'sales', ['id'])
+            pytest.fail("the block should stop at the failed upsert")
+    assert 'BEGIN' not in log and not any('MERGE' in sql for sql in log)
+    assert 'ROLLBACK' in log
+    # both staging tables are dropped: the failed one by its upsert, the deferred one by the batch
+    staged = set(temp_tables(log))
+    assert len(staged) == 2
+    assert set(re.findall(r'DROP TABLE IF EXISTS sales\.(\w+)', '\n'.join(log))) == staged
+    assert db.batch is None
+
+def test_snowflake_failed_commit_rolls_back_and_drops_staging_tables(monkeypatch, log):
+    db = suite.connector(Snowflake, Target('orders'))
+    failing(monkeypatch, r'^\s*MERGE INTO')
+    log.clear()
+    with pytest.raises(RuntimeError):
+        with db.load_batch() as batch:
+            batch.upsert(Target('orders'), 'orders', 'sales', ['id'])
+    assert log.index('BEGIN') < log.index('ROLLBACK')
+    assert 'COMMIT' not in log[log.index('BEGIN'):log.index('ROLLBACK')]
+    [staged] = temp_tables(log)
+    assert log[-2:] == [f"DROP TABLE IF EXISTS sales.{staged}", 'COMMIT']
+
+def test_rollback_discards_delta_hashes(monkeypatch, log, index):
+    db = suite.connector(Snowflake, Target('orders'))
+    failing(monkeypatch, r'^INSERT INTO sales\.order_lines_temp_')
+    with pytest.raises(Exception, match='warehouse suspended'):
+        with db.load_batch() as batch:
+            batch.upsert(Target('orders'), 'orders', 'sales', ['id'], delta_index=index)
+            batch.upsert(Target('order_lines'), 'order_lines', 'sales', ['id'])
+    assert index.pending == {}
+    monkeypatch.undo()
+
+    # every row still counts as new, so the next load sends all of them
+    db = suite.connector(Snowflake, Target('orders'))
+    sent = index.counts['sent']
+    assert db.upsert_object('orders', 'sales', ['id'], delta_index=index) is None
+    assert index.counts['sent'] - sent == 3
+
+def test_commit_records_delta_hashes(log, index):
+    db = suite.connector(Snowflake, Target('orders'))
+    with db.load_batch() as batch:
+        batch.upsert(Target('orders'), 'orders', 'sales', ['id'], delta_index=index)
+    skipped = index.counts['skipped']
+    db.upsert_object('orders', 'sales', ['id'], delta_index=index)
+    assert index.counts['skipped'] - skipped == 3
+
+def test_postgres_failing_second_operation_rolls_back_the_batch(monkeypatch, log):
+    db = suite.connector(Postgres, Target('orders'))
+    execute_values = db.execute_values
+    def execute(cursor, sql, batch, page_size=100):
+        if 'order_lines' in sql:
+            raise RuntimeError('deadlock detected')
+        return execute_values(cursor, sql, batch, page_size=page_size)
+    db.execute_values = execute
+    log.clear()
+    with pytest.raises(RuntimeError):
+        with db.load_batch() as batch:
+            batch.upsert(Target('orders'), 'orders', 'sales', ['id'])
+            batch.upsert(Target('order_lines'), 'order_lines', 'sales', ['id'])
+    assert 'COMMIT' not in log and log[-1] == 'ROLLBACK'
+    # the CREATE TABLEs were rolled back too, so the schema cache mustn't remember them
+    log.clear()
+    db.upsert_object('orders', 'sales', ['id'])
+    assert any(sql.startswith('CREATE TABLE IF NOT EXISTS "sales"."orders"') for sql in log)
+
+def test_postgres_batch_commits_once(log):
+    db = suite.connector(Postgres, Target('orders'))
+    log.clear()
+    with db.load_batch() as batch:
+        batch.upsert(Target('orders'), 'orders', 'sales', ['id'])
+        batch.upsert(Target('order_lines'), 'order_lines', 'sales', ['id'], method='copy')
+    assert log.count('COMMIT') == 1 and log[-1] == 'COMMIT'
+    assert batch.operations == 2
+
+def test_batches_dont_nest(log):
+    db = suite.connector(Snowflake, Target('orders'))
+    with db.load_batch():
+        with pytest.raises(ValueError):
+            with db.load_batch():
+                pass
@@ -0,0 +1,86 @@
+'''
+The benchmark suite and its fakes: every case still runs, and the fakes still
+see every row, so a change that breaks a load path or quietly stops sending
+data can't make the numbers look better.
+'''
+import json
+import sys
+
+import pytest
+
+from benchmarks import datasets, fakes, postgres_upsert, suite
+from ampersand_datastore import BigQuery, Postgres, Snowflake
+
+ROW_COUNT = 30
+WIDTH = 7
+
+@pytest.mark.parametrize('name', list(suite.CASES))
+def test_every_case_runs(name):
+    run = suite.CASES[name](ROW_COUNT, WIDTH)
+    run()
+
+def test_main_prints_a_result_per_case(capsys, tmp_path):
+    output = tmp_path / 'results.jsonl'
+    suite.main(['--sizes', str(ROW_COUNT), '--widths', str(WIDTH), '--cases', 'stage/*', 'bigquery/*', '--repeat', '1', '--output', str(output)])
+    printed = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [result['case'] for result in printed] == [name for name in suite.CASES if name.startswith(('stage/', 'bigquery/'))]
+    for result in printed:
+        assert 'skipped' not in result
+        assert (result['rows'], result['width']) == (ROW_COUNT, WIDTH)
+        assert result['seconds'] >= 0 and result['peak_bytes'] > 0
+        assert {'version', 'python'} <= set(result)
+    assert [json.loads(line) for line in output.read_text().splitlines()] == printed
+
+def test_main_lists_cases(capsys):
+    suite.main(['--list', '--cases', 'postgres/*'])
+    assert capsys.readouterr().out.split() == [name for name in suite.CASES if name.startswith('postgres/')]
+
+def test_rows_are_reproducible():
+    assert datasets.rows(ROW_COUNT, WIDTH) == datasets.rows(ROW_COUNT, WIDTH)
+    assert datasets.rows(ROW_COUNT, WIDTH) != datasets.rows(ROW_COUNT, WIDTH, seed=1)
+    columns = datasets.model_columns(WIDTH)
+    assert len(columns) == WIDTH and list(columns)[0] == 'id'
+    assert all(set(row) == set(columns) | {'untracked'} for row in datasets.rows(ROW_COUNT, WIDTH))
+
+def recorded_rows(db, load):
+    recorder = db.cxn.recorder
+    before = recorder.rows
+    exc = load(db)
+    assert exc is None
+    return recorder.rows - before
+
+@pytest.mark.parametrize('options', [
+    {'method': 'values'},
+    {'method': 'copy', 'copy_format': 'csv'},
+])
+def test_postgres_fake_sees_every_row(options):
+    db = suite.connector(Postgres, datasets.list_target(ROW_COUNT, WIDTH))
+    assert recorded_rows(db, lambda db: db.upsert_object('bench', 'bench', ['id'], **options)) == ROW_COUNT
+
+def test_snowflake_fake_sees_every_row():
+    db = suite.connector(Snowflake, datasets.list_target(ROW_COUNT, WIDTH))
+    assert recorded_rows(db, lambda db: db.append_object('bench', 'bench', ['id'], method='bind')) == ROW_COUNT
+
+@pytest.mark.parametrize('file_format', ['json', 'parquet'])
+def test_bigquery_fake_sees_every_row(file_format):
+    db = suite.connector(BigQuery, datasets.list_target(ROW_COUNT, WIDTH))
+    assert recorded_rows(db, lambda db: db.append_object('bench', 'bench', ['id'], file_format=file_format)) == ROW_COUNT
+
+def test_install_replaces_the_drivers():
+    assert sys.modules['psycopg2'].connect is fakes.PostgresConnection
+    assert sys.modules['snowflake.connector'].connect is fakes.SnowflakeConnection
+    assert sys.modules['google.cloud.bigquery'].Client is fakes.BigQueryClient
+
+def test_postgres_upsert_benchmark_recreates_its_table(monkeypatch, capsys):
+    sent = []
+    execute = fakes.PostgresCursor.execute
+    def record(cursor, sql, params=None):
+        sent.append(sql if isinstance(sql, str) else sql.as_string(cursor))
+        return execute(cursor, sql, params)
+    monkeypatch.setattr(fakes.PostgresCursor, 'execute', record)
+    postgres_upsert.run(ROW_COUNT)
+    # one raw drop per method, each followed by a CREATE TABLE for the next pass
+    drops = [sql for sql in sent if sql.startswith('DROP TABLE IF EXISTS')]
+    creates = [sql for sql in sent if sql.startswith('CREATE TABLE')]
+    assert len(drops) == len(creates) == 3
+    assert len(capsys.readouterr().out.splitlines()) == 6
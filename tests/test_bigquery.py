@@ -0,0 +1,154 @@
+import datetime
+import decimal
+import json
+import re
+
+import pyarrow
+import pyarrow.parquet
+import pytest
+
+from benchmarks import fakes, suite
+from ampersand_datastore import BigQuery
+
+class Target(object):
+    def __init__(self, data):
+        self.data = data
+        self.model_columns = {'id': 'int', 'name': 'varchar', 'amount': 'numeric', 'at': 'timestamp', 'tags': 'text[]'}
+        self.target_table = 'orders'
+
+ROWS = [
+    {'id': 1, 'name': None, 'amount': None, 'at': None, 'tags': None},
+    {'id': 2, 'name': 'b', 'amount': decimal.Decimal('2.50'), 'at': datetime.datetime(2025, 1, 2, 3, 4, 5), 'tags': ['x', 'y']},
+    {'id': 3, 'name': 'c', 'amount': 3, 'at': None, 'tags': []},
+]
+
+@pytest.fixture
+def calls(monkeypatch, statements):
+    '''What the fake client was asked to do: ('create' | 'drop', table id) and ('load', table id, format, file bytes).'''
+    made = []
+    create_table = fakes.BigQueryClient.create_table
+    def create(client, table, exists_ok=False):
+        made.append(('create', table.table_id))
+        return create_table(client, table, exists_ok)
+    delete_table = fakes.BigQueryClient.delete_table
+    def delete(client, table_id, not_found_ok=False):
+        made.append(('drop', table_id))
+        return delete_table(client, table_id, not_found_ok)
+    load_table_from_file = fakes.BigQueryClient.load_table_from_file
+    def load(client, file, table_id, job_config=None):
+        data = file.read()
+        made.append(('load', table_id, job_config.source_format, data))
+        file.seek(0)
+        return load_table_from_file(client, file, table_id, job_config)
+    monkeypatch.setattr(fakes.BigQueryClient, 'create_table', create)
+    monkeypatch.setattr(fakes.BigQueryClient, 'delete_table', delete)
+    monkeypatch.setattr(fakes.BigQueryClient, 'load_table_from_file', load)
+    return made
+
+def connect(rows=ROWS):
+    return suite.connector(BigQuery, Target(rows))
+
+def loads(calls):
+    return [call for call in calls if call[0] == 'load']
+
+def test_append_creates_table_and_loads_json(calls):
+    db = connect()
+    db.append_object('orders', 'sales', ['id'], batch_size=2)
+    assert calls[0] == ('create', 'benchmarks.sales.orders')
+    [(_, table_id, source_format, data)] = loads(calls)
+    assert (table_id, source_format) == ('benchmarks.sales.orders', 'NEWLINE_DELIMITED_JSON')
+    assert [json.loads(line) for line in data.decode('utf-8').splitlines()] == [
+        {'id': 1, 'name': None, 'amount': None, 'at': None, 'tags': None},
+        {'id': 2, 'name': 'b', 'amount': '2.50', 'at': '2025-01-02T03:04:05', 'tags': ['x', 'y']},
+        {'id': 3, 'name': 'c', 'amount': 3, 'at': None, 'tags': []},
+    ]
+
+def test_json_loads_split_at_max_batch_bytes(calls):
+    db = connect()
+    db.append_object('orders', 'sales', ['id'], batch_size=1, max_batch_bytes=1)
+    assert [data.count(b'\n') for _, _, _, data in loads(calls)] == [1, 1, 1]
+
+def test_parquet_load_is_one_file_with_a_row_group_per_batch(calls):
+    db = connect()
+    db.append_object('orders', 'sales', ['id'], batch_size=1, file_format='parquet')
+    [(_, _, source_format, data)] = loads(calls)
+    assert source_format == 'PARQUET'
+    parquet_file = pyarrow.parquet.ParquetFile(pyarrow.BufferReader(data))
+    assert parquet_file.metadata.num_row_groups == 3
+    # the first batch is all nulls outside id, and the schema still comes from the column types
+    assert parquet_file.schema_arrow == pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('name', pyarrow.string()),
+        ('amount', pyarrow.decimal128(38, 9)),
+        ('at', pyarrow.string()),
+        ('tags', pyarrow.list_(pyarrow.string())),
+    ])
+    assert parquet_file.read().to_pylist() == [
+        {'id': 1, 'name': None, 'amount': None, 'at': None, 'tags': None},
+        {'id': 2, 'name': 'b', 'amount': decimal.Decimal('2.500000000'), 'at': '2025-01-02T03:04:05', 'tags': ['x', 'y']},
+        {'id': 3, 'name': 'c', 'amount': decimal.Decimal('3.000000000'), 'at': None, 'tags': []},
+    ]
+
+def test_parquet_loads_infer_lists(monkeypatch):
+    configs = []
+    load_table_from_file = fakes.BigQueryClient.load_table_from_file
+    def load(client, file, table_id, job_config=None):
+        configs.append(job_config)
+        return load_table_from_file(client, file, table_id, job_config)
+    monkeypatch.setattr(fakes.BigQueryClient, 'load_table_from_file', load)
+    connect().append_object('orders', 'sales', ['id'], file_format='parquet')
+    connect().append_object('orders', 'sales', ['id'], file_format='json')
+    assert configs[0].parquet_options.enable_list_inference is True
+    assert not hasattr(configs[1], 'parquet_options')
+
+def test_parquet_loads_split_at_max_batch_bytes(calls):
+    db = connect()
+    db.append_object('orders', 'sales', ['id'], batch_size=1, file_format='parquet', max_batch_bytes=1)
+    assert len(loads(calls)) == 3
+
+def test_arrow_parquet_load_keeps_the_arrow_schema(calls):
+    target = Target(pyarrow.table({'id': pyarrow.array([1, 2, 3], pyarrow.int32()), 'name': ['a', 'b', None]}))
+    target.model_columns = {'id': 'int', 'name': 'varchar'}
+    db = suite.connector(BigQuery, target)
+    db.append_object('orders', 'sales', ['id'], batch_size=2, file_format='parquet')
+    [(_, _, _, data)] = loads(calls)
+    table = pyarrow.parquet.read_table(pyarrow.BufferReader(data))
+    assert table.schema.field('id').type == pyarrow.int32()
+    assert table.to_pylist() == [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': None}]
+
+def test_upsert_merges_from_a_temp_table(calls, statements):
+    db = connect()
+    db.upsert_object('orders', 'sales', ['id'])
+    temp_id = calls[1][1]
+    assert re.fullmatch(r'benchmarks\.sales\.orders_temp_[0-9a-f]{32}', temp_id)
+    assert [call[:2] for call in calls] == [
+        ('create', 'benchmarks.sales.orders'),
+        ('create', temp_id),
+        ('load', temp_id),
+        ('drop', temp_id),
+    ]
+    assert ' '.join(statements[-1].split()) == (
+        f"MERGE `benchmarks.sales.orders` AS a USING `{temp_id}` AS b ON a.`id` = b.`id` "
+        "WHEN MATCHED THEN UPDATE SET `name` = b.`name`,`amount` = b.`amount`,`at` = b.`at`,`tags` = b.`tags` "
+        "WHEN NOT MATCHED THEN INSERT (`id`,`name`,`amount`,`at`,`tags`) VALUES (b.`id`,b.`name`,b.`amount`,b.`at`,b.`tags`)"
+    )
+
+def test_upsert_without_updates_only_inserts(statements):
+    db = connect()
+    db.upsert_object('orders', 'sales', ['id'], update_existing=False)
+    assert 'WHEN MATCHED' not in statements[-1]
+
+def test_failed_merge_drops_the_temp_table(monkeypatch, calls):
+    def fail(client, sql):
+        raise RuntimeError('merge failed')
+    monkeypatch.setattr(fakes.BigQueryClient, 'query', fail)
+    db = connect()
+    with pytest.raises(RuntimeError):
+        db.upsert_object('orders', 'sales', ['id'])
+    temp_id = calls[1][1]
+    assert calls[-1] == ('drop', temp_id)
+
+def test_upsert_needs_a_primary_key(calls):
+    with pytest.raises(ValueError):
+        connect().upsert_object('orders', 'sales', [])
+    assert calls == []
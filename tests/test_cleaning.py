@@ -0,0 +1,100 @@
+'''
+Coercion and deduplication of staged rows, including the nullable pandas
+dtypes (Int64, string, boolean) whose nulls are pd.NA rather than None or NaN.
+'''
+import datetime
+import math
+
+import numpy
+import pandas
+import pytest
+
+from benchmarks import suite
+from ampersand_datastore import Snowflake
+from ampersand_datastore.cleaning import coerce_value, is_null, to_int, to_str
+
+class Target(object):
+    def __init__(self, data):
+        self.data = data
+        self.model_columns = {'id': 'int', 'name': 'varchar', 'ok': 'boolean', 'at': 'timestamp'}
+        self.target_table = 'orders'
+
+def nullable_frame():
+    return pandas.DataFrame({
+        'id': pandas.array([1, 2, 2, None], dtype='Int64'),
+        'name': pandas.array(['a', None, 'b', 'c'], dtype='string'),
+        'ok': pandas.array([True, None, False, True], dtype='boolean'),
+        'at': [pandas.Timestamp('2025-01-02'), pandas.NaT, pandas.NaT, pandas.Timestamp('2025-01-03')],
+    })
+
+@pytest.mark.parametrize('value', [None, float('nan'), numpy.nan, pandas.NA, pandas.NaT, numpy.datetime64('NaT')])
+def test_nulls(value):
+    assert is_null(value)
+    assert coerce_value(value, to_int) is None
+
+@pytest.mark.parametrize('value', [0, '', False, 0.0, [], pandas.Timestamp('2025-01-02')])
+def test_not_nulls(value):
+    assert not is_null(value)
+
+def test_numpy_scalars_are_unwrapped():
+    assert type(coerce_value(numpy.int64(5), to_int)) == int
+    assert coerce_value(numpy.int64(5), to_str) == '5'
+
+def test_bools_are_not_text():
+    with pytest.raises(TypeError):
+        to_str(True)
+
+def test_nullable_dtypes_clean_to_python_values():
+    db = suite.connector(Snowflake, Target(nullable_frame()))
+    counts = db.clean_staged(['id'])
+    assert (counts['rows'], counts['duplicates'], counts['invalid']) == (4, 1, 0)
+    rows = db.target.staged_rows.rows
+    assert rows == [
+        (1, 'a', True, datetime.datetime(2025, 1, 2)),
+        (2, 'b', False, None),
+        (None, 'c', True, datetime.datetime(2025, 1, 3)),
+    ]
+    assert [type(row[0]) for row in rows] == [int, int, type(None)]
+    assert db.target.staged_checked is True
+
+def test_nullable_dtypes_load_as_nulls(statements):
+    db = suite.connector(Snowflake, Target(nullable_frame()))
+    assert db.append_object('orders', 'sales', ['id'], coerce=True) is None
+    values = ' '.join(statements[-1].split()).split('FROM VALUES ')[1]
+    assert values == "(1,'a',True,'2025-01-02 00:00:00'),(2,'NULL',NULL,NULL),(2,'b',False,NULL),(NULL,'c',True,'2025-01-03 00:00:00')"
+    assert 'nan' not in values.lower() and '<NA>' not in values
+
+def test_coerced_varchar_skips_the_per_cell_check(statements):
+    db = suite.connector(Snowflake, Target([{'id': '1', 'name': 5}, {'id': 2.0, 'name': numpy.int64(6)}]))
+    assert db.append_object('orders', 'sales', ['id'], coerce=True) is None
+    assert ' '.join(statements[-1].split()).endswith("FROM VALUES (1,'5',NULL,NULL),(2,'6',NULL,NULL)")
+
+@pytest.mark.parametrize('operation', ['append_object', 'upsert_object'])
+@pytest.mark.parametrize('row', [{'id': 1, 'name': True}, {'id': 1.5}, {'id': 1, 'at': 'not a time'}])
+def test_invalid_values_fail_before_anything_is_sent(statements, row, operation):
+    db = suite.connector(Snowflake, Target([row]))
+    with pytest.raises(ValueError, match="Can't load"):
+        getattr(db, operation)('orders', 'sales', ['id'], coerce=True)
+    assert statements == []
+
+def test_upsert_without_a_primary_key_sends_nothing(statements):
+    db = suite.connector(Snowflake, Target([{'id': 1}]))
+    with pytest.raises(ValueError):
+        db.upsert_object('orders', 'sales', [], coerce=True)
+    assert statements == []
+
+def test_invalid_values_can_be_nulled_or_dropped():
+    rows = [{'id': 1, 'ok': 'maybe'}, {'id': 2, 'ok': 'yes'}]
+    db = suite.connector(Snowflake, Target(rows))
+    db.clean_staged(invalid='null')
+    assert [row[2] for row in db.target.staged_rows.rows] == [None, True]
+    db = suite.connector(Snowflake, Target(rows))
+    counts = db.clean_staged(invalid='drop')
+    assert counts['dropped'] == 1
+    assert [row[0] for row in db.target.staged_rows.rows] == [2]
+
+def test_nan_floats_in_frames_are_nulls():
+    frame = pandas.DataFrame({'id': [1.0, math.nan]})
+    db = suite.connector(Snowflake, Target(frame))
+    db.clean_staged()
+    assert [row[0] for row in db.target.staged_rows.rows] == [1, None]
@@ -0,0 +1,145 @@
+'''
+Resumable loads: a load that fails part way through and is retried with the
+same load_id only sends the chunks that hadn't committed.
+'''
+import re
+
+import pytest
+
+from benchmarks import fakes, suite
+from ampersand_datastore import Postgres, Snowflake
+from ampersand_datastore.journal import LoadJournal
+
+ROWS = 10
+BATCH_SIZE = 2
+
+class Target(object):
+    def __init__(self):
+        self.data = [{'id': i, 'name': f'name {i}'} for i in range(ROWS)]
+        self.model_columns = {'id': 'int', 'name': 'varchar'}
+        self.target_table = 'orders'
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = LoadJournal(str(tmp_path / 'journal.sqlite'))
+    yield journal
+    journal.close()
+
+def failing_on_call(monkeypatch, cls, method, matches, fail_on):
+    '''Make cls.method raise once, on the fail_on-th call whose first argument matches; returns what each matching call was sent.'''
+    sent = []
+    failed = []
+    original = getattr(cls, method)
+    def wrapper(self, sql, *args, **kwargs):
+        text = sql if isinstance(sql, str) else sql.as_string(self)
+        if matches(text):
+            if method == 'copy_expert':
+                payload = args[0].read()
+                args[0].seek(0)
+            else:
+                payload = text
+            sent.append(payload)
+            if len(sent) == fail_on and len(failed) == 0:
+                failed.append(payload)
+                raise RuntimeError('connection dropped')
+        return original(self, sql, *args, **kwargs)
+    monkeypatch.setattr(cls, method, wrapper)
+    return sent
+
+def ids_in(text):
+    return [int(found) for found in re.findall(r"'name (\d+)'", text)]
+
+def test_snowflake_append_resumes_after_the_failed_chunk(monkeypatch, journal):
+    sent = failing_on_call(monkeypatch, fakes.SnowflakeCursor, 'execute', lambda sql: sql.startswith('INSERT INTO'), fail_on=3)
+    db = suite.connector(Snowflake, Target())
+    exc = db.append_object('orders', 'sales', ['id'], batch_size=BATCH_SIZE, journal=journal, load_id='run-1')
+    assert isinstance(exc, Exception)
+    scope = db.journal_scope
+    assert journal.committed_chunks(scope, 'run-1') == {0, 1}
+    assert journal.committed_rows(scope, 'run-1') == 4
+
+    sent.clear()
+    db = suite.connector(Snowflake, Target())
+    assert db.append_object('orders', 'sales', ['id'], batch_size=BATCH_SIZE, journal=journal, load_id='run-1') is None
+    assert [ids_in(sql) for sql in sent] == [[4, 5], [6, 7], [8, 9]]
+    assert journal.committed_chunks(scope, 'run-1') == set()
+
+def test_postgres_values_upsert_resumes(journal):
+    pages = []
+    execute_values = fakes.execute_values
+    def execute(cursor, sql, batch, template=None, page_size=100):
+        pages.append([row[0] for row in batch])
+        if pages == [[0, 1], [2, 3], [4, 5]]:
+            raise RuntimeError('connection dropped')
+        return execute_values(cursor, sql, batch, template, page_size)
+    db = suite.connector(Postgres, Target())
+    db.execute_values = execute
+    with pytest.raises(RuntimeError):
+        db.upsert_object('orders', 'sales', ['id'], batch_size=BATCH_SIZE, journal=journal, load_id='run-1')
+    assert journal.committed_rows(db.journal_scope, 'run-1') == 4
+
+    pages.clear()
+    db = suite.connector(Postgres, Target())
+    db.execute_values = execute
+    db.upsert_object('orders', 'sales', ['id'], batch_size=BATCH_SIZE, journal=journal, load_id='run-1')
+    assert pages == [[4, 5], [6, 7], [8, 9]]
+    assert journal.committed_chunks(db.journal_scope, 'run-1') == set()
+
+def test_postgres_copy_resumes_into_its_unlogged_staging_table(monkeypatch, journal):
+    statements = failing_on_call(monkeypatch, fakes.PostgresCursor, 'execute', lambda sql: True, fail_on=None)
+    copied = failing_on_call(monkeypatch, fakes.PostgresCursor, 'copy_expert', lambda sql: True, fail_on=3)
+    db = suite.connector(Postgres, Target())
+    with pytest.raises(RuntimeError):
+        db.upsert_object('orders', 'sales', ['id'], batch_size=BATCH_SIZE, method='copy', journal=journal, load_id='run-1')
+    [create] = [sql for sql in statements if 'UNLOGGED' in sql]
+    staging_table = re.search(r'"sales"\."(orders_resume_[0-9a-f]{12})"', create).group(1)
+    assert not any(sql.startswith('INSERT INTO') for sql in statements)
+    # the staging table is left for the retry
+    assert not any(f'DROP TABLE "sales"."{staging_table}"' in sql for sql in statements)
+
+    statements.clear()
+    copied.clear()
+    db = suite.connector(Postgres, Target())
+    db.upsert_object('orders', 'sales', ['id'], batch_size=BATCH_SIZE, method='copy', journal=journal, load_id='run-1')
+    assert [[int(line.split(',')[0].strip('"')) for line in data.splitlines()] for data in copied] == [[4, 5], [6, 7], [8, 9]]
+    assert all(f'"sales"."{staging_table}"' in sql for sql in statements if 'UNLOGGED' in sql or sql.startswith('COPY'))
+    merge = [sql for sql in statements if sql.startswith('INSERT INTO')]
+    assert len(merge) == 1 and f'FROM "sales"."{staging_table}"' in merge[0]
+    assert statements[-1] == f'DROP TABLE "sales"."{staging_table}"'
+
+def test_copy_load_cant_resume_as_values(monkeypatch, journal):
+    failing_on_call(monkeypatch, fakes.PostgresCursor, 'copy_expert', lambda sql: True, fail_on=2)
+    db = suite.connector(Postgres, Target())
+    with pytest.raises(RuntimeError):
+        db.upsert_object('orders', 'sales', ['id'], batch_size=BATCH_SIZE, method='copy', journal=journal, load_id='run-1')
+    db = suite.connector(Postgres, Target())
+    with pytest.raises(ValueError, match="resume it with method='copy'"):
+        db.upsert_object('orders', 'sales', ['id'], batch_size=BATCH_SIZE, method='values', journal=journal, load_id='run-1')
+
+def test_resuming_with_another_batch_size_is_refused(monkeypatch, journal):
+    failing_on_call(monkeypatch, fakes.SnowflakeCursor, 'execute', lambda sql: sql.startswith('INSERT INTO'), fail_on=2)
+    db = suite.connector(Snowflake, Target())
+    assert isinstance(db.append_object('orders', 'sales', ['id'], batch_size=BATCH_SIZE, journal=journal, load_id='run-1'), Exception)
+    db = suite.connector(Snowflake, Target())
+    with pytest.raises(ValueError, match='batch_size 2'):
+        db.append_object('orders', 'sales', ['id'], batch_size=3, journal=journal, load_id='run-1')
+
+def test_resumable_loads_need_sequential_chunks(journal):
+    db = suite.connector(Snowflake, Target())
+    for options in ({'method': 'stage'}, {'parallelism': 2}, {'chunk_bytes': 1000}):
+        with pytest.raises(ValueError, match='Resumable loads'):
+            db.append_object('orders', 'sales', ['id'], journal=journal, load_id='run-1', **options)
+
+def test_journal_keeps_loads_apart(journal):
+    assert journal.begin('a', 'run-1', 2, 'staging') == 'staging'
+    assert journal.begin('a', 'run-1', 2, 'another') == 'staging'
+    journal.begin('b', 'run-1', 2)
+    journal.record('a', 'run-1', 0, 2)
+    journal.record('a', 'run-1', 1, 2)
+    journal.record('b', 'run-1', 0, 2)
+    assert journal.committed_chunks('a', 'run-1') == {0, 1}
+    assert journal.committed_rows('a', 'run-1') == 4
+    journal.finish('a', 'run-1')
+    assert journal.committed_chunks('a', 'run-1') == set()
+    assert journal.committed_chunks('b', 'run-1') == {0}
+    assert journal.begin('a', 'run-1', 3) is None
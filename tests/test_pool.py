@@ -0,0 +1,225 @@
+'''
+The shared connection pool: its cap and checkout timeout, idle eviction,
+pings and health checks, leak reclamation and the stats it reports.
+'''
+import gc
+import threading
+import time
+
+import pytest
+
+from benchmarks import fakes
+from ampersand_datastore import Postgres, Snowflake
+from ampersand_datastore.pool import ConnectionPool
+
+class Connection(object):
+    def __init__(self, pool=None, fail_rollback=False):
+        self.pool = pool
+        self.fail_rollback = fail_rollback
+        self.closed = False
+        self.closed_under_lock = None
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise RuntimeError('connection reset')
+
+    def close(self):
+        self.closed = True
+        if self.pool is not None:
+            # another thread can only take the lock if the pool let go of it before closing
+            took = []
+            def take():
+                took.append(self.pool.condition.acquire(timeout=1))
+                if took[0]:
+                    self.pool.condition.release()
+            thread = threading.Thread(target=take)
+            thread.start()
+            thread.join()
+            self.closed_under_lock = not took[0]
+
+KEY = ('postgres', 'creds')
+
+def connector(pool=None, **options):
+    opened = []
+    def connect():
+        cxn = Connection(pool, **options)
+        opened.append(cxn)
+        return cxn
+    return connect, opened
+
+def age(pool, seconds):
+    '''Make every idle connection look like it has sat for seconds longer.'''
+    for entries in pool.idle.values():
+        entries[:] = [(cxn, since - seconds) for cxn, since in entries]
+
+def test_idle_connections_are_reused():
+    pool = ConnectionPool()
+    connect, opened = connector()
+    first = pool.checkout(KEY, connect)
+    pool.checkin(KEY, first)
+    assert pool.checkout(KEY, connect) is first
+    assert len(opened) == 1
+    stats = pool.stats()
+    assert (stats['hits'], stats['misses'], stats['open'], stats['idle'], stats['checked_out']) == (1, 1, 1, 0, 1)
+
+def test_keys_are_separate():
+    pool = ConnectionPool()
+    connect, opened = connector()
+    pool.checkin(KEY, pool.checkout(KEY, connect))
+    pool.checkout(('postgres', 'other creds'), connect)
+    assert len(opened) == 2
+
+def test_key_hides_the_creds():
+    pool = ConnectionPool()
+    key = pool.key('postgres', {'password': 'hunter2'})
+    assert 'hunter2' not in repr(key)
+    assert key == pool.key('postgres', {'password': 'hunter2'})
+
+def test_checkout_times_out_at_max_size():
+    pool = ConnectionPool(max_size=1, checkout_timeout=0.2)
+    connect, _ = connector()
+    pool.checkout(KEY, connect)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        pool.checkout(KEY, connect)
+    assert time.monotonic() - started >= 0.2
+
+def test_checkout_waits_for_a_checkin():
+    pool = ConnectionPool(max_size=1, checkout_timeout=5)
+    connect, opened = connector()
+    first = pool.checkout(KEY, connect)
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.checkout(KEY, connect)))
+    waiter.start()
+    time.sleep(0.1)
+    assert got == []
+    pool.checkin(KEY, first)
+    waiter.join(5)
+    assert got == [first] and len(opened) == 1
+
+def test_failed_connect_frees_its_slot():
+    pool = ConnectionPool(max_size=1, checkout_timeout=0.2)
+    def fail():
+        raise ConnectionError('refused')
+    with pytest.raises(ConnectionError):
+        pool.checkout(KEY, fail)
+    connect, _ = connector()
+    pool.checkout(KEY, connect)
+    assert pool.stats()['open'] == 1
+
+def test_idle_connections_are_evicted_and_closed_outside_the_lock():
+    pool = ConnectionPool(idle_timeout=60)
+    connect, opened = connector(pool)
+    pool.checkin(KEY, pool.checkout(KEY, connect))
+    age(pool, 61)
+    second = pool.checkout(KEY, connect)
+    assert second is opened[1]
+    assert opened[0].closed and opened[0].closed_under_lock is False
+    assert pool.stats()['evictions'] == 1 and pool.stats()['open'] == 1
+
+def test_ping_only_after_ping_after():
+    pool = ConnectionPool(ping_after=30)
+    connect, _ = connector()
+    pings = []
+    def healthy(cxn, ping):
+        pings.append(ping)
+        return True
+    pool.checkin(KEY, pool.checkout(KEY, connect, healthy))
+    pool.checkin(KEY, pool.checkout(KEY, connect, healthy))
+    age(pool, 31)
+    pool.checkout(KEY, connect, healthy)
+    assert pings == [False, True]
+
+def test_unhealthy_connections_are_replaced():
+    pool = ConnectionPool(max_size=1)
+    connect, opened = connector(pool)
+    pool.checkin(KEY, pool.checkout(KEY, connect))
+    replacement = pool.checkout(KEY, connect, lambda cxn, ping: False)
+    assert replacement is opened[1]
+    assert opened[0].closed and opened[0].closed_under_lock is False
+    stats = pool.stats()
+    assert (stats['unhealthy'], stats['hits'], stats['misses'], stats['open']) == (1, 0, 2, 1)
+
+def test_connections_that_fail_to_roll_back_are_closed():
+    pool = ConnectionPool(max_size=1)
+    connect, opened = connector(pool, fail_rollback=True)
+    pool.checkin(KEY, pool.checkout(KEY, connect))
+    assert opened[0].closed and opened[0].closed_under_lock is False
+    assert pool.stats()['open'] == 0
+
+def test_discard_and_close_all():
+    pool = ConnectionPool()
+    connect, opened = connector(pool)
+    first, second, third = [pool.checkout(KEY, connect) for _ in range(3)]
+    pool.discard(KEY, first)
+    pool.checkin(KEY, second)
+    pool.close_all()
+    assert [cxn.closed for cxn in opened] == [True, True, False]
+    assert all(cxn.closed_under_lock is False for cxn in opened[:2])
+    assert pool.stats()['open'] == 1
+
+def test_leaked_connections_give_their_slot_back():
+    pool = ConnectionPool(max_size=1, checkout_timeout=5)
+    connect, opened = connector()
+    pool.checkout(KEY, connect)
+    # the borrower drops it without checking it in
+    opened.clear()
+    gc.collect()
+    cxn = pool.checkout(KEY, connect)
+    assert cxn is opened[0]
+    stats = pool.stats()
+    assert (stats['leaked'], stats['open'], stats['checked_out']) == (1, 1, 1)
+    assert len(pool.borrowed) == 1
+
+def test_a_waiting_checkout_picks_up_a_leaked_slot():
+    pool = ConnectionPool(max_size=1, checkout_timeout=5)
+    connect, opened = connector()
+    pool.checkout(KEY, connect)
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.checkout(KEY, connect)))
+    waiter.start()
+    time.sleep(0.1)
+    opened.pop(0)
+    gc.collect()
+    # nothing notifies the waiter; it has to notice on its own
+    waiter.join(3)
+    assert len(got) == 1 and pool.stats()['leaked'] == 1
+
+def test_checked_in_connections_are_not_reported_as_leaked():
+    pool = ConnectionPool()
+    connect, opened = connector()
+    pool.checkin(KEY, pool.checkout(KEY, connect))
+    pool.close_all()
+    opened.clear()
+    gc.collect()
+    pool.checkout(KEY, connect)
+    assert pool.stats()['leaked'] == 0
+
+def test_saved_seconds():
+    pool = ConnectionPool()
+    def slow_connect():
+        time.sleep(0.05)
+        return Connection()
+    cxn = pool.checkout(KEY, slow_connect)
+    pool.checkin(KEY, cxn)
+    pool.checkin(KEY, pool.checkout(KEY, slow_connect))
+    stats = pool.stats()
+    assert stats['hits'] == 1 and stats['saved_seconds'] == pytest.approx(stats['connect_seconds'])
+
+def test_connector_health_checks(monkeypatch):
+    pg = Postgres()
+    cxn = fakes.PostgresConnection()
+    assert pg.connection_healthy(cxn)
+    assert cxn.recorder.statements == 0
+    assert pg.connection_healthy(cxn, ping=True)
+    assert cxn.recorder.last == 'SELECT 1'
+    cxn.close()
+    assert not pg.connection_healthy(cxn, ping=True)
+
+    snowflake = Snowflake()
+    cxn = fakes.SnowflakeConnection()
+    def fail(cursor, sql, params=None):
+        raise RuntimeError('session expired')
+    monkeypatch.setattr(fakes.SnowflakeCursor, 'execute', fail)
+    assert snowflake.connection_healthy(cxn)
+    assert not snowflake.connection_healthy(cxn, ping=True)
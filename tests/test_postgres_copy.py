@@ -0,0 +1,117 @@
+'''
+The buffers Postgres COPY is fed, in csv and binary format, including values
+read out of dataframes (pd.Timestamp, NaT, pd.NA) and bools spelled as text.
+'''
+import datetime
+import struct
+
+import pandas
+import pytest
+
+from benchmarks import fakes, suite
+from ampersand_datastore import Postgres
+from ampersand_datastore.postgres import COPY_BINARY_HEADER, COPY_BINARY_TRAILER
+
+class Target(object):
+    def __init__(self, data, model_columns):
+        self.data = data
+        self.model_columns = model_columns
+        self.target_table = 'orders'
+
+def connect(data, model_columns):
+    return suite.connector(Postgres, Target(data, model_columns))
+
+def binary_fields(buffer):
+    '''Each row of a COPY binary stream as a list of raw fields, None for nulls.'''
+    data = buffer.getvalue()
+    assert data.startswith(COPY_BINARY_HEADER) and data.endswith(COPY_BINARY_TRAILER)
+    position = len(COPY_BINARY_HEADER)
+    rows = []
+    while position < len(data) - len(COPY_BINARY_TRAILER):
+        (count,) = struct.unpack_from('!h', data, position)
+        position += 2
+        row = []
+        for _ in range(count):
+            (length,) = struct.unpack_from('!i', data, position)
+            position += 4
+            if length == -1:
+                row.append(None)
+            else:
+                row.append(data[position:position + length])
+                position += length
+        rows.append(row)
+    return rows
+
+def frame():
+    return pandas.DataFrame({
+        'id': pandas.array([1, 2, None], dtype='Int64'),
+        'on': pandas.to_datetime(['2025-01-02', None, '2000-01-03']),
+        'at': pandas.to_datetime(['2000-01-01 00:00:01', None, '2025-01-02 03:04:05']),
+        'ok': pandas.array([True, None, False], dtype='boolean'),
+    })
+
+FRAME_COLUMNS = {'id': 'int', 'on': 'date', 'at': 'timestamp', 'ok': 'boolean'}
+
+def test_binary_frame_values():
+    db = connect(frame(), FRAME_COLUMNS)
+    [batch] = db.iter_batches(10)
+    rows = binary_fields(db.copy_binary_buffer(batch, db.binary_encoders()))
+    days = (datetime.date(2025, 1, 2) - datetime.date(2000, 1, 1)).days
+    assert rows == [
+        [struct.pack('!i', 1), struct.pack('!i', days), struct.pack('!q', 1000000), b'\x01'],
+        [struct.pack('!i', 2), None, None, None],
+        [None, struct.pack('!i', 2), rows[2][2], b'\x00'],
+    ]
+
+def test_binary_upsert_of_a_frame():
+    db = connect(frame(), FRAME_COLUMNS)
+    assert db.upsert_object('orders', 'sales', ['id'], method='copy', copy_format='binary') is None
+
+@pytest.mark.parametrize('value, expected', [
+    (True, b'\x01'), (False, b'\x00'),
+    ('false', b'\x00'), ('f', b'\x00'), ('0', b'\x00'), ('no', b'\x00'),
+    ('true', b'\x01'), ('t', b'\x01'), ('1', b'\x01'), (1, b'\x01'), (0, b'\x00'),
+])
+def test_binary_bools(value, expected):
+    db = connect([{'ok': value}], {'ok': 'boolean'})
+    [batch] = db.iter_batches(10)
+    assert binary_fields(db.copy_binary_buffer(batch, db.binary_encoders())) == [[expected]]
+
+@pytest.mark.parametrize('value', ['maybe', '', 2, 1.5])
+def test_binary_rejects_non_bools(value):
+    db = connect([{'ok': value}], {'ok': 'boolean'})
+    [batch] = db.iter_batches(10)
+    with pytest.raises(ValueError):
+        db.copy_binary_buffer(batch, db.binary_encoders())
+
+def test_csv_frame_values():
+    db = connect(frame(), {'id': 'int', 'on': 'date', 'at': 'timestamptz', 'ok': 'boolean'})
+    [batch] = db.iter_batches(10)
+    assert db.copy_csv_buffer(batch).getvalue().splitlines() == [
+        '"1","2025-01-02 00:00:00","2000-01-01T00:00:01+00:00","True"',
+        '"2",,,',
+        ',"2000-01-03 00:00:00","2025-01-02T03:04:05+00:00","False"',
+    ]
+
+def test_csv_text_bools_and_arrays():
+    rows = [
+        {'ok': 'f', 'tags': ['a', 'say "hi"', None, 'back\\slash'], 'extra': {'k': "it's"}},
+        {'ok': None, 'tags': [], 'extra': None},
+    ]
+    db = connect(rows, {'ok': 'boolean', 'tags': 'text[]', 'extra': 'jsonb'})
+    [batch] = db.iter_batches(10)
+    assert db.copy_csv_buffer(batch).getvalue().splitlines() == [
+        '"f","{""a"",""say \\""hi\\"""",NULL,""back\\\\slash""}","{""k"": ""it\'s""}"',
+        ',"{}",',
+    ]
+
+def test_binary_upsert_of_arrays_falls_back_to_csv(monkeypatch):
+    formats = []
+    copy_expert = fakes.PostgresCursor.copy_expert
+    def record(cursor, sql, file):
+        formats.append(sql.split('FORMAT ')[1].rstrip(')'))
+        return copy_expert(cursor, sql, file)
+    monkeypatch.setattr(fakes.PostgresCursor, 'copy_expert', record)
+    db = connect([{'id': 1, 'tags': ['a']}], {'id': 'int', 'tags': 'text[]'})
+    assert db.upsert_object('orders', 'sales', ['id'], method='copy', copy_format='binary') is None
+    assert formats == ['csv']
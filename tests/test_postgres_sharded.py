@@ -0,0 +1,117 @@
+'''
+Sharded Postgres upserts: every shard commits together or rolls back
+together, and a failure on either side of the queues can't hang the load.
+'''
+import threading
+
+import pytest
+
+from benchmarks import fakes, suite
+from ampersand_datastore import Postgres
+from ampersand_datastore.postgres import ShardedUpsertError, shard_of
+
+SHARDS = 4
+
+class Target(object):
+    def __init__(self, data):
+        self.data = data
+        self.model_columns = {'id': 'int', 'name': 'varchar'}
+        self.target_table = 'orders'
+
+def rows(count):
+    return [{'id': i, 'name': f'name {i}'} for i in range(count)]
+
+@pytest.fixture
+def outcomes(monkeypatch):
+    ''''commit' or 'rollback' per connection, in the order they happened.'''
+    done = []
+    lock = threading.Lock()
+    def recorder(outcome):
+        def record(cxn):
+            with lock:
+                done.append((cxn, outcome))
+        return record
+    monkeypatch.setattr(fakes.PostgresConnection, 'commit', recorder('commit'))
+    monkeypatch.setattr(fakes.PostgresConnection, 'rollback', recorder('rollback'))
+    return done
+
+def worker_outcomes(db, outcomes):
+    '''The first outcome of each worker connection, leaving out the instance's own.'''
+    first = {}
+    for cxn, outcome in outcomes:
+        if cxn is not db.cxn:
+            first.setdefault(id(cxn), outcome)
+    return sorted(first.values())
+
+def failing_on(db, ids):
+    '''Make execute_values fail for any page holding one of ids.'''
+    execute_values = db.execute_values
+    def execute(cursor, sql, batch, page_size=100):
+        if any(row[0] in ids for row in batch):
+            raise RuntimeError('constraint violated')
+        return execute_values(cursor, sql, batch, page_size=page_size)
+    db.execute_values = execute
+
+def run_with_timeout(load, seconds=10):
+    '''Run load on a thread and return what it raised, failing the test if it never finishes.'''
+    raised = []
+    def target():
+        try:
+            load()
+        except BaseException as e:
+            raised.append(e)
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), "the sharded upsert deadlocked"
+    return raised[0] if raised else None
+
+@pytest.mark.parametrize('method', ['values', 'copy'])
+def test_every_shard_commits(outcomes, method):
+    db = suite.connector(Postgres, Target(rows(100)))
+    exc = run_with_timeout(lambda: db.upsert_object('orders', 'sales', ['id'], method=method, parallelism=SHARDS, batch_size=10))
+    assert exc is None
+    assert worker_outcomes(db, outcomes) == ['commit'] * SHARDS
+
+def test_one_failing_shard_rolls_back_every_shard(outcomes):
+    db = suite.connector(Postgres, Target(rows(100)))
+    failing_on(db, {7})
+    exc = run_with_timeout(lambda: db.upsert_object('orders', 'sales', ['id'], parallelism=SHARDS, batch_size=10))
+    assert isinstance(exc, ShardedUpsertError)
+    assert list(exc.errors) == [shard_of((7,), SHARDS)]
+    assert isinstance(exc.errors[shard_of((7,), SHARDS)], RuntimeError)
+    assert worker_outcomes(db, outcomes) == ['rollback'] * SHARDS
+
+def test_every_failed_shard_is_reported(outcomes):
+    failing = {}
+    for i in range(100):
+        failing.setdefault(shard_of((i,), SHARDS), i)
+        if len(failing) == 2:
+            break
+    db = suite.connector(Postgres, Target(rows(100)))
+    failing_on(db, set(failing.values()))
+    exc = run_with_timeout(lambda: db.upsert_object('orders', 'sales', ['id'], parallelism=SHARDS, batch_size=10))
+    assert isinstance(exc, ShardedUpsertError)
+    assert sorted(exc.errors) == sorted(failing)
+    for shard in failing:
+        assert f"shard {shard}: RuntimeError" in str(exc)
+    assert worker_outcomes(db, outcomes) == ['rollback'] * SHARDS
+
+def test_a_failing_producer_rolls_back_without_deadlocking(outcomes):
+    def stream():
+        # enough rows to fill the bounded queues before the failure
+        for row in rows(200):
+            yield row
+        raise IOError('source went away')
+    db = suite.connector(Postgres, Target(stream()))
+    exc = run_with_timeout(lambda: db.upsert_object('orders', 'sales', ['id'], parallelism=SHARDS, batch_size=5))
+    assert isinstance(exc, IOError)
+    assert worker_outcomes(db, outcomes) == ['rollback'] * SHARDS
+
+def test_a_shard_failing_early_still_drains_its_queue(outcomes):
+    '''The producer keeps feeding every shard; a dead shard has to keep taking batches.'''
+    db = suite.connector(Postgres, Target(rows(400)))
+    failing_on(db, set(range(400)))
+    exc = run_with_timeout(lambda: db.upsert_object('orders', 'sales', ['id'], parallelism=SHARDS, batch_size=2))
+    assert isinstance(exc, ShardedUpsertError)
+    assert sorted(exc.errors) == list(range(SHARDS))
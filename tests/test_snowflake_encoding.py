@@ -0,0 +1,162 @@
+'''
+The compiled Snowflake VALUES encoder against the per-cell encoder it
+replaced, reproduced here from the original append_object.
+'''
+import datetime
+import random
+
+import pytest
+
+from benchmarks import suite
+from ampersand_datastore import Snowflake
+
+def old_check_safe(string):
+    if type(string) != str:
+        return string
+    string = string.replace(';', '')
+    if string in ('order', 'product_class'):
+        string = f'"{string}"'
+    return string
+
+def old_escape_varchar(string):
+    if "'" in string:
+        string = string.replace("'", "\\'")
+    return string
+
+def old_insert_sql(model_columns, chunk, schema, target_table):
+    '''The INSERT the original append_object built for one chunk of row dicts.'''
+    val_string = ''
+    for row in chunk:
+        new_row = "("
+        for col, typ in model_columns.items():
+            safe_col = old_check_safe(row.get(col))
+            if typ == 'varchar':
+                if safe_col is None:
+                    safe_col = 'NULL'
+                if safe_col == '':
+                    safe_col = 'NULL'
+                if type(safe_col) == int:
+                    safe_col = str(safe_col)
+                if type(safe_col) != str:
+                    raise Exception(f"Type exception ({type(safe_col)}) in varchar upsert for column {col}.")
+                safe_col = old_escape_varchar(safe_col)
+                if safe_col[0] != "'":
+                    safe_col = f"'{safe_col}"
+                if safe_col[-1] != "'":
+                    safe_col = f"{safe_col}'"
+                if safe_col[-1] == "'" and safe_col[-2] == "\\":
+                    safe_col = f"{safe_col}'"
+            if typ == 'ARRAY':
+                safe_col = old_check_safe(f"{str(row.get(col))}").replace("'", "\\'")
+                if safe_col is None:
+                    safe_col = 'NULL'
+                elif safe_col == 'None':
+                    safe_col = 'NULL'
+                else:
+                    safe_col = f"'{safe_col}'"
+            if typ == 'timestamp':
+                if safe_col is None:
+                    safe_col = 'NULL'
+                else:
+                    safe_col = f"'{safe_col}'"
+            if typ == 'date':
+                if safe_col is None:
+                    safe_col = 'NULL'
+                elif safe_col == '':
+                    safe_col = 'NULL'
+                else:
+                    safe_col = f"'{safe_col}'"
+            if typ == 'int':
+                if safe_col == '':
+                    safe_col = None
+            if safe_col is None:
+                safe_col = 'NULL'
+            if new_row == "(":
+                new_row = f"{new_row}{safe_col}"
+            else:
+                new_row = ','.join([new_row, str(safe_col)])
+        new_row = f"{new_row})"
+        if val_string == '':
+            val_string = new_row
+        else:
+            val_string = ','.join([val_string, new_row])
+
+    select_str = ''
+    countah = 1
+    for typ in model_columns.values():
+        counter = f"${countah}"
+        if typ == 'ARRAY':
+            counter = f"PARSE_JSON({counter})"
+        if typ == 'timestamp':
+            counter = f"TO_TIMESTAMP({counter})"
+        if typ == 'date':
+            counter = f"TO_DATE({counter})"
+        counter = f"{counter},"
+        select_str = f"{select_str}{counter}"
+        countah += 1
+    select_str = select_str[:-1]
+
+    return """INSERT INTO {schema}.{target_table}
+            ({col_string})
+            SELECT {select_str}
+            FROM VALUES {val_string}
+            """.format(
+                        schema = old_check_safe(schema),
+                        target_table = old_check_safe(target_table),
+                        col_string = ','.join([
+                            old_check_safe(field) for field in model_columns.keys()
+                        ]),
+                        select_str = select_str,
+                        val_string = val_string
+                    )
+
+MODEL_COLUMNS = {'id': 'int', 'name': 'varchar', 'tags': 'ARRAY', 'at': 'timestamp', 'on': 'date', 'score': 'float', 'extra': 'variant', 'order': 'varchar'}
+
+## candidate values per column type
+VALUES = {
+    'int': [None, '', 0, 7, -12],
+    'varchar': [None, '', 'plain', "it's", "ends with \\", "ends \\'", "'", 'a;b', 'order', 5],
+    'ARRAY': [None, [], ['a', "b'c"], [1, 2], {'k': 'v'}, 'already text'],
+    'timestamp': [None, datetime.datetime(2025, 1, 2, 3, 4, 5), datetime.datetime(2025, 1, 2, tzinfo=datetime.timezone.utc), '2025-01-02T03:04:05Z'],
+    'date': [None, '', datetime.date(2025, 1, 2), '2025-01-02'],
+    'float': [None, 1.5, -0.25, 3],
+    'variant': [None, {'nested': ["x'y", None]}, [1, {'a': 2}], 'text', 12],
+}
+
+class Target(object):
+    def __init__(self, data):
+        self.data = data
+        self.model_columns = dict(MODEL_COLUMNS)
+        self.target_table = 'orders'
+
+def random_rows(rng, count):
+    rows = []
+    for _ in range(count):
+        row = {col: rng.choice(VALUES[typ]) for col, typ in MODEL_COLUMNS.items()}
+        if rng.random() < 0.2:
+            # columns missing from a row come through as nulls
+            del row[rng.choice(list(MODEL_COLUMNS))]
+        rows.append(row)
+    return rows
+
+def new_inserts(rows, batch_size, statements):
+    db = suite.connector(Snowflake, Target(rows))
+    exc = db.append_object('orders', 'sales', ['id'], batch_size=batch_size)
+    assert exc is None
+    return [sql for sql in statements if sql.startswith('INSERT INTO')]
+
+@pytest.mark.parametrize('seed', range(25))
+def test_new_encoder_matches_the_old_one(seed, statements):
+    rng = random.Random(seed)
+    rows = random_rows(rng, rng.randint(1, 40))
+    batch_size = rng.choice([1, 3, 50])
+    expected = [old_insert_sql(MODEL_COLUMNS, rows[start:start + batch_size], 'sales', 'orders') for start in range(0, len(rows), batch_size)]
+    assert new_inserts(rows, batch_size, statements) == expected
+
+def test_both_encoders_reject_floats_in_varchar_columns():
+    rows = [{'id': 1, 'name': 1.5}]
+    with pytest.raises(Exception, match='Type exception'):
+        old_insert_sql(MODEL_COLUMNS, rows, 'sales', 'orders')
+    db = suite.connector(Snowflake, Target(rows))
+    with pytest.raises(TypeError, match='Type exception'):
+        db.append_object('orders', 'sales', ['id'])
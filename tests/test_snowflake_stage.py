@@ -0,0 +1,136 @@
+import datetime
+import gzip
+import os
+import re
+
+import pyarrow
+import pyarrow.parquet
+import pytest
+
+from benchmarks import fakes, suite
+from ampersand_datastore import Snowflake
+
+class Target(object):
+    def __init__(self, data):
+        self.data = data
+        self.model_columns = {'id': 'int', 'name': 'varchar', 'tags': 'ARRAY', 'at': 'timestamp', 'ok': 'boolean'}
+        self.target_table = 'orders'
+
+ROWS = [
+    {'id': 1, 'name': None, 'tags': None, 'at': None, 'ok': None},
+    {'id': 2, 'name': None, 'tags': None, 'at': None, 'ok': None},
+    {'id': 3, 'name': 'say "hi"', 'tags': ['a', 'b'], 'at': datetime.datetime(2025, 1, 2, 3, 4, 5), 'ok': True},
+]
+
+@pytest.fixture
+def uploads(monkeypatch, statements):
+    '''Contents of every file PUT to the stage, read while the local file still exists.'''
+    files = {}
+    execute = fakes.SnowflakeCursor.execute
+    def put(cursor, sql, params=None):
+        if sql.startswith('PUT '):
+            path = re.match(r"PUT 'file://(.+?)' ", sql).group(1)
+            with open(path, 'rb') as part:
+                files[path] = part.read()
+        return execute(cursor, sql, params)
+    monkeypatch.setattr(fakes.SnowflakeCursor, 'execute', put)
+    return files
+
+def stage_load(file_format, rows=ROWS, batch_size=2, stage='temporary'):
+    db = suite.connector(Snowflake, Target(rows))
+    return db, db.append_object('orders', 'sales', ['id'], batch_size=batch_size, method='stage', file_format=file_format, stage=stage)
+
+def test_csv_stage_sql(statements, uploads):
+    _, exc = stage_load('csv')
+    assert exc is None
+
+    stage_name = re.fullmatch(r"CREATE TEMPORARY STAGE (sales\.ampersand_stage_[0-9a-f]{32})", statements[-4]).group(1)
+    put = statements[-3]
+    assert re.fullmatch(rf"PUT 'file://.+/part_00000\.csv\.gz' @{stage_name}/ampersand/orders/[0-9a-f]{{32}} AUTO_COMPRESS = FALSE OVERWRITE = TRUE", put)
+
+    stage_location = put.split(' ')[2]
+    copy = ' '.join(statements[-2].split())
+    assert copy == (
+        f"COPY INTO sales.orders (id,name,tags,at,ok) "
+        f"FROM (SELECT $1,$2,PARSE_JSON($3),TO_TIMESTAMP($4),$5 FROM {stage_location}) "
+        "FILE_FORMAT = (TYPE = CSV COMPRESSION = GZIP FIELD_OPTIONALLY_ENCLOSED_BY = '\"' EMPTY_FIELD_AS_NULL = TRUE) "
+        "PURGE = TRUE"
+    )
+    assert statements[-1] == f"DROP STAGE IF EXISTS {stage_name}"
+
+@pytest.mark.parametrize('stage, location', [('user', '@~'), ('loads', '@loads')])
+def test_other_stages(statements, uploads, stage, location):
+    _, exc = stage_load('csv', stage=stage)
+    assert exc is None
+    assert not any(sql.startswith(('CREATE TEMPORARY STAGE', 'DROP STAGE')) for sql in statements)
+    assert statements[-1].startswith('COPY INTO')
+    assert f"FROM {location}/ampersand/orders/" in statements[-1]
+
+def test_table_stages_are_refused(statements):
+    _, exc = stage_load('csv', stage='table')
+    assert isinstance(exc, ValueError)
+    assert not any(sql.startswith('PUT ') for sql in statements)
+
+def test_csv_stage_file(uploads):
+    stage_load('csv')
+    [content] = uploads.values()
+    assert gzip.decompress(content).decode('utf-8').splitlines() == [
+        '"1",,,,',
+        '"2",,,,',
+        '"3","say ""hi""","[""a"", ""b""]","2025-01-02 03:04:05","True"',
+    ]
+
+def test_parquet_stage_sql(statements, uploads):
+    _, exc = stage_load('parquet')
+    assert exc is None
+    copy = ' '.join(statements[-2].split())
+    assert 'FROM (SELECT $1:"id",$1:"name",PARSE_JSON($1:"tags"::varchar),TO_TIMESTAMP($1:"at"::varchar),$1:"ok" FROM @sales.ampersand_stage_' in copy
+    assert copy.endswith('FILE_FORMAT = (TYPE = PARQUET) PURGE = TRUE')
+
+def test_parquet_stage_file(uploads):
+    '''The first chunk is all nulls outside id; the schema still comes from model_columns.'''
+    stage_load('parquet')
+    [content] = uploads.values()
+    table = pyarrow.parquet.read_table(pyarrow.BufferReader(content))
+    assert table.schema == pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('name', pyarrow.string()),
+        ('tags', pyarrow.string()),
+        ('at', pyarrow.string()),
+        ('ok', pyarrow.bool_()),
+    ])
+    assert table.to_pylist() == [
+        {'id': 1, 'name': None, 'tags': None, 'at': None, 'ok': None},
+        {'id': 2, 'name': None, 'tags': None, 'at': None, 'ok': None},
+        {'id': 3, 'name': 'say "hi"', 'tags': '["a", "b"]', 'at': '2025-01-02 03:04:05', 'ok': True},
+    ]
+
+def test_parquet_stage_rejects_mistyped_values():
+    db, exc = stage_load('parquet', [{'id': 'one'}])
+    assert isinstance(exc, ValueError)
+    assert 'Column id' in str(exc)
+
+@pytest.mark.parametrize('stage', ['temporary', 'user'])
+@pytest.mark.parametrize('failing', ['PUT ', 'COPY INTO'])
+def test_failed_stage_load_is_cleaned_up(monkeypatch, statements, uploads, failing, stage):
+    directories = []
+    execute = fakes.SnowflakeCursor.execute
+    def fail(cursor, sql, params=None):
+        if sql.startswith('PUT '):
+            directories.append(os.path.dirname(re.match(r"PUT 'file://(.+?)' ", sql).group(1)))
+        execute(cursor, sql, params)
+        if sql.startswith(failing):
+            raise RuntimeError('stage is unavailable')
+    monkeypatch.setattr(fakes.SnowflakeCursor, 'execute', fail)
+
+    _, exc = stage_load('csv', stage=stage)
+    assert isinstance(exc, RuntimeError)
+    stage_location = statements[[sql.startswith('PUT ') for sql in statements].index(True)].split(' ')[2]
+    if stage == 'temporary':
+        # dropping the stage takes its files with it
+        assert statements[-1] == f"DROP STAGE IF EXISTS {stage_location[1:].split('/')[0]}"
+    else:
+        assert statements[-1] == f"REMOVE {stage_location}"
+    if failing == 'PUT ':
+        assert not any(sql.startswith('COPY INTO') for sql in statements)
+    assert len(directories) > 0 and not os.path.exists(directories[0])